@@ -0,0 +1,223 @@
+import numpy as np
+import numba
+import psutil
+from numba import cuda
+from numba.cuda.random import create_xoroshiro128p_states
+from model import gpuTransforms, cpuTransforms
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+
+def gpuAvailable():
+    """True if cupy can be imported and a CUDA device exists"""
+    if cp is None:
+        return False
+    try:
+        return cuda.is_available()
+    except Exception:
+        return False
+
+
+def getBackend(backend='Auto', threadsperblock=8):
+    """Get the backend running the transforms, 'GPU' (cupy and numba.cuda), 'CPU' (numpy and numba parallel)
+    or 'Auto', choosing the GPU if available"""
+    if backend == 'Auto':
+        backend = 'GPU' if gpuAvailable() else 'CPU'
+    if backend == 'GPU':
+        if not gpuAvailable():
+            raise RuntimeError('GPU backend requested but cupy or a CUDA device is not available')
+        return GPUBackend(threadsperblock)
+    elif backend == 'CPU':
+        return CPUBackend()
+    else:
+        raise ValueError(f'Unknown backend "{backend}", should be "Auto", "GPU" or "CPU"')
+
+
+class GPUBackend:
+    """Arrays are cupy arrays and the transforms are launched as CUDA kernels with one thread per output voxel"""
+    name = 'GPU'
+
+    def __init__(self, threadsperblock=8):
+        self.xp = cp
+        self.threadsperblock = threadsperblock
+        self.mempool = cp.get_default_memory_pool()
+
+    def asnumpy(self, arr):
+        return cp.asnumpy(arr)
+
+    def synchronize(self):
+        cuda.synchronize()
+
+    def freeMemory(self):
+        self.mempool.free_all_blocks()
+
+    def getFreeMemory(self):
+        """Free device memory in bytes"""
+        return cuda.current_context().get_memory_info()[0]
+
+    def getNrScatterBuffers(self):
+        """The scatter transforms add to the sample volume with atomicAdd, no extra volumes are needed"""
+        return 0
+
+    def pinHostArray(self, arr):
+        """Copy the array into page locked host memory, which is copied to the device faster than pageable memory"""
+        arr = np.ascontiguousarray(arr)
+        mem = cp.cuda.alloc_pinned_memory(arr.nbytes)
+        pinned = np.frombuffer(mem, arr.dtype, arr.size).reshape(arr.shape)
+        pinned[...] = arr
+        return pinned
+
+    def gaussDistribTransform(self, dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x, z_halfsize,
+                              y_halfsize, x_halfsize):
+        gpuTransforms.gaussDistribTransform[self._blocks(dataStack.shape), self._threads()](
+            dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize)
+
+    def convTransform(self, dataStack, sampleVol, kernel, transformMat):
+        gpuTransforms.convTransform[self._blocks(dataStack.shape), self._threads()](
+            dataStack, sampleVol, kernel, transformMat)
+
+    def invConvTransform(self, dataStack, sampleVol, kernel, transformMat):
+        gpuTransforms.invConvTransform[self._blocks(dataStack.shape), self._threads()](
+            dataStack, sampleVol, kernel, transformMat)
+
+    def invConvTransformGather(self, dataStack, sampleVol, kernel, transformMat, invTransformMat):
+        gpuTransforms.invConvTransformGather[self._blocks(sampleVol.shape), self._threads()](
+            dataStack, sampleVol, kernel, transformMat, invTransformMat)
+
+    def NNTransform(self, dataStack, sampleVol, transformMat):
+        gpuTransforms.NNTransform[self._blocks(dataStack.shape), self._threads()](dataStack, sampleVol, transformMat)
+
+    def invNNTransform(self, dataStack, sampleVol, transformMat):
+        gpuTransforms.invNNTransform[self._blocks(dataStack.shape), self._threads()](dataStack, sampleVol, transformMat)
+
+    def convTransformBatch(self, dataStacks, sampleVols, kernel, transformMat):
+        gpuTransforms.convTransformBatch[self._batchBlocks(dataStacks.shape), self._threads()](
+            dataStacks, sampleVols, kernel, transformMat)
+
+    def invConvTransformBatch(self, dataStacks, sampleVols, kernel, transformMat):
+        gpuTransforms.invConvTransformBatch[self._batchBlocks(dataStacks.shape), self._threads()](
+            dataStacks, sampleVols, kernel, transformMat)
+
+    def invConvTransformGatherBatch(self, dataStacks, sampleVols, kernel, transformMat, invTransformMat):
+        gpuTransforms.invConvTransformGatherBatch[self._batchBlocks(sampleVols.shape), self._threads()](
+            dataStacks, sampleVols, kernel, transformMat, invTransformMat)
+
+    def NNTransformBatch(self, dataStacks, sampleVols, transformMat):
+        gpuTransforms.NNTransformBatch[self._batchBlocks(dataStacks.shape), self._threads()](
+            dataStacks, sampleVols, transformMat)
+
+    def invNNTransformBatch(self, dataStacks, sampleVols, transformMat):
+        gpuTransforms.invNNTransformBatch[self._batchBlocks(dataStacks.shape), self._threads()](
+            dataStacks, sampleVols, transformMat)
+
+    def binomialSplit(self, rawData, bin1Data, bin2Data, p, seed):
+        """Element wise, batches are split as one stack"""
+        rawData, bin1Data, bin2Data = (self._as3D(a) for a in (rawData, bin1Data, bin2Data))
+        blocks = self._blocks(rawData.shape)
+        rng_states = create_xoroshiro128p_states(self.threadsperblock**3 * int(np.prod(blocks)), seed=seed)
+        gpuTransforms.gpuBinomialSplit[blocks, self._threads()](rawData, bin1Data, bin2Data, p, rng_states)
+
+    def doGradientConsent(self, updateFactors1, updateFactors2):
+        updateFactors1, updateFactors2 = self._as3D(updateFactors1), self._as3D(updateFactors2)
+        gpuTransforms.gpuDoGradientConsent[self._blocks(updateFactors1.shape), self._threads()](
+            updateFactors1, updateFactors2)
+
+    def _as3D(self, arr):
+        """View of a batch of volumes as one stack along z"""
+        return arr.reshape((-1,) + arr.shape[-2:])
+
+    def _blocks(self, shape):
+        return tuple((s + (self.threadsperblock - 1)) // self.threadsperblock for s in shape)
+
+    def _batchBlocks(self, shape):
+        """The batch and z axes share the first grid axis"""
+        return self._blocks((shape[0] * shape[1],) + tuple(shape[2:]))
+
+    def _threads(self):
+        return (self.threadsperblock, self.threadsperblock, self.threadsperblock)
+
+
+class CPUBackend:
+    """Arrays are numpy arrays and the transforms run on all cores with numba, see cpuTransforms"""
+    name = 'CPU'
+
+    def __init__(self):
+        self.xp = np
+        print('Using CPU backend with', numba.get_num_threads(), 'threads')
+
+    def asnumpy(self, arr):
+        return np.asarray(arr)
+
+    def synchronize(self):
+        pass
+
+    def freeMemory(self):
+        pass
+
+    def getFreeMemory(self):
+        """Available system memory in bytes"""
+        return psutil.virtual_memory().available
+
+    def getNrScatterBuffers(self):
+        """The scatter transforms distribute into one copy of the sample volume per thread, see cpuTransforms"""
+        return numba.get_num_threads()
+
+    def pinHostArray(self, arr):
+        return arr
+
+    def gaussDistribTransform(self, dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x, z_halfsize,
+                              y_halfsize, x_halfsize):
+        cpuTransforms.gaussDistribTransform(dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x,
+                                            z_halfsize, y_halfsize, x_halfsize)
+
+    def convTransform(self, dataStack, sampleVol, kernel, transformMat):
+        cpuTransforms.convTransform(dataStack, sampleVol, kernel, transformMat)
+
+    def invConvTransform(self, dataStack, sampleVol, kernel, transformMat):
+        cpuTransforms.invConvTransform(dataStack, sampleVol, kernel, transformMat)
+
+    def invConvTransformGather(self, dataStack, sampleVol, kernel, transformMat, invTransformMat):
+        cpuTransforms.invConvTransformGather(dataStack, sampleVol, kernel, transformMat, invTransformMat)
+
+    def NNTransform(self, dataStack, sampleVol, transformMat):
+        cpuTransforms.NNTransform(dataStack, sampleVol, transformMat)
+
+    def invNNTransform(self, dataStack, sampleVol, transformMat):
+        cpuTransforms.invNNTransform(dataStack, sampleVol, transformMat)
+
+    """There is no launch overhead to save on the CPU, the batched transforms transform one volume at a time with all
+    threads"""
+    def convTransformBatch(self, dataStacks, sampleVols, kernel, transformMat):
+        for dataStack, sampleVol in zip(dataStacks, sampleVols):
+            cpuTransforms.convTransform(dataStack, sampleVol, kernel, transformMat)
+
+    def invConvTransformBatch(self, dataStacks, sampleVols, kernel, transformMat):
+        for dataStack, sampleVol in zip(dataStacks, sampleVols):
+            cpuTransforms.invConvTransform(dataStack, sampleVol, kernel, transformMat)
+
+    def invConvTransformGatherBatch(self, dataStacks, sampleVols, kernel, transformMat, invTransformMat):
+        for dataStack, sampleVol in zip(dataStacks, sampleVols):
+            cpuTransforms.invConvTransformGather(dataStack, sampleVol, kernel, transformMat, invTransformMat)
+
+    def NNTransformBatch(self, dataStacks, sampleVols, transformMat):
+        for dataStack, sampleVol in zip(dataStacks, sampleVols):
+            cpuTransforms.NNTransform(dataStack, sampleVol, transformMat)
+
+    def invNNTransformBatch(self, dataStacks, sampleVols, transformMat):
+        for dataStack, sampleVol in zip(dataStacks, sampleVols):
+            cpuTransforms.invNNTransform(dataStack, sampleVol, transformMat)
+
+    def binomialSplit(self, rawData, bin1Data, bin2Data, p, seed):
+        """Element wise, batches are split as one stack"""
+        rawData, bin1Data, bin2Data = (self._as3D(a) for a in (rawData, bin1Data, bin2Data))
+        cpuTransforms.binomialSplit(rawData, bin1Data, bin2Data, p, seed)
+
+    def doGradientConsent(self, updateFactors1, updateFactors2):
+        cpuTransforms.doGradientConsent(self._as3D(updateFactors1), self._as3D(updateFactors2))
+
+    def _as3D(self, arr):
+        """View of a batch of volumes as one stack along z"""
+        return arr.reshape((-1,) + arr.shape[-2:])
@@ -3,14 +3,15 @@ import h5py
 import tifffile as tiff
 import matplotlib.pyplot as plt
 import numpy as np
-import copy
 from model.DataIO_tools import DataIO_tools
+from model import preprocessing
 import scipy.ndimage as ndi
 
 class DataFiddler:
 
     def __init__(self):
         self.dataPath = None
+        self.dataFile = None
         self.rawData = None
         self.adjustedData = None
         self.dataPropertiesDict = None
@@ -20,14 +21,15 @@ class DataFiddler:
 
         ext = os.path.splitext(path)[1]
         if ext in ['.hdf5', '.hdf']:
-            with h5py.File(path, 'r') as datafile:
-                if h5dataset is None:
-                    print('No dataset given, loading first one')
-                    h5dataset = list(datafile.keys())[0]
-                self.rawData = np.array(datafile[h5dataset][:]).astype(float)
-                datafile.close()
-
-
+            """The file is kept open and frames are only read when a timepoint is requested"""
+            self.unloadData()
+            self.dataFile = h5py.File(path, 'r')
+            if h5dataset is None:
+                print('No dataset given, loading first one')
+                h5dataset = [name for name, item in self.dataFile.items()
+                             if isinstance(item, h5py.Dataset)][0]
+            self.rawData = self.dataFile[h5dataset]
+            self.dataPath = path
 
         if dataPropertiesDict is None: #No dataPropertiesDict given
             if self.dataPropertiesDict is None: # no existing dataPropertiesDict
@@ -81,6 +83,9 @@ class DataFiddler:
 
     def unloadData(self):
         self.rawData = None
+        if self.dataFile is not None:
+            self.dataFile.close()
+            self.dataFile = None
 
     def setDataPropertiesDict(self, dataPropertiesDict):
         self.dataPropertiesDict = dataPropertiesDict
@@ -98,7 +103,6 @@ class DataFiddler:
         else:
             print('Data properties matches given parameters! (this check is/may not be complete)')
             self.dataMakesSense = True
-            self.rawData.shape = np.insert(self.getDataTimepointShape(), 0, self.getNrOfTimepoints()) #Insert nr of timepoints in front of shape
             return True
 
     def getDataTimepointShape(self):
@@ -113,87 +117,127 @@ class DataFiddler:
     def getDataPropertiesDict(self):
         return self.dataPropertiesDict
 
-    def _correctPxOffsets(self, data):
+    def getRawTimepoint(self, timepoint):
+        """Read the frames of one timepoint from the file, in the dtype of the file"""
+        framesInTimepoint = self.getDataTimepointShape()[0]
+        return self.rawData[timepoint * framesInTimepoint:(timepoint + 1) * framesInTimepoint]
+
+    def _correctPxOffsets(self, data, xp=np):
+        """Subtract the difference between each pixel and the mean of its 8 neighbours (with wrap around) in the
+        axial mean of the data"""
         print('Correcting pixel offsets')
-        axialMean = np.mean(data, 0)
-        pxOffset = copy.copy(axialMean)
-        for i in range(-1, 2):
-            for j in range(-1, 2):
-                if i == j == 0:
-                    continue
-                pxOffset -= (1 / 8) * np.roll(axialMean, (i, j))
+        axialMean = xp.mean(data, 0)
+        neighbourhoodMean = self._getNdimage(xp).uniform_filter(axialMean, size=3, mode='wrap')
+        pxOffset = (9 / 8) * (axialMean - neighbourhoodMean)
 
-        data[:] -= pxOffset
+        data -= pxOffset
 
-    def _adjustForOffset(self, data):
+    def _adjustForOffset(self, data, xp=np):
         print('Adjusting for camera offset')
-        data[:] = (data - self.dataPropertiesDict['Camera offset']).clip(0.1)
+        data -= self.dataPropertiesDict['Camera offset']
+        xp.clip(data, 0.1, None, out=data)
 
-    def _correctFirstCycle(self, data):
+    def _correctFirstCycle(self, data, xp=np):
         """This is done on non-restacked data"""
         print('Correcting first cycle')
         planesInCycle = self.dataPropertiesDict['Planes in cycle']
 
-        averageFirstCycle = np.mean(data[:planesInCycle], axis=0)
-        averageSecondCycle = np.mean(data[planesInCycle:2 * planesInCycle], axis=0)
-        averageLastCycle = np.mean(data[-planesInCycle:], axis=0)
+        averageFirstCycle = xp.mean(data[:planesInCycle], axis=0)
+        averageSecondCycle = xp.mean(data[planesInCycle:2 * planesInCycle], axis=0)
+        averageLastCycle = xp.mean(data[-planesInCycle:], axis=0)
 
         corrFac = (averageSecondCycle + averageLastCycle) / (2 * averageFirstCycle)
-        for i in range(planesInCycle):
-            data[i] *= corrFac
+        data[:planesInCycle] *= corrFac
 
-    def _restackData(self, data):
+    def _restackData(self, data, xp=np):
+        """Frames are acquired plane by plane within each cycle, reorder them to cycle by cycle within each plane.
+        Returns the restacked data as a new array."""
         print('Restacking data')
         planesInCycle = self.dataPropertiesDict['Planes in cycle']
         cycles = self.dataPropertiesDict['Cycles']
 
-        restacked = np.zeros_like(data)
-        for i in range(planesInCycle):
-            restacked[i * cycles:(i + 1) * cycles] = data[i::planesInCycle]
+        return preprocessing.restack(data, cycles, planesInCycle, parallel=True, xp=xp)
 
-        data[:] = restacked
-        del restacked
-
-    def _correctSkewedScan(self, data, pxPerCycleShift):
-        """Takes in restacked data"""
+    def _correctSkewedScan(self, data, pxPerCycleShift, xp=np):
+        """Takes in restacked data. All frames are shifted at once by multiplying with a phase ramp in Fourier space.
+        To not wrap around, the frames are padded along the shift axis, with the edge values of the far side and near
+        side in each half of the padding to avoid ringing from the jump at the edges. The rows shifted in from outside
+        the frame, with the source position outside the frame, are zeroed afterwards."""
         print('Correcting for skewed scan')
         #Below some attempt to automatically get correct axis, but not sure its relevant
         shiftAxis = 2 - self.dataPropertiesDict['Tilt axis']
-        shift = [0,0]
-        for i in range(len(data)):
-            cycleIndex = np.mod(i, self.dataPropertiesDict['Cycles'])
-            shift[shiftAxis] = cycleIndex*pxPerCycleShift
-            data[i] = ndi.shift(data[i], shift, mode='constant').clip(0) #Clipping since shift may cause small negative due to interpolation
+        cycleIndex = xp.arange(len(data)) % self.dataPropertiesDict['Cycles']
+        shifts = (cycleIndex * pxPerCycleShift).astype(data.dtype)
+
+        axis = shiftAxis + 1 #Axis in stack of frames
+        size = data.shape[axis]
+        padding = 2 * int(np.ceil(np.abs(pxPerCycleShift) * (self.dataPropertiesDict['Cycles'] - 1))) + 16
+        padded = xp.concatenate([data,
+                                 xp.repeat(xp.take(data, [-1], axis=axis), padding // 2, axis=axis),
+                                 xp.repeat(xp.take(data, [0], axis=axis), padding - padding // 2, axis=axis)],
+                                axis=axis)
+        paddedSize = size + padding
+        freqs = xp.fft.rfftfreq(paddedSize).astype(data.dtype)
+        phaseRamp = xp.exp(-2j * np.pi * shifts[:, None] * freqs[None, :])
+        rampShape = [len(data), 1, 1]
+        rampShape[axis] = len(freqs)
+        ft = xp.fft.rfft(padded, axis=axis)
+        del padded
+        ft *= phaseRamp.reshape(rampShape)
+        shifted = xp.fft.irfft(ft, n=paddedSize, axis=axis)
+        del ft
+        index = [slice(None)] * 3
+        index[axis] = slice(0, size)
+        data[:] = shifted[tuple(index)]
+        del shifted
+        sourceRows = xp.arange(size, dtype=data.dtype)[None, :] - shifts[:, None]
+        insideFrame = (sourceRows >= 0) & (sourceRows <= size - 1)
+        maskShape = [len(data), 1, 1]
+        maskShape[axis] = size
+        data *= insideFrame.reshape(maskShape)
+        xp.clip(data, 0, None, out=data) #Clipping since shift may cause small negative due to interpolation
+
+    def _getNdimage(self, xp):
+        if xp is np:
+            return ndi
+        else:
+            import cupyx.scipy.ndimage
+            return cupyx.scipy.ndimage
 
-    def getPreprocessedData(self, reconOptionsDict, timepoints=None):
+    def getPreprocessedData(self, reconOptionsDict, timepoints=None, xp=np):
         """If an array is given as timepoints parameter, this function returns the average of those timepoints
         - timpoints parameter needs to be either  "All", an np.ndarray of ints or a single int32 value
+        - xp is the array module to preprocess with, numpy or cupy, the data is returned as an array of that module
         """
         print('Type of timepoints parameter is: ', type(timepoints))
         if timepoints is None:
             if self.getNrOfTimepoints() > 1:
                 print('Must specify timepoint/s for data with more than one timepoint')
                 return False
-            self.processedData = copy.copy(self.rawData[0,:,:,:])
+            self.processedData = xp.asarray(self.getRawTimepoint(0), dtype=xp.float32)
         elif isinstance(timepoints, np.ndarray):
-            self.processedData = copy.copy(self.rawData[timepoints,:,:,:]).mean(axis=0)
-        elif isinstance(timepoints, np.int32):
-            self.processedData = copy.copy(self.rawData[timepoints,:,:,:])
+            """Average one timepoint at a time to only have one timepoint in memory"""
+            self.processedData = xp.zeros(self.getDataTimepointShape(), dtype=xp.float32)
+            for tp in timepoints:
+                self.processedData += xp.asarray(self.getRawTimepoint(tp))
+            self.processedData /= len(timepoints)
+        elif isinstance(timepoints, (int, np.integer)):
+            self.processedData = xp.asarray(self.getRawTimepoint(timepoints), dtype=xp.float32)
         else:
             print('Unknown format of timepoints parameter')
 
         if reconOptionsDict['Correct pixel offsets']:
-            self._correctPxOffsets(self.processedData)
-        self._adjustForOffset(self.processedData)
+            self._correctPxOffsets(self.processedData, xp)
+        self._adjustForOffset(self.processedData, xp)
         if reconOptionsDict['Correct first cycle']:
-            self._correctFirstCycle(self.processedData)
+            self._correctFirstCycle(self.processedData, xp)
         if self.dataPropertiesDict['Data stacking'] == 'PLSR Interleaved':
-            self._restackData(self.processedData)
+            self.processedData = self._restackData(self.processedData, xp)
         if reconOptionsDict['Skew correction pixel per cycle'] != 0:
             self._correctSkewedScan(self.processedData,
-                                    pxPerCycleShift=reconOptionsDict['Skew correction pixel per cycle'])
+                                    pxPerCycleShift=reconOptionsDict['Skew correction pixel per cycle'], xp=xp)
         if self.dataPropertiesDict['Pos/Neg scan direction'] == 'Neg':
-            return np.flip(self.processedData, self.dataPropertiesDict['Scan axis'])
+            return xp.flip(self.processedData, self.dataPropertiesDict['Scan axis'])
         else:
             return self.processedData
 
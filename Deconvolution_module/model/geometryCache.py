@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class GeometryCache:
+    """Cache of arrays that only depend on the acquisition geometry and the image formation model, eg. the PLSR kernel
+    and the normalization (H transpose of ones), such that they are calculated once for a series of data sets with the
+    same geometry. Arrays are stored under a hash of the parameters they were calculated from, in memory and, if a
+    cache folder is given, as .npy files in that folder to be reused between sessions. The arrays in memory are
+    limited to maxBytes, evicting the least recently used arrays first, evicted arrays are loaded again from the cache
+    folder when needed."""
+
+    def __init__(self, cacheFolder=None, maxBytes=2**30):
+        self.cacheFolder = cacheFolder
+        self.maxBytes = maxBytes
+        self.arrays = OrderedDict()
+        self.fileHashes = {}
+        if cacheFolder is not None:
+            os.makedirs(cacheFolder, exist_ok=True)
+
+    def getOrCompute(self, name, parameters, computeFunction):
+        """Get the array calculated from the parameters, or calculate it with computeFunction and store it"""
+        key = self.makeKey(name, parameters)
+        array = self.get(key)
+        if array is None:
+            array = np.asarray(computeFunction())
+            self.put(key, array)
+        else:
+            print('Using cached ', name)
+        return array
+
+    def makeKey(self, name, parameters):
+        """Parameters can be nested dicts and lists of numbers and strings, and numpy arrays, which are hashed by
+        their content"""
+        parameterString = json.dumps(parameters, sort_keys=True, default=self._toJSON)
+        return name + '_' + hashlib.sha1(parameterString.encode()).hexdigest()
+
+    def get(self, key):
+        if key in self.arrays:
+            self.arrays.move_to_end(key)
+            return self.arrays[key]
+        path = self._getPath(key)
+        if path is not None and os.path.exists(path):
+            array = np.load(path)
+            self._keep(key, array)
+            return array
+        return None
+
+    def put(self, key, array):
+        self._keep(key, array)
+        path = self._getPath(key)
+        if path is not None:
+            np.save(path, array)
+
+    def clear(self):
+        """Clear the arrays in memory, files in the cache folder are kept"""
+        self.arrays = OrderedDict()
+
+    def hashFile(self, path):
+        """Hash of the content of a file, eg. the PSF, remembered as long as the file is not modified"""
+        stat = os.stat(path)
+        fileId = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if fileId not in self.fileHashes:
+            hasher = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(2**20), b''):
+                    hasher.update(chunk)
+            self.fileHashes[fileId] = hasher.hexdigest()
+        return self.fileHashes[fileId]
+
+    def _keep(self, key, array):
+        """Keep the array in memory, evicting the least recently used arrays to stay within maxBytes. The newest
+        array is always kept"""
+        self.arrays[key] = array
+        self.arrays.move_to_end(key)
+        while len(self.arrays) > 1 and sum(a.nbytes for a in self.arrays.values()) > self.maxBytes:
+            self.arrays.popitem(last=False)
+
+    def _getPath(self, key):
+        if self.cacheFolder is None:
+            return None
+        return os.path.join(self.cacheFolder, key + '.npy')
+
+    def _toJSON(self, obj):
+        if isinstance(obj, np.ndarray):
+            arr = np.ascontiguousarray(obj)
+            return [str(arr.dtype), list(arr.shape), hashlib.sha1(arr.tobytes()).hexdigest()]
+        elif isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f'Can not hash parameter of type {type(obj)}')
@@ -1,4 +1,5 @@
 from numba import cuda
+from numba.cuda.random import xoroshiro128p_uniform_float32
 import math
 
 @cuda.jit
@@ -59,7 +60,46 @@ def convTransform(dataStack, sampleVol, kernel, transformMat):
 
 
 
+@cuda.jit
+def NNTransform(dataStack, sampleVol, transformMat):
+    """Retrieve the nearest neighbour value from the sample volume and place in the data stack"""
+    idz, idy, idx = cuda.grid(3)
+    if idz < dataStack.shape[0] and idy < dataStack.shape[1] and idx < dataStack.shape[2]:
+        sampleCoords_z = transformMat[0, 0] * idz + transformMat[0, 1] * idy + transformMat[0, 2] * idx
+        sampleCoords_y = transformMat[1, 0] * idz + transformMat[1, 1] * idy + transformMat[1, 2] * idx
+        sampleCoords_x = transformMat[2, 0] * idz + transformMat[2, 1] * idy + transformMat[2, 2] * idx
+
+        # Round to nearest and cast to int
+        sampleIndex_z = int(round(sampleCoords_z))
+        sampleIndex_y = int(round(sampleCoords_y))
+        sampleIndex_x = int(round(sampleCoords_x))
+
+        if 0 <= sampleIndex_z < sampleVol.shape[0] and 0 <= sampleIndex_y < sampleVol.shape[1] and 0 <= sampleIndex_x < \
+                sampleVol.shape[2]:
+            dataStack[idz, idy, idx] = sampleVol[sampleIndex_z, sampleIndex_y, sampleIndex_x]
+        else:
+            dataStack[idz, idy, idx] = 0
+
+
 """Inverse model"""
+@cuda.jit
+def invNNTransform(dataStack, sampleVol, transformMat):
+    """Distribute the values in the data stack back to the sample canvas in the nearest neighbour voxel"""
+    idz, idy, idx = cuda.grid(3)
+    if idz < dataStack.shape[0] and idy < dataStack.shape[1] and idx < dataStack.shape[2]:
+        sampleCoords_z = transformMat[0, 0] * idz + transformMat[0, 1] * idy + transformMat[0, 2] * idx
+        sampleCoords_y = transformMat[1, 0] * idz + transformMat[1, 1] * idy + transformMat[1, 2] * idx
+        sampleCoords_x = transformMat[2, 0] * idz + transformMat[2, 1] * idy + transformMat[2, 2] * idx
+
+        # Round to nearest and cast to int
+        sampleIndex_z = int(round(sampleCoords_z))
+        sampleIndex_y = int(round(sampleCoords_y))
+        sampleIndex_x = int(round(sampleCoords_x))
+
+        if 0 <= sampleIndex_z < sampleVol.shape[0] and 0 <= sampleIndex_y < sampleVol.shape[1] and 0 <= sampleIndex_x < \
+                sampleVol.shape[2]:
+            cuda.atomic.add(sampleVol, (sampleIndex_z, sampleIndex_y, sampleIndex_x), dataStack[idz, idy, idx])
+
 @cuda.jit
 def invConvTransform(dataStack, sampleVol, kernel, transformMat):
     """Distribute the values in the data stack back to the sample canvas according to the kernel values
@@ -90,4 +130,212 @@ def invConvTransform(dataStack, sampleVol, kernel, transformMat):
                         the kernel and not retrieving the value according to the kernel as usually in convolution. These 
                         two facts both flip the kernel and cancel out, so we keep the minus as we have in the forward model"""
                         value = dataValue * kernel[-zk-1, -yk-1, -xk-1]
-                        cuda.atomic.add(sampleVol, (z, y, x), value)
\ No newline at end of file
+                        cuda.atomic.add(sampleVol, (z, y, x), value)
+
+@cuda.jit(device=True)
+def _dataIndexRange(m0, m1, m2, lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, axisSize):
+    """Range of data indices along one data axis that can be rounded into the sample index box [lo, hi] (inclusive),
+    m0, m1, m2 is the row of the inverse transform matrix belonging to the data axis"""
+    dMin = min(m0 * (lo_z - 0.5), m0 * (hi_z + 0.5)) + \
+           min(m1 * (lo_y - 0.5), m1 * (hi_y + 0.5)) + \
+           min(m2 * (lo_x - 0.5), m2 * (hi_x + 0.5))
+    dMax = max(m0 * (lo_z - 0.5), m0 * (hi_z + 0.5)) + \
+           max(m1 * (lo_y - 0.5), m1 * (hi_y + 0.5)) + \
+           max(m2 * (lo_x - 0.5), m2 * (hi_x + 0.5))
+    start = max(int(math.floor(dMin)), 0)
+    stop = min(int(math.ceil(dMax)) + 1, axisSize)
+    return start, stop
+
+
+@cuda.jit
+def invConvTransformGather(dataStack, sampleVol, kernel, transformMat, invTransformMat):
+    """Same result as invConvTransform but formulated as a gather, each thread computes one sample voxel by collecting
+    the values from the data voxels whose nearest sample index falls within reach of the kernel. Candidate data voxels
+    are found using the inverse transform matrix, which removes the need for atomicAdd operations.
+    NOTE: The sample canvas is overwritten, not added to as in invConvTransform."""
+    idz, idy, idx = cuda.grid(3)
+    if idz < sampleVol.shape[0] and idy < sampleVol.shape[1] and idx < sampleVol.shape[2]:
+        volume_size = kernel.shape
+        # A data voxel with nearest sample index s reaches sample voxels s - K//2 to s + K - 1 - K//2,
+        # so the sample indices that reach this voxel lie in the box [lo, hi]
+        lo_z = idz - (volume_size[0] - 1 - volume_size[0] // 2)
+        hi_z = idz + volume_size[0] // 2
+        lo_y = idy - (volume_size[1] - 1 - volume_size[1] // 2)
+        hi_y = idy + volume_size[1] // 2
+        lo_x = idx - (volume_size[2] - 1 - volume_size[2] // 2)
+        hi_x = idx + volume_size[2] // 2
+
+        start_z, stop_z = _dataIndexRange(invTransformMat[0, 0], invTransformMat[0, 1], invTransformMat[0, 2],
+                                          lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[0])
+        start_y, stop_y = _dataIndexRange(invTransformMat[1, 0], invTransformMat[1, 1], invTransformMat[1, 2],
+                                          lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[1])
+        start_x, stop_x = _dataIndexRange(invTransformMat[2, 0], invTransformMat[2, 1], invTransformMat[2, 2],
+                                          lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[2])
+
+        finalValue = 0.
+        for dz in range(start_z, stop_z):
+            for dy in range(start_y, stop_y):
+                for dx in range(start_x, stop_x):
+                    # Same rounding as in the forward model to get the identical nearest sample index
+                    sampleIndex_z = int(round(transformMat[0, 0] * dz + transformMat[0, 1] * dy + transformMat[0, 2] * dx))
+                    sampleIndex_y = int(round(transformMat[1, 0] * dz + transformMat[1, 1] * dy + transformMat[1, 2] * dx))
+                    sampleIndex_x = int(round(transformMat[2, 0] * dz + transformMat[2, 1] * dy + transformMat[2, 2] * dx))
+                    if lo_z <= sampleIndex_z <= hi_z and lo_y <= sampleIndex_y <= hi_y and lo_x <= sampleIndex_x <= hi_x:
+                        zk = idz - sampleIndex_z + (volume_size[0] // 2)
+                        yk = idy - sampleIndex_y + (volume_size[1] // 2)
+                        xk = idx - sampleIndex_x + (volume_size[2] // 2)
+                        finalValue += dataStack[dz, dy, dx] * kernel[-zk-1, -yk-1, -xk-1]
+        sampleVol[idz, idy, idx] = finalValue
+
+
+"""Batched transforms, the data stacks and sample volumes of several timepoints are stacked along a first axis and
+transformed in one launch. The first grid axis runs over both the batch and the z axis."""
+@cuda.jit
+def convTransformBatch(dataStacks, sampleVols, kernel, transformMat):
+    """Same as convTransform for every volume in the batch"""
+    idtz, idy, idx = cuda.grid(3)
+    if idtz < dataStacks.shape[0] * dataStacks.shape[1] and idy < dataStacks.shape[2] and idx < dataStacks.shape[3]:
+        idt = idtz // dataStacks.shape[1]
+        idz = idtz % dataStacks.shape[1]
+        sampleCoords_z = transformMat[0, 0] * idz + transformMat[0, 1] * idy + transformMat[0, 2] * idx
+        sampleCoords_y = transformMat[1, 0] * idz + transformMat[1, 1] * idy + transformMat[1, 2] * idx
+        sampleCoords_x = transformMat[2, 0] * idz + transformMat[2, 1] * idy + transformMat[2, 2] * idx
+
+        # Round to nearest and cast to int
+        sampleIndex_z = int(round(sampleCoords_z))
+        sampleIndex_y = int(round(sampleCoords_y))
+        sampleIndex_x = int(round(sampleCoords_x))
+
+        volume_size = kernel.shape
+
+        finalValue = 0
+        for zk in range(0, volume_size[0]):
+            z = sampleIndex_z + zk - (volume_size[0] // 2)
+            for yk in range(0, volume_size[1]):
+                y = sampleIndex_y + yk - (volume_size[1] // 2)
+                for xk in range(0, volume_size[2]):
+                    x = sampleIndex_x + xk - (volume_size[2] // 2)
+                    if 0 <= z < sampleVols.shape[1] and 0 <= y < sampleVols.shape[2] and 0 <= x < sampleVols.shape[3]:
+                        finalValue += sampleVols[idt, z, y, x] * kernel[-zk-1, -yk-1, -xk-1] #Minus for the flipping in convolution
+        dataStacks[idt, idz, idy, idx] = finalValue
+
+
+@cuda.jit
+def NNTransformBatch(dataStacks, sampleVols, transformMat):
+    """Same as NNTransform for every volume in the batch"""
+    idtz, idy, idx = cuda.grid(3)
+    if idtz < dataStacks.shape[0] * dataStacks.shape[1] and idy < dataStacks.shape[2] and idx < dataStacks.shape[3]:
+        idt = idtz // dataStacks.shape[1]
+        idz = idtz % dataStacks.shape[1]
+        sampleIndex_z = int(round(transformMat[0, 0] * idz + transformMat[0, 1] * idy + transformMat[0, 2] * idx))
+        sampleIndex_y = int(round(transformMat[1, 0] * idz + transformMat[1, 1] * idy + transformMat[1, 2] * idx))
+        sampleIndex_x = int(round(transformMat[2, 0] * idz + transformMat[2, 1] * idy + transformMat[2, 2] * idx))
+
+        if 0 <= sampleIndex_z < sampleVols.shape[1] and 0 <= sampleIndex_y < sampleVols.shape[2] and \
+                0 <= sampleIndex_x < sampleVols.shape[3]:
+            dataStacks[idt, idz, idy, idx] = sampleVols[idt, sampleIndex_z, sampleIndex_y, sampleIndex_x]
+        else:
+            dataStacks[idt, idz, idy, idx] = 0
+
+
+@cuda.jit
+def invNNTransformBatch(dataStacks, sampleVols, transformMat):
+    """Same as invNNTransform for every volume in the batch"""
+    idtz, idy, idx = cuda.grid(3)
+    if idtz < dataStacks.shape[0] * dataStacks.shape[1] and idy < dataStacks.shape[2] and idx < dataStacks.shape[3]:
+        idt = idtz // dataStacks.shape[1]
+        idz = idtz % dataStacks.shape[1]
+        sampleIndex_z = int(round(transformMat[0, 0] * idz + transformMat[0, 1] * idy + transformMat[0, 2] * idx))
+        sampleIndex_y = int(round(transformMat[1, 0] * idz + transformMat[1, 1] * idy + transformMat[1, 2] * idx))
+        sampleIndex_x = int(round(transformMat[2, 0] * idz + transformMat[2, 1] * idy + transformMat[2, 2] * idx))
+
+        if 0 <= sampleIndex_z < sampleVols.shape[1] and 0 <= sampleIndex_y < sampleVols.shape[2] and \
+                0 <= sampleIndex_x < sampleVols.shape[3]:
+            cuda.atomic.add(sampleVols, (idt, sampleIndex_z, sampleIndex_y, sampleIndex_x), dataStacks[idt, idz, idy, idx])
+
+
+@cuda.jit
+def invConvTransformBatch(dataStacks, sampleVols, kernel, transformMat):
+    """Same as invConvTransform for every volume in the batch"""
+    idtz, idy, idx = cuda.grid(3)
+    if idtz < dataStacks.shape[0] * dataStacks.shape[1] and idy < dataStacks.shape[2] and idx < dataStacks.shape[3]:
+        idt = idtz // dataStacks.shape[1]
+        idz = idtz % dataStacks.shape[1]
+        sampleIndex_z = int(round(transformMat[0, 0] * idz + transformMat[0, 1] * idy + transformMat[0, 2] * idx))
+        sampleIndex_y = int(round(transformMat[1, 0] * idz + transformMat[1, 1] * idy + transformMat[1, 2] * idx))
+        sampleIndex_x = int(round(transformMat[2, 0] * idz + transformMat[2, 1] * idy + transformMat[2, 2] * idx))
+
+        dataValue = dataStacks[idt, idz, idy, idx]
+        volume_size = kernel.shape
+        for zk in range(0, volume_size[0]):
+            z = sampleIndex_z + zk - (volume_size[0] // 2)
+            for yk in range(0, volume_size[1]):
+                y = sampleIndex_y + yk - (volume_size[1] // 2)
+                for xk in range(0, volume_size[2]):
+                    x = sampleIndex_x + xk - (volume_size[2] // 2)
+                    if 0 <= z < sampleVols.shape[1] and 0 <= y < sampleVols.shape[2] and 0 <= x < sampleVols.shape[3]:
+                        cuda.atomic.add(sampleVols, (idt, z, y, x), dataValue * kernel[-zk-1, -yk-1, -xk-1])
+
+
+@cuda.jit
+def invConvTransformGatherBatch(dataStacks, sampleVols, kernel, transformMat, invTransformMat):
+    """Same as invConvTransformGather for every volume in the batch"""
+    idtz, idy, idx = cuda.grid(3)
+    if idtz < sampleVols.shape[0] * sampleVols.shape[1] and idy < sampleVols.shape[2] and idx < sampleVols.shape[3]:
+        idt = idtz // sampleVols.shape[1]
+        idz = idtz % sampleVols.shape[1]
+        volume_size = kernel.shape
+        lo_z = idz - (volume_size[0] - 1 - volume_size[0] // 2)
+        hi_z = idz + volume_size[0] // 2
+        lo_y = idy - (volume_size[1] - 1 - volume_size[1] // 2)
+        hi_y = idy + volume_size[1] // 2
+        lo_x = idx - (volume_size[2] - 1 - volume_size[2] // 2)
+        hi_x = idx + volume_size[2] // 2
+
+        start_z, stop_z = _dataIndexRange(invTransformMat[0, 0], invTransformMat[0, 1], invTransformMat[0, 2],
+                                          lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStacks.shape[1])
+        start_y, stop_y = _dataIndexRange(invTransformMat[1, 0], invTransformMat[1, 1], invTransformMat[1, 2],
+                                          lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStacks.shape[2])
+        start_x, stop_x = _dataIndexRange(invTransformMat[2, 0], invTransformMat[2, 1], invTransformMat[2, 2],
+                                          lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStacks.shape[3])
+
+        finalValue = 0.
+        for dz in range(start_z, stop_z):
+            for dy in range(start_y, stop_y):
+                for dx in range(start_x, stop_x):
+                    sampleIndex_z = int(round(transformMat[0, 0] * dz + transformMat[0, 1] * dy + transformMat[0, 2] * dx))
+                    sampleIndex_y = int(round(transformMat[1, 0] * dz + transformMat[1, 1] * dy + transformMat[1, 2] * dx))
+                    sampleIndex_x = int(round(transformMat[2, 0] * dz + transformMat[2, 1] * dy + transformMat[2, 2] * dx))
+                    if lo_z <= sampleIndex_z <= hi_z and lo_y <= sampleIndex_y <= hi_y and lo_x <= sampleIndex_x <= hi_x:
+                        zk = idz - sampleIndex_z + (volume_size[0] // 2)
+                        yk = idy - sampleIndex_y + (volume_size[1] // 2)
+                        xk = idx - sampleIndex_x + (volume_size[2] // 2)
+                        finalValue += dataStacks[idt, dz, dy, dx] * kernel[-zk-1, -yk-1, -xk-1]
+        sampleVols[idt, idz, idy, idx] = finalValue
+
+
+"""Gradient consent"""
+@cuda.jit
+def gpuBinomialSplit(rawData, bin1Data, bin2Data, p, rng_states):
+    idz, idy, idx = cuda.grid(3)
+    if idz < rawData.shape[0] and idy < rawData.shape[1] and idx < rawData.shape[2]:
+        n = idz*cuda.gridsize(3)[1]*cuda.gridsize(3)[2] + idy*cuda.gridsize(3)[2] + idx
+        for _ in range(rawData[idz, idy, idx]):
+            r = xoroshiro128p_uniform_float32(rng_states, n)
+            if r < p:
+                bin1Data[idz, idy, idx] += 1
+            else:
+                bin2Data[idz, idy, idx] += 1
+
+@cuda.jit
+def gpuDoGradientConsent(updateFactors1, updateFactors2):
+    idz, idy, idx = cuda.grid(3)
+    if idz < updateFactors1.shape[0] and idy < updateFactors1.shape[1] and idx < updateFactors1.shape[2]:
+        uf1 = updateFactors1[idz, idy, idx]
+        uf2 = updateFactors2[idz, idy, idx]
+        s1 = uf1 - 1
+        s2 = uf2 - 1
+        if s1 / abs(s1) == s2 / abs(s2):
+            updateFactors1[idz, idy, idx] = 0.5*(uf1 + uf2)
+        else:
+            updateFactors1[idz, idy, idx] = 1
@@ -0,0 +1,121 @@
+import numpy as np
+from scipy.fft import next_fast_len
+
+
+class DirectModel:
+    """Image formation model where each data voxel is calculated by a direct 3D convolution of the sample with the
+    kernel, centered at the nearest sample voxel of the data voxel. Costs O(N*K^3) per transform.
+    The transforms take either single volumes or batches of volumes stacked along a first axis, eg. several
+    timepoints, which are transformed with one kernel launch."""
+
+    def __init__(self, kernel, transformMat, reconShape, backend, backprojection='Gather'):
+        self.reconShape = tuple(int(s) for s in reconShape)
+        self.backend = backend
+        self.backprojection = backprojection
+
+        xp = backend.xp
+        self.dev_K = xp.array(kernel)
+        self.dev_M = xp.array(transformMat)
+        self.dev_invM = xp.array(np.linalg.inv(transformMat))
+
+    def forward(self, dev_sampleIn, dev_dataOut):
+        """Calculate the expected data from the sample, overwriting the data canvas"""
+        if dev_sampleIn.ndim == 4:
+            self.backend.convTransformBatch(dev_dataOut, dev_sampleIn, self.dev_K, self.dev_M)
+        else:
+            self.backend.convTransform(dev_dataOut, dev_sampleIn, self.dev_K, self.dev_M)
+
+    def adjoint(self, dev_dataIn, dev_sampleOut):
+        """Distribute the data canvas to the sample canvas, overwriting the sample canvas. 'Scatter' launches one thread
+        per data voxel and uses atomicAdd, 'Gather' launches one thread per sample voxel."""
+        batch = dev_dataIn.ndim == 4
+        if self.backprojection == 'Gather':
+            if batch:
+                self.backend.invConvTransformGatherBatch(dev_dataIn, dev_sampleOut, self.dev_K, self.dev_M,
+                                                         self.dev_invM)
+            else:
+                self.backend.invConvTransformGather(dev_dataIn, dev_sampleOut, self.dev_K, self.dev_M, self.dev_invM)
+        elif self.backprojection == 'Scatter':
+            dev_sampleOut.fill(0) #Scatter kernel adds to the canvas
+            if batch:
+                self.backend.invConvTransformBatch(dev_dataIn, dev_sampleOut, self.dev_K, self.dev_M)
+            else:
+                self.backend.invConvTransform(dev_dataIn, dev_sampleOut, self.dev_K, self.dev_M)
+        else:
+            raise ValueError(f'Unknown backprojection "{self.backprojection}", should be "Gather" or "Scatter"')
+
+
+class FFTModel(DirectModel):
+    """Image formation model separated into a convolution of the sample with the kernel, done by FFT on a zero padded
+    sample canvas, followed by a nearest neighbour transform to the data. The FFTs of the kernel (K) and of the flipped
+    kernel (Kt) are calculated once and reused for every transform. Gives the same result as DirectModel."""
+
+    def __init__(self, kernel, transformMat, reconShape, backend, canvasMode='Power of two'):
+        super().__init__(kernel, transformMat, reconShape, backend)
+        self.canvasShape = self.makeCanvasShape(self.reconShape, kernel.shape, canvasMode)
+        print('FFT canvas shape = ', self.canvasShape)
+
+        self.dev_canvas = backend.xp.zeros(self.canvasShape, dtype=float)
+        self.dev_K_fft, self.dev_Kt_fft = self._makeKernelFFTs(kernel)
+        del self.dev_K  # Only the FFTs are needed
+
+    @staticmethod
+    def makeCanvasShape(reconShape, kernelShape, canvasMode='Power of two'):
+        """Padded canvas large enough that the circular FFT convolution never wraps kernel contributions back into the
+        reconstruction volume"""
+        minShape = [r + k for r, k in zip(reconShape, kernelShape)]
+        if canvasMode == 'Power of two':
+            return tuple(int(2 ** np.ceil(np.log2(s))) for s in minShape)
+        elif canvasMode == 'Fast length':
+            return tuple(next_fast_len(s, real=True) for s in minShape)
+        else:
+            raise ValueError(f'Unknown FFT canvas mode "{canvasMode}", should be "Power of two" or "Fast length"')
+
+    def forward(self, dev_sampleIn, dev_dataOut):
+        """Calculate the expected data from the sample, overwriting the data canvas"""
+        canvas = self._getCanvas(dev_sampleIn.shape[:-3])
+        canvas[..., :self.reconShape[0], :self.reconShape[1], :self.reconShape[2]] = dev_sampleIn
+        xp = self.backend.xp
+        axes = (-3, -2, -1)
+        convolved = xp.fft.irfftn(xp.fft.rfftn(canvas, axes=axes) * self.dev_K_fft, s=self.canvasShape, axes=axes)
+        if convolved.ndim == 4:
+            self.backend.NNTransformBatch(dev_dataOut, convolved, self.dev_M)
+        else:
+            self.backend.NNTransform(dev_dataOut, convolved, self.dev_M)
+        del convolved
+
+    def adjoint(self, dev_dataIn, dev_sampleOut):
+        """Distribute the data canvas to the sample canvas, overwriting the sample canvas"""
+        canvas = self._getCanvas(dev_dataIn.shape[:-3])
+        if canvas.ndim == 4:
+            self.backend.invNNTransformBatch(dev_dataIn, canvas, self.dev_M)
+        else:
+            self.backend.invNNTransform(dev_dataIn, canvas, self.dev_M)
+        xp = self.backend.xp
+        axes = (-3, -2, -1)
+        convolved = xp.fft.irfftn(xp.fft.rfftn(canvas, axes=axes) * self.dev_Kt_fft, s=self.canvasShape, axes=axes)
+        dev_sampleOut[:] = convolved[..., :self.reconShape[0], :self.reconShape[1], :self.reconShape[2]]
+        del convolved
+
+    def _getCanvas(self, batchShape):
+        """Zeroed padded canvas, reallocated when the batch size changes"""
+        shape = tuple(batchShape) + self.canvasShape
+        if self.dev_canvas.shape != shape:
+            self.dev_canvas = self.backend.xp.zeros(shape, dtype=float)
+        else:
+            self.dev_canvas.fill(0)
+        return self.dev_canvas
+
+    def _makeKernelFFTs(self, kernel):
+        """The kernel is placed in the canvas with the voxel that convTransform centers on the nearest sample voxel
+        at the origin. Since the kernel is real, the FFT of the flipped kernel is the complex conjugate."""
+        xp = self.backend.xp
+        dev_paddedKernel = xp.zeros(self.canvasShape, dtype=float)
+        dev_paddedKernel[:kernel.shape[0], :kernel.shape[1], :kernel.shape[2]] = xp.array(kernel)
+        origin = [k - 1 - k // 2 for k in kernel.shape]
+        dev_paddedKernel = xp.roll(dev_paddedKernel, [-o for o in origin], axis=(0, 1, 2))
+        dev_K_fft = xp.fft.rfftn(dev_paddedKernel)
+        dev_Kt_fft = xp.conj(dev_K_fft)
+        del dev_paddedKernel
+
+        return dev_K_fft, dev_Kt_fft
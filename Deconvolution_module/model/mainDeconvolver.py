@@ -1,30 +1,33 @@
 import os
 import time
 
-import cupy
 import numpy as np
-import numba
-from numba import cuda
-from numba.cuda.random import xoroshiro128p_uniform_float32, create_xoroshiro128p_states
-import cupy as cp
 from model.kernelGeneration import KernelHandler
 from model.transformMatGeneration import TransformMatHandler
-from model.gpuTransforms import gaussDistribTransform, convTransform, invConvTransform
+from model.imFormationModels import DirectModel, FFTModel
+from model.backends import getBackend
+from model.tiling import TileHandler
+from model.pipeline import TimepointPrefetcher, AsyncWriter
+from model.geometryCache import GeometryCache
 from model.dataFiddler import DataFiddler
 from model.DataIO_tools import DataIO_tools
 import json
 import math
-import copy
 import time
 class Deconvolver:
 
-    def __init__(self):
-
+    def __init__(self, backend='Auto', cacheFolder=None):
+        """backend is 'Auto', 'GPU' or 'CPU', 'Auto' uses the GPU if cupy and a CUDA device are available.
+        Kernels and normalizations are cached in memory, and in cacheFolder if given, see GeometryCache"""
         self.DF = DataFiddler()
         self.KH = KernelHandler()
         self.tMatHandler = TransformMatHandler()
+        self.tileHandler = TileHandler()
+        self.geometryCache = GeometryCache(cacheFolder)
 
-        self.mempool = cp.get_default_memory_pool()
+        self.backend = getBackend(backend)
+        self.xp = self.backend.xp
+        print('Using backend: ', self.backend.name)
 
     def setAndLoadData(self, path, dataPropertiesDict):
         self.DF.loadData(path, dataPropertiesDict)
@@ -46,66 +49,66 @@ class Deconvolver:
         else:
             saveMode = None
 
+        xp = self.xp
         M = self.tMatHandler.makeSOLSTransformMatrix(self.DF.getDataPropertiesDict(), algOptionsDict, reconOptionsDict)
-        cpM = cuda.to_device(M)
+        dev_M = xp.array(M)
         """Calculate reconstruction canvas size"""
         print('Timepoint shape = ', self.DF.getDataTimepointShape())
         dataShape = self.DF.getDataTimepointShape()
         reconShape = np.ceil(np.matmul(M, dataShape)).astype(int)
-        """Prepare GPU blocks for shape of data"""
-        threadsperblock = 8
-        data_blocks_per_grid_z = (dataShape[0] + (threadsperblock - 1)) // threadsperblock
-        data_blocks_per_grid_y = (dataShape[1] + (threadsperblock - 1)) // threadsperblock
-        data_blocks_per_grid_x = (dataShape[2] + (threadsperblock - 1)) // threadsperblock
 
         sigma_z, sigma_y, sigma_x = self.KH.makeGaussianSigmas(self.DF.getDataPropertiesDict(), reconOptionsDict)
 
         """Reconstruct"""
-        print('Before allocating')
-        dataOnes = cp.ones(dataShape)
-        invTransfOnes = cp.zeros(reconShape)
-        print('After allocating')
-        gaussDistribTransform[(data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x),
-                              (threadsperblock, threadsperblock, threadsperblock)](dataOnes, invTransfOnes, cpM,
-                                                                                   sigma_z, sigma_y, sigma_x,
-                                                                                   int(np.ceil(sigma_z)),
-                                                                                   int(np.ceil(sigma_y)),
-                                                                                   int(np.ceil(sigma_x)))
-        print('After transform')
-        del dataOnes
-
+        def transformOnes():
+            print('Before allocating')
+            dataOnes = xp.ones(dataShape)
+            invTransfOnes = xp.zeros(reconShape)
+            print('After allocating')
+            self.backend.gaussDistribTransform(dataOnes, invTransfOnes, dev_M, sigma_z, sigma_y, sigma_x,
+                                               int(np.ceil(sigma_z)), int(np.ceil(sigma_y)), int(np.ceil(sigma_x)))
+            print('After transform')
+            del dataOnes
+            return self.backend.asnumpy(invTransfOnes)
+
+        invTransfOnesParameters = {'Transform matrix': M, 'Data shape': dataShape, 'Reconstruction shape': reconShape,
+                                   'Sigmas': [sigma_z, sigma_y, sigma_x]}
+        invTransfOnes = xp.array(self.geometryCache.getOrCompute('SimpleDeskewNormalization', invTransfOnesParameters,
+                                                                 transformOnes))
         invTransfOnes = invTransfOnes.clip(0.01)
         """Prepare how to process timepoints"""
         timepoints = self._getTimepointsList(reconOptionsDict)
         print('Timepoints = ', timepoints)
-        for tp in timepoints:
-            adjustedData = cp.array(self.DF.getPreprocessedData(reconOptionsDict, timepoints=tp))
-            recon_canvas = cp.zeros(reconShape, dtype=float)
-            gaussDistribTransform[(data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x),
-                                  (threadsperblock, threadsperblock, threadsperblock)](adjustedData, recon_canvas, M,
-                                                                                       sigma_z, sigma_y, sigma_x,
-                                                                                   int(np.ceil(sigma_z)),
-                                                                                   int(np.ceil(sigma_y)),
-                                                                                   int(np.ceil(sigma_x)))
-            finalReconstruction = cp.asnumpy(cp.divide(recon_canvas, invTransfOnes))
-            print('Reconstruction finished at t = ', time.time() - startTime)
-            if saveToDisc:
-                vx_size = (reconOptionsDict['Reconstruction voxel size [nm]'],) * 3
-                saveDataPath = os.path.join(saveFolder, saveName + '_Timepoint_' + str(tp) + '_SimpleDeskew.tif')
-                DataIO_tools.save_data(finalReconstruction, saveDataPath, vx_size=vx_size, unit='nm')
-                saveParamsPath = os.path.join(saveFolder, saveName + '_ReconstructionParameters.json')
-                saveParamDict = {'Data Parameters': dataPropertiesDict,
-                                 'Reconstruction parameters': reconOptionsDict,
-                                 'Image formation model parameters': imFormationModelParameters,
-                                 'Algorithmic parameters': algOptionsDict}
-                with open(saveParamsPath, 'w') as fp:
-                    json.dump(saveParamDict, fp, indent=4)
-                    fp.close()
+        if self._getPrefetch(algOptionsDict, timepoints):
+            loadTimepoint = lambda tp: self._loadTimepoint(reconOptionsDict, tp, np, pin=True)
+            timepointData = TimepointPrefetcher(loadTimepoint, timepoints)
+        else:
+            loadTimepoint = lambda tp: self._loadTimepoint(reconOptionsDict, tp, xp, pin=False)
+            timepointData = ((tp, loadTimepoint(tp)) for tp in timepoints)
+        with AsyncWriter() as writer:
+            for tp, adjustedData in timepointData:
+                adjustedData = xp.asarray(adjustedData)
+                recon_canvas = xp.zeros(reconShape, dtype=float)
+                self.backend.gaussDistribTransform(adjustedData, recon_canvas, dev_M, sigma_z, sigma_y, sigma_x,
+                                                   int(np.ceil(sigma_z)), int(np.ceil(sigma_y)), int(np.ceil(sigma_x)))
+                finalReconstruction = self.backend.asnumpy(xp.divide(recon_canvas, invTransfOnes))
+                print('Reconstruction finished at t = ', time.time() - startTime)
+                if saveToDisc:
+                    vx_size = (reconOptionsDict['Reconstruction voxel size [nm]'],) * 3
+                    saveDataPath = os.path.join(saveFolder, saveName + '_Timepoint_' + str(tp) + '_SimpleDeskew.tif')
+                    writer.submit(DataIO_tools.save_data, finalReconstruction, saveDataPath, vx_size=vx_size,
+                                  unit='nm')
+                    saveParamsPath = os.path.join(saveFolder, saveName + '_ReconstructionParameters.json')
+                    saveParamDict = {'Data Parameters': dataPropertiesDict,
+                                     'Reconstruction parameters': reconOptionsDict,
+                                     'Image formation model parameters': imFormationModelParameters,
+                                     'Algorithmic parameters': algOptionsDict}
+                    writer.submit(self._saveParameters, saveParamsPath, saveParamDict)
 
         del adjustedData
         del recon_canvas
         del invTransfOnes
-        self.mempool.free_all_blocks()
+        self.backend.freeMemory()
 
 
     def Deconvolve(self, reconOptionsDict, algOptionsDict, imFormationModelParameters, saveOptions):
@@ -136,157 +139,553 @@ class Deconvolver:
             gradientConsent = algOptionsDict['Gradient consent']
         except KeyError:
             gradientConsent = False
+        try:
+            backprojection = algOptionsDict['Backprojection']
+        except KeyError:
+            backprojection = 'Gather'
+        try:
+            modelType = algOptionsDict['Model']
+        except KeyError:
+            modelType = 'Direct'
+        try:
+            fftCanvas = algOptionsDict['FFT canvas']
+        except KeyError:
+            fftCanvas = 'Power of two'
+        acceleration, convergenceMetric, tolerance = self._getConvergenceOptions(algOptionsDict)
 
-        K = self.KH.makePLSRKernel(self.DF.getDataPropertiesDict(), imFormationModelParameters, algOptionsDict,
-                                   reconOptionsDict)
+        K = self._getKernel(imFormationModelParameters, algOptionsDict, reconOptionsDict)
         M = self.tMatHandler.makeSOLSTransformMatrix(self.DF.getDataPropertiesDict(), algOptionsDict, reconOptionsDict)
 
         dataShape = self.DF.getDataTimepointShape()
         reconShape = np.ceil(np.matmul(M, dataShape)).astype(int)
-        """Prepare GPU blocks for shape of data"""
-        threadsperblock = 8
-        data_blocks_per_grid_z = (dataShape[0] + (threadsperblock - 1)) // threadsperblock
-        data_blocks_per_grid_y = (dataShape[1] + (threadsperblock - 1)) // threadsperblock
-        data_blocks_per_grid_x = (dataShape[2] + (threadsperblock - 1)) // threadsperblock
-
-        """Prepare arrays"""
-        dev_dataOnes = cp.ones(dataShape, dtype=float)
-        dev_Ht_of_ones = cp.zeros(reconShape, dtype=float)
-        dev_K = cp.array(K)
-        dev_M = cp.array(M)
-        invConvTransform[
-            (data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x), (
-                threadsperblock, threadsperblock, threadsperblock)](
-            dev_dataOnes, dev_Ht_of_ones, dev_K, dev_M)
-        del dev_dataOnes
-        dev_Ht_of_ones = dev_Ht_of_ones.clip(
-            0.3 * cp.max(dev_Ht_of_ones))  # Avoid divide by zero and crazy high guesses outside measured region, 0.3 is emperically chosen
-        self.mempool.free_all_blocks()
-        dev_dataCanvas = cp.zeros(dataShape, dtype=float)
-        dev_sampleCanvas = cp.zeros(reconShape, dtype=float)
-        if gradientConsent:
-            dev_dataCanvas2 = cp.zeros(dataShape, dtype=float)
-            dev_sampleCanvas2 = cp.zeros(reconShape, dtype=float)
 
-        """Prepare GPU blocks for shape of samples guess"""
-        sample_blocks_per_grid_z = (reconShape[0] + (threadsperblock - 1)) // threadsperblock
-        sample_blocks_per_grid_y = (reconShape[1] + (threadsperblock - 1)) // threadsperblock
-        sample_blocks_per_grid_x = (reconShape[2] + (threadsperblock - 1)) // threadsperblock
+        """Prepare tiles"""
+        tiltAxis = self.DF.getDataPropertiesDict()['Tilt axis']
+        maxTileColumns = self._getMaxTileColumns(dataShape, reconShape, tiltAxis, modelType, gradientConsent,
+                                                 algOptionsDict, K.shape)
+        """A tile reconstruction is invalid within a kernel width of its inner borders after the first iteration, the
+        forward projection misses the sample outside the tile and the backprojection spreads that error by another
+        half kernel"""
+        tiles = self.tileHandler.makeTiles(dataShape, reconShape, M, tiltAxis, K.shape[2], maxTileColumns)
+        if len(tiles) > 1:
+            """Clip the normalization relative to its maximum over all tiles, as it would be without tiling"""
+            HtMax = 0
+            for tile in tiles:
+                imFormationModel, dev_Ht_of_ones = self._prepareImFormationModel(
+                    modelType, K, M, tile.getDataShape(dataShape), tile.reconShape,
+                    backprojection, fftCanvas, clipValue=0)
+                HtMax = max(HtMax, float(self.xp.max(dev_Ht_of_ones)))
+                del imFormationModel, dev_Ht_of_ones
+                self.backend.freeMemory()
+            clipValue = 0.3 * HtMax
+        else:
+            clipValue = None
 
         """Prepare saving"""
         if saveMode == 'Progression':
             saveRecons = []
             if progressionMode == 'Logarithmic':
                 indices = (iterations - np.arange(0, np.floor(np.log2(iterations)))**2)[::-1]
+                saveIterations = [i for i in range(iterations) if i in indices]
+            else:
+                saveIterations = list(range(iterations))
+        else:
+            saveIterations = []
 
         """Prepare how to process timepoints"""
         timepoints = self._getTimepointsList(reconOptionsDict)
 
+        """Group timepoints into batches that are deconvolved together"""
+        batchSize = self._getBatchSize(algOptionsDict, tiles, timepoints, dataShape, reconShape, modelType,
+                                       gradientConsent, K.shape)
+        batches = [timepoints[i:i + batchSize] for i in range(0, len(timepoints), batchSize)]
+
+        """Prepare pipelining, the next batch is loaded and the previous one saved while the current one is
+        processed"""
+        prefetch = self._getPrefetch(algOptionsDict, batches)
+        if len(tiles) > 1 or prefetch:
+            preprocessingXp = np #Tiled and prefetched data stays on the host, only tiles are moved
+        else:
+            preprocessingXp = self.xp
+        loadBatch = lambda batch: self._loadTimepoints(reconOptionsDict, batch, preprocessingXp, pin=len(tiles) == 1,
+                                                       stack=batchSize > 1)
+        if prefetch:
+            batchData = TimepointPrefetcher(loadBatch, batches)
+        else:
+            batchData = ((batch, loadBatch(batch)) for batch in batches)
+
         """Run deconvolution iteration"""
-        for tp in timepoints:
-            data = self.DF.getPreprocessedData(reconOptionsDict, timepoints=tp) #timepoint is zero-indexed
-            assert self._checkData(data), "Something wrong with data"
+        imFormationModel = None
+        convergenceTraces = {}
+        with AsyncWriter() as writer:
+            for batch, data in batchData: #timepoints are zero-indexed
+                batchShape = (len(batch),) if batchSize > 1 else ()
+                batchReconstruction = np.zeros(batchShape + tuple(reconShape), dtype=float)
+                if saveMode == 'Progression':
+                    progression = np.zeros((len(saveIterations),) + batchShape + tuple(reconShape), dtype=float)
+                for tile in tiles:
+                    if imFormationModel is None:
+                        imFormationModel, dev_Ht_of_ones = self._prepareImFormationModel(
+                            modelType, K, M, tile.getDataShape(dataShape), tile.reconShape, backprojection,
+                            fftCanvas, clipValue)
+                    tileReconstruction, tileProgression, tileConvergence = self._deconvolveVolume(
+                        tile.getData(data), tile.reconShape, imFormationModel, dev_Ht_of_ones, iterations,
+                        gradientConsent, saveIterations, seed=batch[0]*iterations, tp=batch,
+                        acceleration=acceleration, convergenceMetric=convergenceMetric, tolerance=tolerance)
+                    for tp in batch:
+                        convergenceTraces.setdefault('Timepoint ' + str(tp), []).append(tileConvergence)
+                    self.tileHandler.blendTile(batchReconstruction, tileReconstruction, tile)
+                    if saveMode == 'Progression':
+                        for p, rec in enumerate(tileProgression):
+                            self.tileHandler.blendTile(progression[p], rec, tile)
+                    if len(tiles) > 1:
+                        """Free the memory of this tile before preparing the next"""
+                        imFormationModel = None
+                        dev_Ht_of_ones = None
+                        self.backend.freeMemory()
+                del data
+                print('Deconvolution finished at t = ', time.time() - startTime)
+
+                for b, tp in enumerate(batch):
+                    finalReconstruction = batchReconstruction[b] if batchSize > 1 else batchReconstruction
+                    if saveMode == 'Progression':
+                        saveRecons.extend(progression[:, b] if batchSize > 1 else progression)
+                    if saveToDisc:
+                        vx_size = (reconOptionsDict['Reconstruction voxel size [nm]'],)*3
+                        if saveMode == 'Final':
+                            saveDataPath = os.path.join(saveFolder, saveName + '_Timepoint_' + str(tp) + '_FinalDeconvolved.tif')
+                            writer.submit(DataIO_tools.save_data, finalReconstruction, saveDataPath,
+                                          vx_size=vx_size, unit='nm')
+                        elif saveMode == 'Progression':
+                            saveDataPath = os.path.join(saveFolder, saveName + '_DeconvolutionProgression.tif')
+                            writer.submit(DataIO_tools.save_data, np.asarray(saveRecons), saveDataPath,
+                                          vx_size=vx_size, unit='nm')
+                        saveParamsPath = os.path.join(saveFolder, saveName + '_DeconvolutionParameters.json')
+                        saveParamDict = {'Data Parameters': dataPropertiesDict,
+                                         'Reconstruction parameters': reconOptionsDict,
+                                         'Image formation model parameters': imFormationModelParameters,
+                                         'Algorithmic parameters': algOptionsDict}
+                        writer.submit(self._saveParameters, saveParamsPath, saveParamDict)
+
+            if saveToDisc:
+                """Convergence trace of every tile, for batches the max over the batch. Written once all timepoints
+                are deconvolved, such that saving a timepoint does not wait for it"""
+                saveConvergencePath = os.path.join(saveFolder, saveName + '_DeconvolutionConvergence.json')
+                saveConvergenceDict = {'Convergence metric': convergenceMetric,
+                                       'Convergence tolerance': tolerance,
+                                       'Acceleration': acceleration,
+                                       'Traces': convergenceTraces}
+                writer.submit(self._saveParameters, saveConvergencePath, saveConvergenceDict)
+
+        del imFormationModel
+        self.backend.freeMemory()
+
+        return finalReconstruction
+
+    def compareBackprojections(self, reconOptionsDict, algOptionsDict, imFormationModelParameters):
+        """Run the scatter and gather backprojections on the same random data, using the kernel and geometry of the
+        loaded data, and return the maximum difference relative to the maximum value of the scatter result."""
+        K = self._getKernel(imFormationModelParameters, algOptionsDict, reconOptionsDict)
+        M = self.tMatHandler.makeSOLSTransformMatrix(self.DF.getDataPropertiesDict(), algOptionsDict, reconOptionsDict)
+        dataShape = self.DF.getDataTimepointShape()
+        reconShape = np.ceil(np.matmul(M, dataShape)).astype(int)
+
+        xp = self.xp
+        dev_data = xp.random.random(dataShape)
+        scatterModel = DirectModel(K, M, reconShape, self.backend, backprojection='Scatter')
+        gatherModel = DirectModel(K, M, reconShape, self.backend, backprojection='Gather')
+        dev_scattered = xp.zeros(reconShape, dtype=float)
+        dev_gathered = xp.zeros(reconShape, dtype=float)
+        t1 = time.time()
+        scatterModel.adjoint(dev_data, dev_scattered)
+        self.backend.synchronize()
+        t2 = time.time()
+        gatherModel.adjoint(dev_data, dev_gathered)
+        self.backend.synchronize()
+        t3 = time.time()
+        relDiff = float(xp.max(xp.abs(dev_scattered - dev_gathered)) / xp.max(xp.abs(dev_scattered)))
+        print('Scatter elapsed = ', t2 - t1, ', Gather elapsed = ', t3 - t2, ', Max relative difference = ', relDiff)
+
+        del dev_data, dev_scattered, dev_gathered, scatterModel, gatherModel
+        self.backend.freeMemory()
+
+        return relDiff
+
+    def compareModels(self, reconOptionsDict, algOptionsDict, imFormationModelParameters):
+        """Run the forward and adjoint transforms of the direct and the FFT based image formation models on the same
+        random data, using the kernel and geometry of the loaded data, and return the maximum differences relative to
+        the maximum values of the direct results."""
+        try:
+            fftCanvas = algOptionsDict['FFT canvas']
+        except KeyError:
+            fftCanvas = 'Power of two'
+        K = self._getKernel(imFormationModelParameters, algOptionsDict, reconOptionsDict)
+        M = self.tMatHandler.makeSOLSTransformMatrix(self.DF.getDataPropertiesDict(), algOptionsDict, reconOptionsDict)
+        dataShape = self.DF.getDataTimepointShape()
+        reconShape = np.ceil(np.matmul(M, dataShape)).astype(int)
+
+        xp = self.xp
+        directModel = DirectModel(K, M, reconShape, self.backend)
+        fftModel = FFTModel(K, M, reconShape, self.backend, canvasMode=fftCanvas)
+        relDiffs = []
+        for transform, inShape, outShape in (('forward', reconShape, dataShape), ('adjoint', dataShape, reconShape)):
+            dev_in = xp.random.random(inShape)
+            dev_outDirect = xp.zeros(outShape, dtype=float)
+            dev_outFFT = xp.zeros(outShape, dtype=float)
+            t1 = time.time()
+            getattr(directModel, transform)(dev_in, dev_outDirect)
+            self.backend.synchronize()
+            t2 = time.time()
+            getattr(fftModel, transform)(dev_in, dev_outFFT)
+            self.backend.synchronize()
+            t3 = time.time()
+            relDiff = float(xp.max(xp.abs(dev_outDirect - dev_outFFT)) / xp.max(xp.abs(dev_outDirect)))
+            print(transform, ': Direct elapsed = ', t2 - t1, ', FFT elapsed = ', t3 - t2,
+                  ', Max relative difference = ', relDiff)
+            relDiffs.append(relDiff)
+            del dev_in, dev_outDirect, dev_outFFT
+
+        del directModel, fftModel
+        self.backend.freeMemory()
+
+        return relDiffs
+
+    def _getKernel(self, imFormationModelParameters, algOptionsDict, reconOptionsDict):
+        """Make the PLSR kernel, or get it from the cache if it was made before for the same PSF and geometry"""
+        dataPropertiesDict = self.DF.getDataPropertiesDict()
+        kernelParameters = dict(imFormationModelParameters)
+        psfPath = kernelParameters.pop('Optical PSF path') #The PSF is identified by its content, not its path
+        kernelParameters.update({'Optical PSF hash': self.geometryCache.hashFile(psfPath),
+                                 'Tilt angle [deg]': dataPropertiesDict['Tilt angle [deg]'],
+                                 'Camera pixel size [nm]': dataPropertiesDict['Camera pixel size [nm]'],
+                                 'Reconstruction voxel size [nm]': reconOptionsDict['Reconstruction voxel size [nm]'],
+                                 'Clip factor for kernel cropping': algOptionsDict['Clip factor for kernel cropping']})
+        return self.geometryCache.getOrCompute(
+            'Kernel', kernelParameters,
+            lambda: self.KH.makePLSRKernel(dataPropertiesDict, imFormationModelParameters, algOptionsDict,
+                                           reconOptionsDict))
+
+    def _prepareImFormationModel(self, modelType, K, M, dataShape, reconShape, backprojection, fftCanvas,
+                                 clipValue=None):
+        """Make the image formation model and calculate the normalization, H transpose of ones. The normalization is
+        clipped at clipValue, or at 0.3 times its maximum if None"""
+        xp = self.xp
+        imFormationModel = self._makeImFormationModel(modelType, K, M, reconShape, backprojection, fftCanvas)
+
+        def transformOnes():
+            dev_dataOnes = xp.ones(dataShape, dtype=float)
+            dev_Ht_of_ones = xp.zeros(reconShape, dtype=float)
+            imFormationModel.adjoint(dev_dataOnes, dev_Ht_of_ones)
+            del dev_dataOnes
+            return self.backend.asnumpy(dev_Ht_of_ones)
+
+        HtParameters = {'Kernel': K, 'Transform matrix': M, 'Data shape': dataShape, 'Reconstruction shape': reconShape,
+                        'Model': modelType, 'Backprojection': backprojection, 'FFT canvas': fftCanvas}
+        dev_Ht_of_ones = xp.array(self.geometryCache.getOrCompute('Normalization', HtParameters, transformOnes))
+        if clipValue is None:
+            clipValue = 0.3 * xp.max(dev_Ht_of_ones)
+        dev_Ht_of_ones = dev_Ht_of_ones.clip(clipValue)  # Avoid divide by zero and crazy high guesses outside measured region, 0.3 is emperically chosen
+        self.backend.freeMemory()
+
+        return imFormationModel, dev_Ht_of_ones
+
+    def _deconvolveVolume(self, data, reconShape, imFormationModel, dev_Ht_of_ones, iterations, gradientConsent,
+                          saveIterations, seed, tp, acceleration='Off', convergenceMetric='Relative change',
+                          tolerance=None):
+        """Run the deconvolution iterations on one volume of data (a timepoint or a tile of it), or on a batch of
+        volumes stacked along a first axis. The normalization is the same for all volumes and is broadcast.
+        With 'Biggs-Andrews' acceleration each iteration starts from the estimate extrapolated along the previous
+        update direction. The convergence metric is calculated every iteration and the iterations stop early when it
+        gets below the tolerance, for batches when it is below for all volumes. Returns the final reconstruction, a
+        list of the reconstructions at the iterations in saveIterations and the list of convergence metric values"""
+        xp = self.xp
+        dataShape = data.shape
+        reconShape = tuple(dataShape[:-3]) + tuple(reconShape)
+        dev_dataCanvas = xp.zeros(dataShape, dtype=float)
+        dev_sampleCanvas = xp.zeros(reconShape, dtype=float)
+        if gradientConsent:
+            dev_dataCanvas2 = xp.zeros(dataShape, dtype=float)
+            dev_sampleCanvas2 = xp.zeros(reconShape, dtype=float)
+        progression = []
+        convergence = []
+
+        dev_data = xp.array(data)
+        if gradientConsent:
+            dev_dataBin1 = xp.zeros_like(dev_data)
+            dev_dataBin2 = xp.zeros_like(dev_data)
+        dev_currentReconstruction = xp.ones(reconShape, dtype=float)
+        dev_update = xp.zeros(reconShape, dtype=float) #Difference between new and previous (extrapolated) estimate
+        if acceleration == 'Biggs-Andrews':
+            dev_previousReconstruction = xp.ones(reconShape, dtype=float)
+            dev_previousUpdate = xp.zeros(reconShape, dtype=float)
+        elif acceleration != 'Off':
+            raise ValueError(f'Unknown acceleration "{acceleration}", should be "Off" or "Biggs-Andrews"')
+        for i in range(iterations):
+            print('Timepoint: ', tp, ', Iteration: ', i)
+            if acceleration == 'Biggs-Andrews':
+                self._extrapolate(dev_currentReconstruction, dev_previousReconstruction, dev_update,
+                                  dev_previousUpdate, i)
+            """Zero arrays"""
+            print('Made arrays')
+            t1 = time.time()
+            imFormationModel.forward(dev_currentReconstruction, dev_dataCanvas)
+            self.backend.synchronize()
+            t2 = time.time()
+            elapsed = t2-t1
+            print('Calculated dfg, elapsed = ', elapsed)
+            if convergenceMetric == 'I-divergence':
+                convergence.append(self._getIDivergence(dev_data, dev_dataCanvas))
 
-            dev_data = cp.array(data)
             if gradientConsent:
-                dev_dataBin1 = cp.zeros_like(dev_data)
-                dev_dataBin2 = cp.zeros_like(dev_data)
-            dev_currentReconstruction = cp.ones(reconShape, dtype=float)
-            for i in range(iterations):
-                print('Timepoint: ', tp, ', Iteration: ', i)
-                """Zero arrays"""
-                print('Made arrays')
+                dev_dataBin1 = xp.zeros_like(dev_data)
+                dev_dataBin2 = xp.zeros_like(dev_data)
+                self.backend.binomialSplit(dev_data, dev_dataBin1, dev_dataBin2, 0.5, seed=i+seed)
+                xp.divide(dev_dataCanvas, 2, dev_dataCanvas) #since data is devided into two bins
+                xp.divide(dev_dataBin2, dev_dataCanvas, dev_dataCanvas2)
+                xp.divide(dev_dataBin1, dev_dataCanvas, dev_dataCanvas) #dataCanvas now stores the error
+
+                print('Calculated error in gradient consent')
+                imFormationModel.adjoint(dev_dataCanvas, dev_sampleCanvas)  # Sample canvas now stores the 1st distributed error
+                self.backend.synchronize()
+                xp.divide(dev_sampleCanvas, dev_Ht_of_ones,
+                          out=dev_sampleCanvas)  # Sample canvas now stores the 1st "correction factor"
+                imFormationModel.adjoint(dev_dataCanvas2, dev_sampleCanvas2)  # Sample canvas now stores the 2nd distributed error
+                xp.divide(dev_sampleCanvas2, dev_Ht_of_ones,
+                          out=dev_sampleCanvas2)  # Sample canvas now stores the 2nd "correction factor"
+                self.backend.synchronize()
+                if i == 99:
+                    DataIO_tools.save_data(self.backend.asnumpy(dev_sampleCanvas), 'Sample_Canvas.tif')
+                    DataIO_tools.save_data(self.backend.asnumpy(dev_sampleCanvas2), 'Sample_Canvas2.tif')
+                """Check for which voxels the update factors agree. If they agree, take the mean, else take 1."""
+                self.backend.doGradientConsent(dev_sampleCanvas, dev_sampleCanvas2)
+                self.backend.synchronize()
+                if i == 15:
+                    DataIO_tools.save_data(self.backend.asnumpy(dev_sampleCanvas), 'Sample_Canvas_after.tif')
+            else:
+                xp.divide(dev_data, dev_dataCanvas, dev_dataCanvas) #dataCanvas now stores the error
+                print('Calculated error')
                 t1 = time.time()
-                convTransform[
-                    (data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x), (
-                        threadsperblock, threadsperblock, threadsperblock)](
-                    dev_dataCanvas, dev_currentReconstruction, dev_K, dev_M)
-                cuda.synchronize()
+                imFormationModel.adjoint(dev_dataCanvas, dev_sampleCanvas) #Sample canvas now stores the distributed error
+                self.backend.synchronize()
                 t2 = time.time()
                 elapsed = t2-t1
-                print('Calculated dfg, elapsed = ', elapsed)
-
-                if gradientConsent:
-                    dev_dataBin1 = cp.zeros_like(dev_data)
-                    dev_dataBin2 = cp.zeros_like(dev_data)
-                    rng_states = create_xoroshiro128p_states(
-                        threadsperblock**3 * data_blocks_per_grid_z * data_blocks_per_grid_y * data_blocks_per_grid_x, seed=i+tp*iterations)
-                    gpuBinomialSplit[
-                        (data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x), (
-                            threadsperblock, threadsperblock, threadsperblock)](dev_data, dev_dataBin1, dev_dataBin2, 0.5, rng_states)
-                    cp.divide(dev_dataCanvas, 2, dev_dataCanvas) #since data is devided into two bins
-                    cp.divide(dev_dataBin2, dev_dataCanvas, dev_dataCanvas2)
-                    cp.divide(dev_dataBin1, dev_dataCanvas, dev_dataCanvas) #dataCanvas now stores the error
-
-                    print('Calculated error in gradient consent')
-                    invConvTransform[
-                        (data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x), (
-                            threadsperblock, threadsperblock, threadsperblock)](
-                        dev_dataCanvas, dev_sampleCanvas, dev_K, dev_M)  # Sample canvas now stores the 1st distributed error
-                    cuda.synchronize()
-                    cp.divide(dev_sampleCanvas, dev_Ht_of_ones,
-                              out=dev_sampleCanvas)  # Sample canvas now stores the 1st "correction factor"
-                    invConvTransform[
-                        (data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x), (
-                            threadsperblock, threadsperblock, threadsperblock)](
-                        dev_dataCanvas2, dev_sampleCanvas2, dev_K, dev_M)  # Sample canvas now stores the 2nd distributed error
-                    cp.divide(dev_sampleCanvas2, dev_Ht_of_ones,
-                              out=dev_sampleCanvas2)  # Sample canvas now stores the 2nd "correction factor"
-                    cuda.synchronize()
-                    if i == 99:
-                        DataIO_tools.save_data(cp.asnumpy(dev_sampleCanvas), 'Sample_Canvas.tif')
-                        DataIO_tools.save_data(cp.asnumpy(dev_sampleCanvas2), 'Sample_Canvas2.tif')
-                    """Check for which voxels the update factors agree. If they agree, take the mean, else take 1."""
-                    gpuDoGradientConsent[
-                        (sample_blocks_per_grid_z, sample_blocks_per_grid_y, sample_blocks_per_grid_x), (
-                            threadsperblock, threadsperblock, threadsperblock)](dev_sampleCanvas, dev_sampleCanvas2)
-                    cuda.synchronize()
-                    if i == 15:
-                        DataIO_tools.save_data(cp.asnumpy(dev_sampleCanvas), 'Sample_Canvas_after.tif')
-                else:
-                    cp.divide(dev_data, dev_dataCanvas, dev_dataCanvas) #dataCanvas now stores the error
-                    print('Calculated error')
-                    t1 = time.time()
-                    invConvTransform[
-                        (data_blocks_per_grid_z, data_blocks_per_grid_y, data_blocks_per_grid_x), (
-                            threadsperblock, threadsperblock, threadsperblock)](
-                        dev_dataCanvas, dev_sampleCanvas, dev_K, dev_M) #Sample canvas now stores the distributed error
-                    cuda.synchronize()
-                    t2 = time.time()
-                    elapsed = t2-t1
-                    print('Distributed error, elapsed = ', elapsed)
-                    cp.divide(dev_sampleCanvas, dev_Ht_of_ones, out=dev_sampleCanvas) #Sample canvas now stores the "correction factor"
-
-                cp.multiply(dev_currentReconstruction, dev_sampleCanvas, out=dev_currentReconstruction)
-                if saveMode == 'Progression' and (progressionMode == 'All' or i in indices):
-                    saveRecons.append(cp.asnumpy(dev_currentReconstruction))
-
-            finalReconstruction = cp.asnumpy(dev_currentReconstruction)
-            print('Deconvolution finished at t = ', time.time() - startTime)
-            if saveToDisc:
-                vx_size = (reconOptionsDict['Reconstruction voxel size [nm]'],)*3
-                if saveMode == 'Final':
-                    saveDataPath = os.path.join(saveFolder, saveName + '_Timepoint_' + str(tp) + '_FinalDeconvolved.tif')
-                    DataIO_tools.save_data(finalReconstruction, saveDataPath, vx_size=vx_size, unit='nm')
-                elif saveMode == 'Progression':
-                    saveRecons = np.asarray(saveRecons)
-                    saveDataPath = os.path.join(saveFolder, saveName + '_DeconvolutionProgression.tif')
-                    DataIO_tools.save_data(saveRecons, saveDataPath, vx_size=vx_size, unit='nm')
-                saveParamsPath = os.path.join(saveFolder, saveName + '_DeconvolutionParameters.json')
-                saveParamDict = {'Data Parameters': dataPropertiesDict,
-                                 'Reconstruction parameters': reconOptionsDict,
-                                 'Image formation model parameters': imFormationModelParameters,
-                                 'Algorithmic parameters': algOptionsDict}
-                with open(saveParamsPath, 'w') as fp:
-                    json.dump(saveParamDict, fp, indent=4)
-                    fp.close()
-
-        del dev_currentReconstruction
-        del dev_dataCanvas
-        del dev_sampleCanvas
-        self.mempool.free_all_blocks()
+                print('Distributed error, elapsed = ', elapsed)
+                xp.divide(dev_sampleCanvas, dev_Ht_of_ones, out=dev_sampleCanvas) #Sample canvas now stores the "correction factor"
+
+            xp.subtract(dev_sampleCanvas, 1, out=dev_update)
+            xp.multiply(dev_update, dev_currentReconstruction, out=dev_update)
+            if convergenceMetric == 'Relative change':
+                convergence.append(self._getRelativeChange(dev_currentReconstruction, dev_update))
+            xp.multiply(dev_currentReconstruction, dev_sampleCanvas, out=dev_currentReconstruction)
+            if i in saveIterations:
+                progression.append(self.backend.asnumpy(dev_currentReconstruction))
+
+            if self._isConverged(convergence, convergenceMetric, tolerance):
+                print('Converged after ', i + 1, ' iterations, ', convergenceMetric, ' = ', convergence[-1])
+                """Keep the number of saved reconstructions independent of when the iterations stopped"""
+                progression.extend(self.backend.asnumpy(dev_currentReconstruction)
+                                   for j in saveIterations if j > i)
+                break
+
+        finalReconstruction = self.backend.asnumpy(dev_currentReconstruction)
+        del dev_currentReconstruction, dev_dataCanvas, dev_sampleCanvas, dev_data, dev_update
+        if gradientConsent:
+            del dev_dataCanvas2, dev_sampleCanvas2, dev_dataBin1, dev_dataBin2
+        if acceleration == 'Biggs-Andrews':
+            del dev_previousReconstruction, dev_previousUpdate
+        self.backend.freeMemory()
+
+        return finalReconstruction, progression, convergence
+
+    def _extrapolate(self, dev_currentReconstruction, dev_previousReconstruction, dev_update, dev_previousUpdate,
+                     iteration):
+        """Biggs-Andrews vector extrapolation, y = x_k + alpha * (x_k - x_k-1), with alpha estimated from the
+        correlation of the last two updates and limited to [0, 1). The extrapolated estimate replaces the current one
+        and is clipped to stay positive. The update arrays hold the updates of the last two iterations."""
+        xp = self.xp
+        axes = (-3, -2, -1) #Separate alpha for each volume of a batch
+        if iteration >= 2:
+            alpha = xp.sum(dev_update * dev_previousUpdate, axis=axes, keepdims=True) / \
+                    (xp.sum(dev_previousUpdate * dev_previousUpdate, axis=axes, keepdims=True) + 1e-30)
+            alpha = xp.clip(alpha, 0, 0.99)
+        else:
+            alpha = 0
+        dev_previousUpdate[...] = dev_update
+        xp.subtract(dev_currentReconstruction, dev_previousReconstruction, out=dev_update) #Used as temporary here
+        dev_previousReconstruction[...] = dev_currentReconstruction
+        dev_currentReconstruction += alpha * dev_update
+        xp.clip(dev_currentReconstruction, 1e-6, None, out=dev_currentReconstruction)
+
+    def _getRelativeChange(self, dev_reconstruction, dev_update):
+        """Norm of the update relative to the norm of the estimate it was applied to, max over a batch"""
+        xp = self.xp
+        axes = (-3, -2, -1)
+        relChange = xp.sqrt(xp.sum(dev_update**2, axis=axes) / xp.sum(dev_reconstruction**2, axis=axes))
+        return float(xp.max(relChange))
+
+    def _getIDivergence(self, dev_data, dev_expectedData):
+        """I-divergence (Csiszar) between the data and the data expected from the current estimate, which
+        Richardson-Lucy minimizes, normalized by the total counts. Max over a batch"""
+        xp = self.xp
+        axes = (-3, -2, -1)
+        eps = 1e-12
+        divergence = xp.sum(dev_data * xp.log((dev_data + eps) / (dev_expectedData + eps)) - dev_data
+                            + dev_expectedData, axis=axes) / xp.sum(dev_data, axis=axes)
+        return float(xp.max(divergence))
+
+    def _isConverged(self, convergence, convergenceMetric, tolerance):
+        """Relative change converges when it drops below the tolerance, the I-divergence when its relative decrease
+        between iterations does"""
+        if tolerance is None or len(convergence) == 0:
+            return False
+        if convergenceMetric == 'Relative change':
+            return convergence[-1] < tolerance
+        elif convergenceMetric == 'I-divergence':
+            return len(convergence) > 1 and (convergence[-2] - convergence[-1]) < tolerance * abs(convergence[-2])
+        else:
+            return False
 
-        return finalReconstruction
+    def _getConvergenceOptions(self, algOptionsDict):
+        """Acceleration is 'Off' or 'Biggs-Andrews'. The convergence metric, 'Relative change' or 'I-divergence', is
+        recorded every iteration. If a tolerance is given the iterations stop when the metric converges, 'Iterations'
+        is then the maximum number of iterations."""
+        try:
+            acceleration = algOptionsDict['Acceleration']
+        except KeyError:
+            acceleration = 'Off'
+        try:
+            convergenceMetric = algOptionsDict['Convergence metric']
+        except KeyError:
+            convergenceMetric = 'Relative change'
+        if convergenceMetric not in ('Relative change', 'I-divergence'):
+            raise ValueError(f'Unknown convergence metric "{convergenceMetric}", should be "Relative change" or '
+                             f'"I-divergence"')
+        try:
+            tolerance = algOptionsDict['Convergence tolerance']
+        except KeyError:
+            tolerance = None
+
+        return acceleration, convergenceMetric, tolerance
+
+    def _getBatchSize(self, algOptionsDict, tiles, timepoints, dataShape, reconShape, modelType, gradientConsent,
+                      kernelShape):
+        """Number of timepoints deconvolved together, limited by the memory available. Batching is only used when the
+        data is not tiled, since tiling means that a single timepoint already does not fit."""
+        try:
+            batchSize = algOptionsDict['Batch timepoints']
+        except KeyError:
+            batchSize = 1
+        batchSize = max(min(int(batchSize), len(timepoints)), 1)
+        if batchSize == 1:
+            return 1
+        if len(tiles) > 1:
+            print('Data is tiled, timepoints are deconvolved one at a time')
+            return 1
+        freeMem = self.backend.getFreeMemory()
+        bytesPerTimepoint = self._estimateMemory(dataShape, reconShape, modelType, gradientConsent,
+                                                 self._getConvergenceOptions(algOptionsDict)[0])
+        scatterBytes = self._estimateScatterMemory(reconShape, modelType, kernelShape, algOptionsDict)
+        maxBatchSize = max(int((0.8 * freeMem - scatterBytes) / bytesPerTimepoint), 1)
+        if maxBatchSize < batchSize:
+            print('Not enough memory for batches of ', batchSize, ' timepoints, using batches of ', maxBatchSize)
+            batchSize = maxBatchSize
+        print('Deconvolving ', batchSize, ' timepoints per batch')
+
+        return batchSize
+
+    def _estimateMemory(self, dataShape, reconShape, modelType, gradientConsent, acceleration='Off'):
+        """Rough estimate of the memory in bytes needed to deconvolve one volume"""
+        nDataVolumes = 4 if gradientConsent else 2 #Data and data canvas, plus bins and second canvas
+        nSampleVolumes = 5 if gradientConsent else 4 #Ht of ones, reconstruction, update and sample canvas, plus second canvas
+        if acceleration == 'Biggs-Andrews':
+            nSampleVolumes += 2 #Previous reconstruction and update
+        if modelType == 'FFT':
+            nSampleVolumes += 8 #Padded canvas, kernel FFTs and FFT temporaries
+
+        return 8 * (nDataVolumes * np.prod(dataShape) + nSampleVolumes * np.prod(reconShape))
+
+    def _estimateScatterMemory(self, reconShape, modelType, kernelShape, algOptionsDict):
+        """Memory in bytes of the volumes the scatter transforms of the backend distribute into, one per thread on the
+        CPU. They are allocated once per transform, also when timepoints are batched. The FFT model scatters into the
+        padded canvas."""
+        if modelType == 'FFT':
+            try:
+                fftCanvas = algOptionsDict['FFT canvas']
+            except KeyError:
+                fftCanvas = 'Power of two'
+            scatterShape = FFTModel.makeCanvasShape(reconShape, kernelShape, fftCanvas)
+        else:
+            scatterShape = reconShape
+        return 8 * self.backend.getNrScatterBuffers() * np.prod(scatterShape)
+
+    def _getMaxTileColumns(self, dataShape, reconShape, tiltAxis, modelType, gradientConsent, algOptionsDict,
+                           kernelShape):
+        """Maximum number of data columns along the tilt axis that can be deconvolved at once. Returns None if tiling
+        is turned off. The memory usage is a rough estimate."""
+        try:
+            tiling = algOptionsDict['Tiling']
+        except KeyError:
+            tiling = 'Auto'
+        if tiling == 'Off':
+            return None
+        elif tiling != 'Auto':
+            raise ValueError(f'Unknown tiling "{tiling}", should be "Auto" or "Off"')
+        try:
+            return algOptionsDict['Tile size [px]']
+        except KeyError:
+            pass
+
+        bytesPerColumn = (self._estimateMemory(dataShape, reconShape, modelType, gradientConsent,
+                                               self._getConvergenceOptions(algOptionsDict)[0]) +
+                          self._estimateScatterMemory(reconShape, modelType, kernelShape, algOptionsDict)) / \
+            dataShape[tiltAxis]
+        freeMem = self.backend.getFreeMemory()
+        maxTileColumns = int(0.8 * freeMem / bytesPerColumn)
+        print('Free memory = ', freeMem / 1e9, ' GB, max tile size = ', maxTileColumns, ' columns')
+
+        return maxTileColumns
+
+    def _makeImFormationModel(self, modelType, K, M, reconShape, backprojection, fftCanvas):
+        """'Direct' convolves with the kernel in real space for every data voxel, 'FFT' convolves the whole sample
+        volume by FFT followed by a nearest neighbour transform, which is faster for larger kernels."""
+        if modelType == 'Direct':
+            return DirectModel(K, M, reconShape, self.backend, backprojection=backprojection)
+        elif modelType == 'FFT':
+            return FFTModel(K, M, reconShape, self.backend, canvasMode=fftCanvas)
+        else:
+            raise ValueError(f'Unknown image formation model "{modelType}", should be "Direct" or "FFT"')
+
+    def _getPrefetch(self, algOptionsDict, timepoints):
+        """Prefetching only helps if there is a next timepoint (or batch of timepoints) to load"""
+        try:
+            prefetch = algOptionsDict['Prefetch timepoints']
+        except KeyError:
+            prefetch = True
+        return prefetch and len(timepoints) > 1
+
+    def _loadTimepoints(self, reconOptionsDict, timepoints, xp, pin, stack):
+        """Load a batch of timepoints, stacked along a first axis if stack is True, else the batch holds one
+        timepoint which is returned as is"""
+        if not stack:
+            return self._loadTimepoint(reconOptionsDict, timepoints[0], xp, pin)
+        data = xp.stack([self._loadTimepoint(reconOptionsDict, tp, xp, pin=False) for tp in timepoints])
+        if pin and xp is np:
+            data = self.backend.pinHostArray(data)
+        return data
+
+    def _loadTimepoint(self, reconOptionsDict, tp, xp, pin):
+        """Load and preprocess a timepoint, runs in the prefetching thread. Data that is copied to the device in one
+        piece is pinned to speed up the copy."""
+        data = self.DF.getPreprocessedData(reconOptionsDict, timepoints=tp, xp=xp)
+        assert self._checkData(data), "Something wrong with data"
+        if pin and xp is np:
+            data = self.backend.pinHostArray(data)
+        return data
+
+    def _saveParameters(self, saveParamsPath, saveParamDict):
+        with open(saveParamsPath, 'w') as fp:
+            json.dump(saveParamDict, fp, indent=4)
+            fp.close()
 
     def _checkData(self, data):
         #ToDo: Insert relevent checks here
@@ -313,32 +712,6 @@ class Deconvolver:
 
         return timepoints
 
-@cuda.jit
-def gpuBinomialSplit(rawData, bin1Data, bin2Data, p, rng_states):
-    idz, idy, idx = cuda.grid(3)
-    if idz < rawData.shape[0] and idy < rawData.shape[1] and idx < rawData.shape[2]:
-        n = idz*cuda.gridsize(3)[1]*cuda.gridsize(3)[2] + idy*cuda.gridsize(3)[2] + idx
-        for _ in range(rawData[idz, idy, idx]):
-            r = xoroshiro128p_uniform_float32(rng_states, n)
-            if r < p:
-                bin1Data[idz, idy, idx] += 1
-            else:
-                bin2Data[idz, idy, idx] += 1
-
-@cuda.jit
-def gpuDoGradientConsent(updateFactors1, updateFactors2):
-    idz, idy, idx = cuda.grid(3)
-    if idz < updateFactors1.shape[0] and idy < updateFactors1.shape[1] and idx < updateFactors1.shape[2]:
-        uf1 = updateFactors1[idz, idy, idx]
-        uf2 = updateFactors2[idz, idy, idx]
-        s1 = uf1 - 1
-        s2 = uf2 - 1
-        if s1 / abs(s1) == s2 / abs(s2):
-            updateFactors1[idz, idy, idx] = 0.5*(uf1 + uf2)
-        else:
-            updateFactors1[idz, idy, idx] = 1
-
-
 def fuseTimePoints(folderPath, fileNamePart1, nrArray, fileNamePart2, averageTimepoints=False):
     fullPath = os.path.join(folderPath, fileNamePart1 + str(nrArray[0]) + fileNamePart2)
     print('Loading path: ', fullPath)
@@ -381,6 +754,15 @@ reconOptionsDict = {'Reconstruction voxel size [nm]': 100,
                     'Average timepoints': True}
 
 algOptionsDict = {'Gradient consent': False,
+                  'Backprojection': 'Gather', #'Gather' or 'Scatter' (atomicAdd based, slower), only used by the direct model
+                  'Model': 'Direct', #'Direct' or 'FFT' (convolution by FFT, faster for large kernels)
+                  'FFT canvas': 'Power of two', #'Power of two' or 'Fast length', padded canvas size for the FFT model
+                  'Tiling': 'Auto', #'Auto' splits the data along the tilt axis if it does not fit in memory, or 'Off'
+                  'Prefetch timepoints': True, #Load the next timepoint and save the previous one while processing
+                  'Batch timepoints': 1, #Deconvolve several timepoints at once, faster for small volumes
+                  'Acceleration': 'Off', #'Off' or 'Biggs-Andrews' (extrapolates the estimate, fewer iterations needed)
+                  'Convergence metric': 'Relative change', #'Relative change' or 'I-divergence', saved for every iteration
+                  'Convergence tolerance': None, #Stop when the metric converges, None runs all iterations
                   'Clip factor for kernel cropping': 0.01,
                   'Iterations': 10}
 
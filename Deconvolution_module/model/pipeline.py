@@ -0,0 +1,62 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TimepointPrefetcher:
+    """Iterate over the timepoints while loading the next ones in a background thread, such that reading and
+    preprocessing timepoint t+1 overlaps with the reconstruction of timepoint t. loadFunction takes a timepoint and
+    returns its data, it is only ever called from the loading thread and in the order of the timepoints."""
+
+    def __init__(self, loadFunction, timepoints, prefetch=1):
+        self.loadFunction = loadFunction
+        self.timepoints = list(timepoints)
+        self.prefetch = prefetch
+
+    def __len__(self):
+        return len(self.timepoints)
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = deque()
+        try:
+            for tp in self.timepoints:
+                pending.append((tp, executor.submit(self.loadFunction, tp)))
+                if len(pending) > self.prefetch:
+                    loadedTp, future = pending.popleft()
+                    yield loadedTp, future.result()
+            while pending:
+                loadedTp, future = pending.popleft()
+                yield loadedTp, future.result()
+        finally:
+            """Don't load more timepoints if the loop is left early"""
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class AsyncWriter:
+    """Run save functions in a background thread, such that writing timepoint t-1 to disc overlaps with the
+    reconstruction of timepoint t. At most maxPending saves are queued, submit blocks until the oldest one is done
+    if there are more. Errors raised while saving are raised again in the calling thread on submit or close."""
+
+    def __init__(self, maxPending=2):
+        self.maxPending = maxPending
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()
+
+    def submit(self, saveFunction, *args, **kwargs):
+        while len(self.pending) >= self.maxPending:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(saveFunction, *args, **kwargs))
+
+    def close(self):
+        """Wait for all queued saves to finish"""
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,106 @@
+import numpy as np
+import numba
+from numba import prange
+
+"""Preprocessing of PLSR data before reconstruction, shared by imreconstruct and the deconvolution
+module. In PLSR interleaved data the frames are acquired plane by plane within each cycle, frame
+c * planesInCycle + p being plane p of cycle c, and they are restacked to cycle by cycle within
+each plane. The functions take numpy arrays, or cupy arrays if xp is cupy, and avoid copies of the
+full stack: restacking goes through a reshape/transpose view, bleaching correction factors are
+broadcast over the frames, and results can be written to a preallocated output array or, for
+bleaching correction, to the data itself.
+
+imswitch/imreconstruct/model/preprocessing.py is the source of this module. The deconvolution
+module, which does not depend on imswitch, has a copy in model/preprocessing.py, which its
+tests/test_preprocessing.py checks to be identical. Change the source and copy it over."""
+
+
+def restackedView(data, cycles, planesInCycle):
+    """View of PLSR interleaved frames with shape (planesInCycle, cycles, y, x), without copying the
+    data"""
+    if data.shape[0] != cycles * planesInCycle:
+        raise ValueError(f'{data.shape[0]} frames do not match {cycles} cycles of'
+                         f' {planesInCycle} planes')
+    return data.reshape((cycles, planesInCycle) + data.shape[1:]).swapaxes(0, 1)
+
+
+def restack(data, cycles, planesInCycle, factors=None, out=None, parallel=False, xp=np):
+    """Reorder PLSR interleaved frames to cycle by cycle within each plane. If factors are given,
+    frame i of the data is multiplied by factors[i] in the same pass, eg. the bleaching correction
+    factors. The result is written to out if given, which must not overlap the data, otherwise to a
+    new array of the data type, or at least float32 if factors are given. If parallel, numpy data is
+    restacked by a numba parallel kernel."""
+    view = restackedView(data, cycles, planesInCycle)
+    if out is None:
+        dtype = data.dtype if factors is None else xp.result_type(data.dtype, xp.float32)
+        out = xp.empty(data.shape, dtype=dtype)
+    outView = out.reshape(view.shape)
+
+    if parallel and xp is np:
+        if factors is None:
+            factors = np.ones(len(data), dtype=np.float32)
+        _restackKernel(np.asarray(data).reshape((cycles, planesInCycle) + data.shape[1:]),
+                       np.asarray(factors).reshape(cycles, planesInCycle), outView)
+    elif factors is None:
+        outView[...] = view
+    else:
+        frameFactors = factors.reshape(cycles, planesInCycle).T.astype(out.dtype)
+        xp.multiply(view, frameFactors[:, :, None, None], out=outView, casting='unsafe')
+    return out
+
+
+def bleachingFactors(data, blockFrames=64, xp=np):
+    """Factors that correct each frame for bleaching, from the total intensity of the frame relative
+    to the first. The frames are summed blockFrames at a time, such that the data can also be an
+    array that is read when sliced, eg. an h5py dataset."""
+    energy = xp.concatenate([xp.sum(xp.asarray(data[start:start + blockFrames]), axis=(1, 2))
+                             for start in range(0, len(data), blockFrames)])
+    return (energy[0] / energy) ** 4
+
+
+def bleachingCorrection(data, factors=None, out=None, xp=np):
+    """Multiply each frame with its bleaching correction factor. The result is written to out if
+    given, which may be the data itself to correct in place, otherwise to a new array of the data
+    type or at least float32."""
+    if factors is None:
+        factors = bleachingFactors(data, xp=xp)
+    if out is None:
+        out = xp.empty(data.shape, dtype=xp.result_type(data.dtype, xp.float32))
+    frameFactors = factors.astype(out.dtype).reshape((len(data),) + (1,) * (data.ndim - 1))
+    xp.multiply(data, frameFactors, out=out, casting='unsafe')
+    return out
+
+
+def averageTimepoints(data, timepoints, factors=None, out=None, dtype=np.float32, xp=np):
+    """Average of the frames over the timepoints, optionally multiplying frame i of the data by
+    factors[i] first. The timepoints are added one at a time to out, or to a new array of dtype,
+    such that no copy of the whole data is made."""
+    framesInTimepoint = len(data) // timepoints
+    if framesInTimepoint * timepoints != len(data):
+        raise ValueError(f'{len(data)} frames can not be split into {timepoints} timepoints')
+    if out is None:
+        out = xp.zeros((framesInTimepoint,) + data.shape[1:], dtype=dtype)
+    else:
+        out.fill(0)
+
+    for tp in range(timepoints):
+        tpSlice = slice(tp * framesInTimepoint, (tp + 1) * framesInTimepoint)
+        if factors is None:
+            out += data[tpSlice]
+        else:
+            out += data[tpSlice] * factors[tpSlice].astype(out.dtype)[:, None, None]
+    out /= timepoints
+    return out
+
+
+@numba.njit(parallel=True)
+def _restackKernel(interleaved, factors, restacked):
+    """restacked[p, c] = factors[c, p] * interleaved[c, p], one frame per iteration"""
+    cycles, planesInCycle = interleaved.shape[0], interleaved.shape[1]
+    for i in prange(cycles * planesInCycle):
+        p = i // cycles
+        c = i - p * cycles
+        factor = factors[c, p]
+        for y in range(interleaved.shape[2]):
+            for x in range(interleaved.shape[3]):
+                restacked[p, c, y, x] = interleaved[c, p, y, x] * factor
@@ -0,0 +1,105 @@
+import numpy as np
+from fractions import Fraction
+
+
+class Tile:
+    """A block of data along the tilt axis together with the block of the reconstruction that it covers. The weights
+    are used when blending the tile into the full reconstruction, along the x axis of the sample."""
+
+    def __init__(self, tiltAxis, dataStart, dataStop, sampleStart, sampleStop, reconShape):
+        self.tiltAxis = tiltAxis
+        self.dataStart = dataStart
+        self.dataStop = dataStop
+        self.sampleStart = sampleStart
+        self.sampleStop = sampleStop
+        self.reconShape = (int(reconShape[0]), int(reconShape[1]), sampleStop - sampleStart)
+        self.weights = np.ones(sampleStop - sampleStart)
+
+    def getDataShape(self, dataShape):
+        shape = [int(s) for s in dataShape]
+        shape[self.tiltAxis] = self.dataStop - self.dataStart
+        return tuple(shape)
+
+    def getData(self, data):
+        """Data is a volume or a batch of volumes stacked along a first axis"""
+        index = [slice(None)] * data.ndim
+        index[self.tiltAxis - 3] = slice(self.dataStart, self.dataStop)
+        return data[tuple(index)]
+
+
+class TileHandler:
+    """Split the data into overlapping tiles along the tilt axis, to reconstruct volumes that do not fit in memory.
+    The tilt axis of the data only maps to the x axis of the sample and vice versa, so each tile can be reconstructed
+    independently with the same transform matrix. Tile borders are placed on data indices that map exactly onto a
+    sample voxel, such that the tiles share the sample grid of the full reconstruction."""
+
+    def makeTiles(self, dataShape, reconShape, M, tiltAxis, margin, maxTileColumns=None):
+        """Margin is given in sample voxels along x, eg. the half size of the kernel, and is the width at the inner
+        borders of a tile where its reconstruction is invalid because the data and sample outside the tile are missing.
+        Each tile is extended by twice the margin on both sides, such that neighbouring tiles are blended over a zone
+        of valid reconstruction in both tiles and the margins get zero weight. maxTileColumns is the maximum size of a
+        tile along the tilt axis of the data, including the extensions. If None or larger than the data, a single tile
+        covering all data is returned."""
+        scale = self._getTiltAxisScale(M, tiltAxis)
+        nrColumns = int(dataShape[tiltAxis])
+        if maxTileColumns is None or maxTileColumns >= nrColumns:
+            return [Tile(tiltAxis, 0, nrColumns, 0, reconShape[2], reconShape)]
+
+        alignment = self._getAlignment(scale, nrColumns)
+        overlapColumns = int(np.ceil(np.ceil(2 * margin / scale) / alignment) * alignment)
+        coreColumns = (maxTileColumns - 2 * overlapColumns) // alignment * alignment
+        if coreColumns < max(2 * overlapColumns, alignment) and alignment > 1:
+            print('Tiles too small to align borders to sample grid, tiles may be shifted by up to half a voxel')
+            alignment = 1
+            overlapColumns = int(np.ceil(2 * margin / scale))
+            coreColumns = maxTileColumns - 2 * overlapColumns
+        if coreColumns < max(2 * overlapColumns, alignment):
+            raise RuntimeError(f'Tiles of {maxTileColumns} columns are too small for an overlap of {overlapColumns} '
+                               f'columns, not enough memory available')
+        """Distribute the columns evenly over the tiles"""
+        nrTiles = int(np.ceil(nrColumns / coreColumns))
+        coreColumns = int(np.ceil(nrColumns / nrTiles / alignment) * alignment)
+
+        tiles = []
+        for coreStart in range(0, nrColumns, coreColumns):
+            dataStart = max(coreStart - overlapColumns, 0)
+            dataStop = min(coreStart + coreColumns + overlapColumns, nrColumns)
+            sampleStart = int(round(scale * dataStart))
+            sampleStop = min(sampleStart + int(np.ceil(scale * (dataStop - dataStart))), reconShape[2])
+            tiles.append(Tile(tiltAxis, dataStart, dataStop, sampleStart, sampleStop, reconShape))
+
+        """Zero weight in the margins and linear ramps, summing to one, over the rest of the region where
+        neighbouring tiles overlap"""
+        margin = int(np.ceil(margin))
+        for prevTile, nextTile in zip(tiles[:-1], tiles[1:]):
+            blendStart = nextTile.sampleStart + margin
+            blendStop = prevTile.sampleStop - margin
+            if blendStop <= blendStart:
+                raise RuntimeError(f'Overlap of tiles is too small for a margin of {margin} voxels')
+            ramp = (np.arange(blendStop - blendStart) + 0.5) / (blendStop - blendStart)
+            prevTile.weights[blendStop - prevTile.sampleStart:] = 0
+            prevTile.weights[blendStart - prevTile.sampleStart:blendStop - prevTile.sampleStart] *= 1 - ramp
+            nextTile.weights[:margin] = 0
+            nextTile.weights[margin:blendStop - nextTile.sampleStart] *= ramp
+        print('Split data into ', len(tiles), ' tiles of max ', maxTileColumns, ' columns along tilt axis')
+
+        return tiles
+
+    def blendTile(self, reconstruction, tileReconstruction, tile):
+        """Add the weighted tile reconstruction to the full reconstruction"""
+        reconstruction[..., tile.sampleStart:tile.sampleStop] += tileReconstruction * tile.weights
+
+    def _getTiltAxisScale(self, M, tiltAxis):
+        otherAxes = [a for a in range(3) if a != tiltAxis]
+        if not (np.allclose(M[:2, tiltAxis], 0) and np.allclose(M[2, otherAxes], 0)):
+            raise ValueError('Tilt axis of data does not map to x axis of sample only, can not tile the data')
+        return M[2, tiltAxis]
+
+    def _getAlignment(self, scale, nrColumns):
+        """Smallest step in data columns that corresponds to a whole number of sample voxels"""
+        fraction = Fraction(float(scale)).limit_denominator(nrColumns)
+        if abs(float(fraction) - scale) < 1e-9:
+            return fraction.denominator
+        else:
+            print('Tile borders can not be aligned to sample grid, tiles may be shifted by up to half a voxel')
+            return 1
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+"""Run from the Deconvolution_module folder: python -m pytest tests"""
+
+moduleFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+copyPath = os.path.join(moduleFolder, 'model', 'preprocessing.py')
+sourcePath = os.path.join(os.path.dirname(moduleFolder), 'ImSwitch-MultiSheetRESOLFT', 'imswitch', 'imreconstruct',
+                          'model', 'preprocessing.py')
+
+
+@pytest.mark.skipif(not os.path.isfile(sourcePath), reason='imswitch source tree not found next to the module')
+def test_preprocessingIsCopyOfImswitch():
+    """model/preprocessing.py must be identical to its source in imswitch, copy the source over if this fails"""
+    with open(copyPath, 'rb') as copyFile, open(sourcePath, 'rb') as sourceFile:
+        assert copyFile.read() == sourceFile.read()
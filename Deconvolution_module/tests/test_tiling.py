@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from model.backends import getBackend
+from model.imFormationModels import DirectModel
+from model.tiling import TileHandler
+from model.transformMatGeneration import TransformMatHandler
+
+"""Run from the Deconvolution_module folder: python -m pytest tests"""
+
+dataPropertiesDict = {'Camera pixel size [nm]': 116, 'Scan step size [nm]': 105, 'Tilt angle [deg]': 35,
+                      'Scan axis': 0, 'Tilt axis': 2}
+reconOptionsDict = {'Reconstruction voxel size [nm]': 58}
+dataShape = (12, 10, 200)
+
+
+@pytest.fixture(scope='module')
+def geometry():
+    rng = np.random.default_rng(1)
+    data = rng.poisson(50, dataShape).astype(float) + 1
+    K = rng.random((5, 5, 7))
+    K /= K.sum()
+    M = TransformMatHandler().makeSOLSTransformMatrix(dataPropertiesDict, {}, reconOptionsDict)
+    reconShape = np.ceil(np.matmul(M, dataShape)).astype(int)
+    return data, K, M, reconShape
+
+
+def richardsonLucyIteration(data, K, M, reconShape, clipValue, backend):
+    """One Richardson-Lucy iteration from a uniform estimate, as Deconvolver._deconvolveVolume"""
+    model = DirectModel(K, M, reconShape, backend)
+    Ht_of_ones = np.zeros(reconShape)
+    model.adjoint(np.ones(data.shape), Ht_of_ones)
+    estimate = np.ones(reconShape)
+    expected = np.zeros(data.shape)
+    model.forward(estimate, expected)
+    correction = np.zeros(reconShape)
+    model.adjoint(data / expected, correction)
+    return estimate * correction / Ht_of_ones.clip(clipValue)
+
+
+def test_weightsSumToOne(geometry):
+    data, K, M, reconShape = geometry
+    tiles = TileHandler().makeTiles(dataShape, reconShape, M, 2, K.shape[2], maxTileColumns=80)
+    assert len(tiles) > 1
+    weightSum = np.zeros(reconShape[2])
+    for tile in tiles:
+        assert np.all(tile.weights[:K.shape[2]] == 0) or tile.sampleStart == 0
+        weightSum[tile.sampleStart:tile.sampleStop] += tile.weights
+    np.testing.assert_allclose(weightSum, 1)
+
+
+def test_tiledEqualsUntiled(geometry):
+    data, K, M, reconShape = geometry
+    backend = getBackend('CPU')
+    tileHandler = TileHandler()
+    untiled = richardsonLucyIteration(data, K, M, reconShape, 1e-3, backend)
+
+    tiles = tileHandler.makeTiles(dataShape, reconShape, M, 2, K.shape[2], maxTileColumns=80)
+    assert len(tiles) > 1
+    tiled = np.zeros(reconShape)
+    for tile in tiles:
+        tileReconstruction = richardsonLucyIteration(tile.getData(data), K, M, tile.reconShape, 1e-3, backend)
+        tileHandler.blendTile(tiled, tileReconstruction, tile)
+    np.testing.assert_allclose(tiled, untiled, rtol=1e-9, atol=1e-9 * np.max(untiled))
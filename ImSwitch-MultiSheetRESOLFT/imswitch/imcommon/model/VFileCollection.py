@@ -1,10 +1,15 @@
+import os
+from collections import OrderedDict
 from dataclasses import dataclass
 from io import IOBase
 from typing import Union
 
 import h5py
+import numpy as np
+import psutil
 
 from imswitch.imcommon.framework import Signal, SignalInterface
+from .logging import initLogger
 
 
 @dataclass
@@ -14,24 +19,68 @@ class VFileItem:
     savedToDisk: bool
 
 
+def getDatasetArray(dataset):
+    """ Returns the data of an HDF5 dataset as a NumPy array. Datasets that
+    are stored in a single external raw file, such as those of RAM
+    recordings, are memory mapped copy-on-write instead of read into a copy,
+    so that large recordings can be used without copying them. """
+    external = dataset.external
+    if external is not None and len(external) == 1 and dataset.size > 0:
+        path, offset, _ = external[0]
+        return np.memmap(path, dtype=dataset.dtype, mode='c', offset=offset,
+                         shape=dataset.shape)
+    return np.array(dataset[:])
+
+
+def getBackingFiles(file):
+    """ Returns the paths of the HDF5 file and of the external raw files that
+    its datasets are stored in. """
+    paths = [file.filename]
+
+    def addExternalFiles(_, item):
+        if isinstance(item, h5py.Dataset) and item.external is not None:
+            paths.extend(path for path, _, _ in item.external if path not in paths)
+
+    file.visititems(addExternalFiles)
+    return paths
+
+
 class VFileCollection(SignalInterface):
     """ VFileCollection is a collection of virtual file-like objects. In
-    addition to holding the data, it also handles saving it to the disk. """
+    addition to holding the data, it also handles saving it to the disk.
+    HDF5 files that are not saved to disk when added are treated as held in
+    memory (e.g. on a tmpfs); when the data held in memory exceeds
+    maxMemoryBytes, the least recently used data is saved to disk and
+    removed from memory. """
 
     sigDataSet = Signal(str, VFileItem)  # (name, vFileItem)
     sigDataSavedToDisk = Signal(str, str)  # (name, filePath)
+    sigDataWillEvict = Signal(str)  # (name)
     sigDataWillRemove = Signal(str)  # (name)
     sigDataRemoved = Signal(str)  # (name)
 
-    def __init__(self):
+    def __init__(self, maxMemoryBytes=None):
         super().__init__()
-        self._data = {}
+        self.__logger = initLogger(self)
+        self._data = OrderedDict()  # Least recently used first
+        self._memoryFiles = {}
+        self.maxMemoryBytes = (maxMemoryBytes if maxMemoryBytes is not None
+                               else psutil.virtual_memory().total // 2)
 
     def getSavePath(self, name):
         """ Returns the path to which the file associated with the given name
         is saved. """
         return self._data[name].filePath
 
+    def getMemorySize(self, name):
+        """ Returns the number of bytes of memory held by the data with the
+        given name. """
+        data = self._data[name].data
+        if isinstance(data, IOBase):
+            return 0 if data.closed else data.getbuffer().nbytes
+        return sum(os.path.getsize(path) for path in self._memoryFiles.get(name, [])
+                   if os.path.exists(path))
+
     def saveToDisk(self, name):
         """ Saves the data with the given name to disk. """
         filePath = self.getSavePath(name)
@@ -40,14 +89,74 @@ class VFileCollection(SignalInterface):
             with open(filePath, 'wb') as file:
                 file.write(self._data[name].data.getbuffer())
         elif isinstance(self._data[name].data, h5py.File):
-            with open(filePath, 'wb') as file:
-                file.write(self._data[name].data.id.get_file_image())
+            if len(getBackingFiles(self._data[name].data)) > 1:
+                self._saveExternalToDisk(self._data[name].data, filePath)
+            else:
+                with open(filePath, 'wb') as file:
+                    file.write(self._data[name].data.id.get_file_image())
         else:
             raise TypeError(f'Data has unsupported type "{type(self._data[name].data).__name__}"')
 
+        self._data[name].savedToDisk = True
         self.sigDataSavedToDisk.emit(name, filePath)
 
+    def evict(self, name):
+        """ Saves the data with the given name to disk, unless it already is,
+        and frees the memory it holds. The data is then read from the disk. """
+        if not self._data[name].savedToDisk:
+            self.saveToDisk(name)
+
+        self.sigDataWillEvict.emit(name)
+        filePath = self._data[name].filePath
+        self._closeData(name)
+        self._data[name] = VFileItem(data=h5py.File(filePath, 'r'), filePath=filePath,
+                                     savedToDisk=True)
+
+    def _evictToBudget(self, keepName):
+        """ Evicts the least recently used data until the data in memory fits
+        in maxMemoryBytes, never evicting the data with name keepName. """
+        memorySizes = {name: self.getMemorySize(name) for name in self._data}
+        totalMemorySize = sum(memorySizes.values())
+        for name in list(self._data.keys()):
+            if totalMemorySize <= self.maxMemoryBytes:
+                break
+            if name == keepName or memorySizes[name] == 0:
+                continue
+            self.evict(name)
+            totalMemorySize -= memorySizes[name]
+
+    def _closeData(self, name):
+        """ Closes the data and deletes the files that held it in memory. """
+        self._data[name].data.close()
+        for path in self._memoryFiles.pop(name, []):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                # E.g. on Windows, while the file is still memory mapped
+                self.__logger.warning(f'Failed to delete "{path}"')
+
+    def _saveExternalToDisk(self, data, filePath):
+        """ Saves an HDF5 file with datasets stored in external raw files to a
+        single HDF5 file, copying the external datasets a block at a time. """
+        blockBytes = 64 * 1024 ** 2
+        with h5py.File(filePath, 'w') as file:
+            file.attrs.update(data.attrs)
+            for itemName, item in data.items():
+                if not isinstance(item, h5py.Dataset) or item.external is None:
+                    data.copy(item, file, name=itemName)
+                    continue
+
+                dataset = file.create_dataset(itemName, item.shape, maxshape=item.maxshape,
+                                              dtype=item.dtype, chunks=True)
+                dataset.attrs.update(item.attrs)
+                array = getDatasetArray(item)
+                blockFrames = max(blockBytes // max(array[:1].nbytes, 1), 1)
+                for start in range(0, len(array), blockFrames):
+                    dataset[start:start + blockFrames] = array[start:start + blockFrames]
+
     def __getitem__(self, name):
+        self._data.move_to_end(name)
         return self._data[name]
 
     def __setitem__(self, name, value):
@@ -56,13 +165,18 @@ class VFileCollection(SignalInterface):
 
         if name in self._data and self._data[name] != value:
             del self._data[name]
+            self._memoryFiles.pop(name, None)
 
         self._data[name] = value
+        self._data.move_to_end(name)
+        if not value.savedToDisk and isinstance(value.data, h5py.File):
+            self._memoryFiles[name] = getBackingFiles(value.data)
         self.sigDataSet.emit(name, value)
+        self._evictToBudget(keepName=name)
 
     def __delitem__(self, name):
         self.sigDataWillRemove.emit(name)
-        self._data[name].data.close()
+        self._closeData(name)
         del self._data[name]
         self.sigDataRemoved.emit(name)
 
@@ -1,5 +1,5 @@
 from .SharedAttributes import SharedAttributes
-from .VFileCollection import VFileItem, VFileCollection
+from .VFileCollection import VFileItem, VFileCollection, getDatasetArray
 from .api import APIExport, generateAPI
 from .logging import initLogger
 from .shortcut import shortcut, generateShortcuts
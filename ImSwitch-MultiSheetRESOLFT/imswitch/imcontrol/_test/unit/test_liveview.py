@@ -0,0 +1,169 @@
+import dataclasses
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from imswitch.imcontrol.model import DetectorsManager
+from imswitch.imcontrol.model.managers.detectors import DetectorManager as detectorManagerModule
+from imswitch.imcontrol.model.managers.detectors.DetectorManager import (
+    DetectorManager, _binImage
+)
+from . import detectorInfosBasic
+
+
+class CountingDetectorManager(DetectorManager):
+    """ Minimal detector that returns the number of frames read so far. """
+
+    def __init__(self, detectorInfo):
+        self.numFramesRead = 0
+        super().__init__(detectorInfo, 'CAM', fullShape=(4, 4), supportedBinnings=[1],
+                         model='Counting')
+
+    @property
+    def pixelSizeUm(self):
+        return [1, 1, 1]
+
+    def crop(self, hpos, vpos, hsize, vsize):
+        pass
+
+    def getLatestFrame(self):
+        self.numFramesRead += 1
+        return np.full((4, 4), self.numFramesRead, dtype=np.uint16)
+
+    def getChunk(self):
+        return np.empty((0, 4, 4), dtype=np.uint16)
+
+    def flushBuffers(self):
+        pass
+
+    def startAcquisition(self):
+        pass
+
+    def stopAcquisition(self):
+        pass
+
+
+def test_bin_image_crops_and_sums():
+    image = np.arange(5 * 7, dtype=np.uint16).reshape(5, 7)
+
+    binned = _binImage(image, 2)
+
+    expected = np.array([[image[y:y + 2, x:x + 2].sum() for x in range(0, 6, 2)]
+                         for y in range(0, 4, 2)])
+    assert binned.shape == (2, 3)
+    assert binned.dtype == np.uint32
+    np.testing.assert_array_equal(binned, expected)
+
+
+def test_bin_image_does_not_overflow():
+    image = np.full((2, 4, 4), np.iinfo(np.uint16).max, dtype=np.uint16)
+
+    binned = _binImage(image, 4)
+
+    assert binned.shape == (2, 1, 1)
+    assert binned.dtype == np.uint32
+    np.testing.assert_array_equal(binned, 16 * int(np.iinfo(np.uint16).max))
+
+
+@pytest.mark.parametrize('binning', [1, 0])
+def test_bin_image_unbinned(binning):
+    image = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    assert _binImage(image, binning) is image
+
+
+def test_latest_image_coalescing(qtbot):
+    detectorsManager = DetectorsManager({}, updatePeriod=100)
+    detectorName = 'CAM'
+
+    # Hold back the emission so that images are set faster than they are shown
+    detectorsManager.sigLatestImageAvailable.disconnect(detectorsManager._emitLatestImage)
+    numAvailable = 0
+
+    def latestImageAvailable(_):
+        nonlocal numAvailable
+        numAvailable += 1
+
+    detectorsManager.sigLatestImageAvailable.connect(latestImageAvailable)
+
+    emitted = []
+    detectorsManager.sigImageUpdated.connect(
+        lambda *args: emitted.append(args)
+    )
+
+    images = [np.full((4, 4), i, dtype=np.uint16) for i in range(3)]
+    detectorsManager._setLatestImage(detectorName, images[0], True)
+    detectorsManager._setLatestImage(detectorName, images[1], False)
+    detectorsManager._setLatestImage(detectorName, images[2], False)
+    assert numAvailable == 1
+    assert emitted == []
+
+    detectorsManager._emitLatestImage(detectorName)
+    assert len(emitted) == 1
+    name, image, init, _ = emitted[0]
+    assert name == detectorName
+    assert image is images[2]
+    assert init is True
+
+    # Nothing is left to emit until a new image is set
+    detectorsManager._emitLatestImage(detectorName)
+    assert len(emitted) == 1
+
+    detectorsManager._setLatestImage(detectorName, images[0], False)
+    assert numAvailable == 2
+    detectorsManager._emitLatestImage(detectorName)
+    assert len(emitted) == 2
+    assert emitted[1][1] is images[0]
+    assert emitted[1][2] is False
+
+
+def test_live_view_max_fps(monkeypatch):
+    now = 0.0
+    monkeypatch.setattr(detectorManagerModule, 'time',
+                        SimpleNamespace(perf_counter=lambda: now))
+
+    detectorInfo = dataclasses.replace(detectorInfosBasic['CAM'], liveViewMaxFPS=10)
+    detectorManager = CountingDetectorManager(detectorInfo)
+    emitted = []
+    detectorManager.sigImageUpdated.connect(
+        lambda image, init: emitted.append((image[0, 0], init))
+    )
+
+    detectorManager.updateLatestFrame(True)
+    now = 0.05
+    detectorManager.updateLatestFrame(True)  # Within 1 / liveViewMaxFPS, skipped
+    now = 0.1
+    detectorManager.updateLatestFrame(True)
+    now = 0.12
+    detectorManager.updateLatestFrame(False)  # Images that are not init are never skipped
+
+    assert emitted == [(1, True), (2, True), (3, False)]
+    assert detectorManager.numFramesRead == 3
+
+
+def test_live_view_max_fps_unlimited():
+    detectorManager = CountingDetectorManager(detectorInfosBasic['CAM'])
+    emitted = []
+    detectorManager.sigImageUpdated.connect(lambda image, init: emitted.append(image))
+
+    for _ in range(5):
+        detectorManager.updateLatestFrame(True)
+
+    assert len(emitted) == 5
+
+
+# Copyright (C) 2020-2021 ImSwitch developers
+# This file is part of ImSwitch.
+#
+# ImSwitch is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImSwitch is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
@@ -1,8 +1,17 @@
+import threading
+import time
+from io import BytesIO
+
 import pytest
 
 import h5py
+import numpy as np
 
-from imswitch.imcontrol.model import DetectorsManager, RecordingManager, RecMode, SaveMode
+from imswitch.imcommon.model import getDatasetArray
+from imswitch.imcontrol.model import (
+    DetectorsManager, RecordingManager, RecMode, SaveMode, Compression
+)
+from imswitch.imcontrol.model.managers.RecordingManager import FrameWaiter, RecordingWriter
 from . import detectorInfosBasic, detectorInfosMulti, detectorInfosNonSquare
 
 
@@ -51,10 +60,12 @@ def test_recording_spec_frames(qtbot, detectorInfos, numFrames):
     assert savedToDiskPerDetector.keys() == detectorInfos.keys()
 
     for detectorName, file in filePerDetector.items():
-        h5pyFile = h5py.File(file)
-        dataset = h5pyFile.get(detectorName)
+        dataset = file.get(detectorName)
         assert dataset.shape[0] == numFrames
-        h5pyFile.close()  # Otherwise we can get segfaults
+        frameInfo = file['frame_info'][detectorName]
+        assert frameInfo['frame_numbers'].shape[0] == numFrames
+        assert frameInfo['timestamps'].shape[0] == numFrames
+        assert np.all(np.diff(frameInfo['frame_numbers'][:]) == 1)  # No dropped frames
         file.close()  # Otherwise we can get segfaults
     for savedToDisk in savedToDiskPerDetector.values():
         assert savedToDisk is False
@@ -81,15 +92,196 @@ def test_recording_spec_time(qtbot, detectorInfos):
     assert savedToDiskPerDetector.keys() == detectorInfos.keys()
 
     for detectorName, file in filePerDetector.items():
-        h5pyFile = h5py.File(file)
-        dataset = h5pyFile.get(detectorName)
+        dataset = file.get(detectorName)
         assert dataset.shape[0] > 0
-        h5pyFile.close()  # Otherwise we can get segfaults
         file.close()  # Otherwise we can get segfaults
     for savedToDisk in savedToDiskPerDetector.values():
         assert savedToDisk is False
 
 
+@pytest.mark.parametrize('compression,h5pyCompression',
+                         [(Compression.GZIP, 'gzip'), (Compression.LZF, 'lzf')])
+def test_recording_compressed(qtbot, tmp_path, compression, h5pyCompression):
+    numFrames = 10
+    filePerDetector, _ = record(
+        qtbot,
+        detectorInfosBasic,
+        detectorNames=list(detectorInfosBasic.keys()),
+        recMode=RecMode.SpecFrames,
+        savename=str(tmp_path / 'test_compressed'),
+        saveMode=SaveMode.DiskAndRAM,
+        attrs={detectorName: {} for detectorName in detectorInfosBasic.keys()},
+        recFrames=numFrames,
+        chunkFrames=1,
+        compression=compression
+    )
+
+    for detectorName, file in filePerDetector.items():
+        dataset = file.get(detectorName)
+        assert dataset.shape[0] == numFrames
+        assert dataset.chunks == (1, *dataset.shape[1:])
+        assert dataset.compression == h5pyCompression
+        file.close()  # Otherwise we can get segfaults
+
+
+def test_recording_ram_memory_mapped(qtbot):
+    numFrames = 10
+    filePerDetector, _ = record(
+        qtbot,
+        detectorInfosBasic,
+        detectorNames=list(detectorInfosBasic.keys()),
+        recMode=RecMode.SpecFrames,
+        savename='test_ram_memory_mapped',
+        saveMode=SaveMode.RAM,
+        attrs={detectorName: {} for detectorName in detectorInfosBasic.keys()},
+        recFrames=numFrames
+    )
+
+    for detectorName, file in filePerDetector.items():
+        dataset = file.get(detectorName)
+        assert dataset.external is not None
+        data = getDatasetArray(dataset)
+        assert isinstance(data, np.memmap)
+        assert np.array_equal(data, dataset[:])
+        file.close()  # Otherwise we can get segfaults
+
+
+@pytest.mark.parametrize('chunks,expectedFrames',
+                         [(None, None), ((4, 16, 16), 37), ((3, 16, 16), None)])
+def test_recording_writer(chunks, expectedFrames):
+    file = h5py.File(BytesIO(), 'w')
+    dataset = file.create_dataset('data', (1, 16, 16), maxshape=(None, 16, 16), dtype='i2',
+                                  chunks=chunks)
+
+    # Small queue, such that writing has to wait for the writer thread
+    writer = RecordingWriter(maxQueuedBytes=5 * 16 * 16 * 2)
+    writer.addDataset('data', dataset, expectedFrames)
+    writer.start()
+
+    chunkSizes = [1, 2, 5, 3, 7, 1, 11, 6, 1]
+    frames = np.arange(sum(chunkSizes))[:, None, None] * np.ones((1, 16, 16), dtype='i2')
+    start = 0
+    for n in chunkSizes:
+        writer.write('data', frames[start:start + n])
+        start += n
+    writer.close()
+
+    assert dataset.shape[0] == len(frames)
+    assert np.array_equal(dataset[:], frames)
+    assert writer.queuedFrames == 0
+    file.close()
+
+
+class WaitingDetector:
+    """ Detector that has new frames every interval seconds, or never """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def waitForFrames(self, timeout):
+        if self.interval is None or self.interval > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(self.interval)
+        return True
+
+
+def test_frame_waiter_any_detector():
+    # Waiting must return when any detector has frames, not only the first one
+    waiter = FrameWaiter({'idle': WaitingDetector(None), 'fast': WaitingDetector(0.01)},
+                         timeout=0.5)
+    startTime = time.perf_counter()
+    for _ in range(10):
+        assert waiter.wait(['idle', 'fast'], timeout=0.5)
+    assert time.perf_counter() - startTime < 1
+    assert not waiter.wait(['idle'], timeout=0.05)
+    waiter.close()
+
+
+class SlowDataset:
+    """ Dataset that takes a while to write, like a slow disk """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
+
+    def __setitem__(self, key, value):
+        time.sleep(0.005)
+        self.dataset[key] = value
+
+
+class RingBufferCamera:
+    """ Camera that captures frames into a ring buffer in a thread of its
+    own, every frame filled with its frame number, until it is stopped """
+
+    def __init__(self, bufferFrames, interval):
+        self.buffer = np.zeros((bufferFrames, 16, 16), dtype='i2')
+        self.frameCount = 0
+        self._interval = interval
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+
+    def getFrames(self, start, stop):
+        """ Views of frames start to stop of the buffer, a copy if they wrap
+        around the end of the buffer """
+        ids = np.arange(start, stop) % len(self.buffer)
+        if ids[-1] >= ids[0]:
+            return self.buffer[ids[0]:ids[-1] + 1]
+        return np.concatenate((self.buffer[ids[0]:], self.buffer[:ids[-1] + 1]))
+
+    def _run(self):
+        while self._running:
+            self.buffer[self.frameCount % len(self.buffer)] = self.frameCount
+            self.frameCount += 1
+            time.sleep(self._interval)
+
+
+@pytest.mark.parametrize('chunks', [None, (4, 16, 16)])
+def test_recording_writer_ring_buffer(chunks):
+    file = h5py.File(BytesIO(), 'w')
+    dataset = file.create_dataset('data', (1, 16, 16), maxshape=(None, 16, 16), dtype='i2',
+                                  chunks=chunks)
+    frameNumbers = file.create_dataset('frame_numbers', (1,), maxshape=(None,), dtype='i8')
+
+    # The camera keeps overwriting its ring buffer while the slow disk makes write block.
+    # Queued frames must be copied, only frames that the camera overwrote before they were
+    # read may be missing, like the frames a detector reports as dropped.
+    bufferFrames = 16
+    camera = RingBufferCamera(bufferFrames, interval=0.001)
+    writer = RecordingWriter(maxQueuedBytes=camera.buffer.nbytes // 4)
+    writer.addDataset('data', SlowDataset(dataset))
+    writer.addDataset('frame_numbers', frameNumbers)
+    writer.start()
+
+    numRead = 0
+    droppedFrames = 0
+    startTime = time.perf_counter()
+    while time.perf_counter() - startTime < 0.3:
+        frameCount = camera.frameCount
+        if frameCount - numRead > bufferFrames // 2:
+            droppedFrames += frameCount - bufferFrames // 2 - numRead
+            numRead = frameCount - bufferFrames // 2
+        if frameCount > numRead:
+            writer.write('data', camera.getFrames(numRead, frameCount), copy=True)
+            writer.write('frame_numbers', np.arange(numRead, frameCount))
+            numRead = frameCount
+        time.sleep(0.001)
+    camera.stop()
+    writer.close()
+
+    assert writer.blockedTime > 0
+    assert dataset.shape[0] == numRead - droppedFrames > 0
+    assert np.array_equal(dataset[:, 0, 0], frameNumbers[:])
+    file.close()
+
+
 # Copyright (C) 2020-2021 ImSwitch developers
 # This file is part of ImSwitch.
 #
@@ -52,10 +52,18 @@ class CommunicationChannel(SignalInterface):
 
     sigUpdateRecTime = Signal(int)  # (recTime)
 
+    sigUpdateRecQueueDepth = Signal(int)  # (queuedFrames)
+
+    sigUpdateRecDroppedFrames = Signal(int)  # (droppedFrames)
+
+    sigRecordingFramesAvailable = Signal(str, np.ndarray)  # (detectorName, frames)
+
     sigMemorySnapAvailable = Signal(
         str, np.ndarray, object, bool
     )  # (name, image, filePath, savedToDisk)
 
+    sigUpdateStaticImage = Signal(str, np.ndarray)  # (name, image)
+
     sigRunScan = Signal(bool, bool)  # (recalculateSignals, isNonFinalPartOfSequence)
 
     sigAbortScan = Signal()
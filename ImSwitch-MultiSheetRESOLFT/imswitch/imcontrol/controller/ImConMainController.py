@@ -87,7 +87,8 @@ class ImConMainController(MainController):
             return
 
         with h5py.File(filePath) as file:
-            datasetsInFile = file.keys()
+            datasetsInFile = [name for name, item in file.items()
+                              if isinstance(item, h5py.Dataset)]
             if len(datasetsInFile) < 1:
                 # File does not contain any datasets
                 return
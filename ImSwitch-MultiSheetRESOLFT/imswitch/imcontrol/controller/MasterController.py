@@ -52,6 +52,11 @@ class MasterController:
         self.recordingManager.sigRecordingEnded.connect(cc.sigRecordingEnded)
         self.recordingManager.sigRecordingFrameNumUpdated.connect(cc.sigUpdateRecFrameNum)
         self.recordingManager.sigRecordingTimeUpdated.connect(cc.sigUpdateRecTime)
+        self.recordingManager.sigRecordingQueueDepthUpdated.connect(cc.sigUpdateRecQueueDepth)
+        self.recordingManager.sigRecordingDroppedFramesUpdated.connect(
+            cc.sigUpdateRecDroppedFrames
+        )
+        self.recordingManager.sigRecordingFramesAvailable.connect(cc.sigRecordingFramesAvailable)
         self.recordingManager.sigMemorySnapAvailable.connect(cc.sigMemorySnapAvailable)
         self.recordingManager.sigMemoryRecordingAvailable.connect(self.memoryRecordingAvailable)
 
@@ -65,6 +70,7 @@ class MasterController:
 
     def closeEvent(self):
         self.recordingManager.endRecording(emitSignal=False, wait=True)
+        self.recordingManager.removeMemoryRecordings()
         self.triggerScopeManager.closeMonitor()
 
         for attrName in dir(self):
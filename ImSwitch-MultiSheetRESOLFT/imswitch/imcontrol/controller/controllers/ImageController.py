@@ -26,6 +26,7 @@ class ImageController(LiveUpdatedController):
         self._commChannel.sigAddItemToVb.connect(self.addItemToVb)
         self._commChannel.sigRemoveItemFromVb.connect(self.removeItemFromVb)
         self._commChannel.sigMemorySnapAvailable.connect(self.memorySnapAvailable)
+        self._commChannel.sigUpdateStaticImage.connect(self.updateStaticImage)
         self._commChannel.sigSetVisibleLayers.connect(self.setVisibleLayers)
 
     def autoLevels(self, detectorNames=None, im=None):
@@ -54,11 +55,12 @@ class ImageController(LiveUpdatedController):
     def update(self, detectorName, im, init, isCurrentDetector):
         """ Update new image in the viewbox. """
         if np.prod(im.shape)>1: # TODO: This seems weird!
-            print(np.shape(im))
+            detector = self._master.detectorsManager[detectorName]
+            im = detector.binLiveViewImage(im)
             if not init:
                 self.autoLevels([detectorName], im)
 
-            self._widget.setImage(detectorName, im)
+            self._widget.setImage(detectorName, im, binning=detector.liveViewBinning)
 
             if not init or self._shouldResetView:
                 self.adjustFrame(instantResetView=True)
@@ -96,6 +98,11 @@ class ImageController(LiveUpdatedController):
         if self._shouldResetView:
             self.adjustFrame(image.shape, instantResetView=True)
 
+    def updateStaticImage(self, name, image):
+        """ Replaces the image of a static layer, adding the layer if it does
+        not exist yet. """
+        self._widget.updateStaticLayer(name, image)
+
     def setVisibleLayers(self, names):
         self._widget.setVisibleLayers(names)
         self.autoLevels(names)
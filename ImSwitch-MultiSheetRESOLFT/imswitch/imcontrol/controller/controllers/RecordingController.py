@@ -42,6 +42,8 @@ class RecordingController(ImConWidgetController):
         self._commChannel.sigScanDone.connect(self.scanDone)
         self._commChannel.sigUpdateRecFrameNum.connect(self.updateRecFrameNum)
         self._commChannel.sigUpdateRecTime.connect(self.updateRecTime)
+        self._commChannel.sigUpdateRecQueueDepth.connect(self._widget.updateRecQueueDepth)
+        self._commChannel.sigUpdateRecDroppedFrames.connect(self._widget.updateRecDroppedFrames)
         self._commChannel.sharedAttrs.sigAttributeSet.connect(self.attrChanged)
         self._commChannel.sigStartRecording.connect(self.startRecording)
         self._commChannel.sigStopRecording.connect(self.stopRecording)
@@ -174,6 +176,7 @@ class RecordingController(ImConWidgetController):
 
     def recordingStarted(self):
         self._widget.setFieldsEnabled(False)
+        self._widget.updateRecDroppedFrames(0)
 
     def recordingCycleEnded(self):
         if (self._widget.isRecButtonChecked() and self.recMode == RecMode.ScanLapse and
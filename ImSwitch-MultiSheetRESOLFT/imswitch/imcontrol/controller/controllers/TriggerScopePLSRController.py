@@ -5,13 +5,18 @@ from ..basecontrollers import ImConWidgetController
 import numpy as np
 import traceback
 import functools
-from imswitch.imcommon.model import APIExport, dirtools
+from imswitch.imcommon.framework import Signal, Thread, Worker, Mutex
+from imswitch.imcommon.model import APIExport, dirtools, initLogger
+from imswitch.imreconstruct.model import Reconstructor
 from imswitch.imcontrol.view import guitools
 from imswitch.imcommon.view.guitools import colorutils
 
 class TriggerScopePLSRController(ImConWidgetController):
     """ Linked to TriggerScopeRasterWidget."""
 
+    sigLiveDeskewStarting = Signal(object)  # (parameters)
+    sigLiveDeskewFramesReceived = Signal(str, np.ndarray)  # (detectorName, frames)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -43,6 +48,15 @@ class TriggerScopePLSRController(ImConWidgetController):
         self._widget.roScanDeviceEdit.addItems(self.positioners.keys())
         self._widget.cycleScanDeviceEdit.addItems(self.positioners.keys())
 
+        # Prepare live deskew worker
+        self.liveDeskewWorker = self.LiveDeskewWorker()
+        self.liveDeskewWorker.sigVolumeDeskewed.connect(self.displayDeskewedVolume)
+        self.liveDeskewThread = Thread()
+        self.liveDeskewWorker.moveToThread(self.liveDeskewThread)
+        self.sigLiveDeskewStarting.connect(self.liveDeskewWorker.startPreview)
+        self.sigLiveDeskewFramesReceived.connect(self.liveDeskewWorker.addFrames)
+        self.liveDeskewThread.start()
+
         # Connect NidaqManager signals
         self._master.triggerScopeManager.sigScanStarted.connect(
             lambda: self.emitScanSignal(self._commChannel.sigScanStarted)
@@ -52,6 +66,8 @@ class TriggerScopePLSRController(ImConWidgetController):
         # Connect CommunicationChannel signals
         self._commChannel.sigRunScan.connect(self.runScanExternal)
         self._commChannel.sigAbortScan.connect(self.abortScan)
+        self._commChannel.sigRecordingFramesAvailable.connect(self.recordingFramesAvailable)
+        self._commChannel.sigRecordingEnded.connect(self.recordingEnded)
 
         # Connect ScanWidget signals
         self._widget.sigSaveScanClicked.connect(self.saveScan)
@@ -59,6 +75,12 @@ class TriggerScopePLSRController(ImConWidgetController):
         self._widget.sigRunScanClicked.connect(self.runScan)
         self._widget.sigParameterChanged.connect(self.updateScanParDict)
 
+    def __del__(self):
+        self.liveDeskewThread.quit()
+        self.liveDeskewThread.wait()
+        if hasattr(super(), '__del__'):
+            super().__del__()
+
     def getNumScanPositions(self):
         """ Returns the number of scan positions for the configured scan. """
         _, positions, _ = self._master.triggerScopeManager.getScanSignalsDict(self._analogParameterDict)
@@ -184,6 +206,8 @@ class TriggerScopePLSRController(ImConWidgetController):
         """ Runs a scan with the set scanning parameters. """
         #Temp safety fix
         # if self._widget.timeLapsePointsEdit.value() * self._widget.timeLapseDelayEdit.value() > 60:
+        if self._widget.getLiveDeskewChecked():
+            self.startLiveDeskew()
         if self._widget.autoStartRec:
             self._commChannel.sigStartRecording.emit()
         try:
@@ -226,6 +250,37 @@ class TriggerScopePLSRController(ImConWidgetController):
         self._widget.setScanButtonChecked(False)
         self.emitScanSignal(self._commChannel.sigScanEnded)
 
+    def startLiveDeskew(self):
+        """ Deskews every volume of roSteps x cycleSteps frames recorded during
+        the scan in the background, and shows it in the image viewer, so that
+        the acquisition can be checked while it is running. """
+        self.getParameters()
+        parameters = {
+            'roSteps': int(self._scanParameterDict['roSteps']),
+            'cycleSteps': int(self._scanParameterDict['cycleSteps']),
+            'restack': self._widget.getLiveDeskewRestackChecked(),
+            'skewAngleRad': np.deg2rad(self._widget.getSkewAngleDeg()),
+            'deltaYNm': self._widget.getDeltaYNm(),
+            'reconVxSizeNm': self._widget.getReconVxSizeNm(),
+            'pixelSizesNm': self._master.detectorsManager.execOnAll(
+                lambda c: c.pixelSizeUm[-1] * 1000, condition=lambda c: c.forAcquisition
+            )
+        }
+        self.sigLiveDeskewStarting.emit(parameters)
+        self._master.recordingManager.emitFrames = True
+
+    def recordingFramesAvailable(self, detectorName, frames):
+        self.liveDeskewWorker.prepareForNewFrames(detectorName, len(frames))
+        self.sigLiveDeskewFramesReceived.emit(detectorName, frames)
+
+    def recordingEnded(self):
+        self._master.recordingManager.emitFrames = False
+
+    def displayDeskewedVolume(self, detectorName, volume, timepoint):
+        """ Replaces the previous live deskewed volume in the image viewer. """
+        self._logger.debug(f'Live deskewed {detectorName} timepoint {timepoint}')
+        self._commChannel.sigUpdateStaticImage.emit(f'Live deskew: {detectorName}', volume)
+
     def getParameters(self):
         """Get parameters from widget field to controller dict"""
         if self.settingParameters:
@@ -293,6 +348,101 @@ class TriggerScopePLSRController(ImConWidgetController):
     def closeEvent(self):
         pass
 
+    class LiveDeskewWorker(Worker):
+        sigVolumeDeskewed = Signal(str, np.ndarray, int)  # (detectorName, volume, timepoint)
+
+        def __init__(self):
+            super().__init__()
+            self.__logger = initLogger(self, tryInheritParent=True)
+            self._reconstructor = None
+            self._parameters = None
+            self._volumes = {}
+            self._numFrames = {}
+            self._timepoints = {}
+            self._numQueuedFrames = {}
+            self._numQueuedFramesMutex = Mutex()
+
+        def startPreview(self, parameters):
+            """ Discards the frames of the previous scan. """
+            self._parameters = parameters
+            self._volumes = {}
+            self._numFrames = {}
+            self._timepoints = {}
+
+        def addFrames(self, detectorName, frames):
+            """ Adds recorded frames to the volume of the detector, and deskews
+            the volume once all its frames have been added. A volume is skipped
+            if all frames of the next one are already queued, so that the
+            preview does not fall behind the acquisition. """
+            try:
+                if self._parameters is None:
+                    return
+
+                framesPerVolume = self._parameters['roSteps'] * self._parameters['cycleSteps']
+                if framesPerVolume < 1:
+                    return
+
+                volume = self._volumes.get(detectorName)
+                if volume is None or volume.shape[1:] != frames.shape[1:]:
+                    volume = np.empty((framesPerVolume, *frames.shape[1:]), dtype=frames.dtype)
+                    self._volumes[detectorName] = volume
+                    self._numFrames[detectorName] = 0
+                    self._timepoints.setdefault(detectorName, 0)
+
+                start = 0
+                while start < len(frames):
+                    numFrames = self._numFrames[detectorName]
+                    n = min(len(frames) - start, framesPerVolume - numFrames)
+                    volume[numFrames:numFrames + n] = frames[start:start + n]
+                    self._numFrames[detectorName] += n
+                    start += n
+                    if self._numFrames[detectorName] < framesPerVolume:
+                        continue
+
+                    self._numFrames[detectorName] = 0
+                    timepoint = self._timepoints[detectorName]
+                    self._timepoints[detectorName] += 1
+                    if self._numQueuedFrames[detectorName] - start >= framesPerVolume:
+                        self.__logger.debug(f'Skipping live deskew of {detectorName}'
+                                            f' timepoint {timepoint} to catch up')
+                        continue
+
+                    self.deskewVolume(detectorName, volume, timepoint)
+            except Exception:
+                self.__logger.error(traceback.format_exc())
+            finally:
+                self._numQueuedFramesMutex.lock()
+                self._numQueuedFrames[detectorName] -= len(frames)
+                self._numQueuedFramesMutex.unlock()
+
+        def prepareForNewFrames(self, detectorName, numFrames):
+            """ Must always be called before the worker receives new frames. """
+            self._numQueuedFramesMutex.lock()
+            self._numQueuedFrames[detectorName] = (self._numQueuedFrames.get(detectorName, 0)
+                                                   + numFrames)
+            self._numQueuedFramesMutex.unlock()
+
+        def deskewVolume(self, detectorName, volume, timepoint):
+            parameters = self._parameters
+            if parameters['restack']:
+                # Frames are acquired cycle by cycle, stack them by read-out step
+                volume = np.reshape(
+                    np.swapaxes(np.reshape(volume, (parameters['cycleSteps'], parameters['roSteps'],
+                                                    *volume.shape[1:])), 0, 1),
+                    volume.shape
+                )
+
+            if self._reconstructor is None:
+                self._reconstructor = Reconstructor()
+
+            deskewed = self._reconstructor.simpleDeskew(volume,
+                                                        parameters['pixelSizesNm'][detectorName],
+                                                        parameters['skewAngleRad'],
+                                                        parameters['deltaYNm'],
+                                                        parameters['reconVxSizeNm'])
+            if deskewed is not None:
+                self.sigVolumeDeskewed.emit(detectorName, deskewed, timepoint)
+
 _attrCategoryScan = 'MS-RESOLFT_Scan'
 _attrCategoryDevices = 'MS-RESOLFT_Dev'
 # Copyright (C) 2020-2021 ImSwitch developers
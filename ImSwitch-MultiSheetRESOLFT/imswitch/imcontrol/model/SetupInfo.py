@@ -45,6 +45,15 @@ class DetectorInfo(DeviceInfo):
     forFocusLock: bool = False
     """ Whether the detector is used for focus lock. """
 
+    liveViewBinning: int = 1
+    """ Number of pixels along each axis that are summed into one pixel of the
+    images shown in the live view. Does not affect recorded data or the
+    images that other widgets, e.g. FFT and alignment, receive. """
+
+    liveViewMaxFPS: Optional[float] = None
+    """ Maximum number of live view images shown per second, ``null`` to show
+    an image every live view update. """
+
 
 @dataclass(frozen=True)
 class LaserInfo(DeviceInfo):
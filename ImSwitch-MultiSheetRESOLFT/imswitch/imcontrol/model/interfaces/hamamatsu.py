@@ -43,8 +43,11 @@
 
 import ctypes
 import ctypes.util
+import mmap
+import time
 
 import numpy as np
+import psutil
 
 from imswitch.imcommon.model import initLogger
 
@@ -216,6 +219,33 @@ class HCamData:
         return self.np_array.ctypes.data
 
 
+# ## allocateFrameMemory
+#
+# Allocate one block of memory for the frames of the ring buffer,
+# aligned to the memory page size. With huge_pages the block is an
+# anonymous memory map that the OS is asked to back with huge pages
+# (Linux only, a normal memory map elsewhere), which makes streaming
+# through gigabytes of frames cheaper for the memory management.
+#
+# @param size The size of the memory block in bytes.
+# @param huge_pages Use a memory map backed by huge pages if possible.
+#
+# @return A uint8 numpy array of the given size.
+#
+def allocateFrameMemory(size, huge_pages=False):
+    size = int(size)
+    if huge_pages:
+        memory = mmap.mmap(-1, size)
+        if hasattr(mmap, "MADV_HUGEPAGE"):
+            memory.madvise(mmap.MADV_HUGEPAGE)
+        return np.frombuffer(memory, dtype=np.uint8)
+
+    alignment = mmap.PAGESIZE
+    memory = np.empty(size + alignment, dtype=np.uint8)
+    offset = -memory.ctypes.data % alignment
+    return memory[offset:offset + size]
+
+
 # ## HamamatsuCamera
 #
 # Basic camera interface class.
@@ -248,6 +278,8 @@ class HamamatsuCamera:
         self.properties = {}
         self.max_backlog = 0
         self.number_image_buffers = 0
+        self.dropped_frames = 0
+        self.new_frame_numbers = np.zeros(0, dtype=np.int64)
 
         # Open the camera.
         self.camera_handle = ctypes.c_void_p(0)
@@ -270,6 +302,7 @@ class HamamatsuCamera:
     def captureSetup(self):
         self.buffer_index = -1
         self.last_frame_number = 0
+        self.dropped_frames = 0
 
         # Set sub array mode.
         self.setSubArrayMode()
@@ -577,12 +610,16 @@ class HamamatsuCamera:
     # ## newFrames
     #
     # Return a list of the ids of all the new frames since the last check.
+    # The frame numbers of these frames, counted from the start of the
+    # acquisition, are stored in new_frame_numbers. Frames that were
+    # overwritten before they could be returned are added to dropped_frames.
     #
     # This will block waiting for at least one new frame.
     #
     # @return [id of the first frame, .. , id of the last frame]
     #
     def newFrames(self):
+        self.new_frame_numbers = np.zeros(0, dtype=np.int64)
         # Wait for a new frame.
         try:
             dwait = ctypes.c_int(DCAMCAP_EVENT_FRAMEREADY)
@@ -617,6 +654,11 @@ class HamamatsuCamera:
                     new_frames.append(i + 1)
             self.buffer_index = cur_buffer_index
 
+            # The returned frames are the last of the backlog, the others are lost
+            self.dropped_frames += max(backlog - len(new_frames), 0)
+            self.new_frame_numbers = np.arange(cur_frame_number - len(new_frames),
+                                               cur_frame_number, dtype=np.int64)
+
             if self.debug:
                 self._logger.debug(new_frames)
 
@@ -624,6 +666,28 @@ class HamamatsuCamera:
         except Exception:
             return []
 
+    # ## waitForFrame
+    #
+    # Block until the camera has captured frames that newFrames has not
+    # returned yet, or until the timeout has passed. The thread sleeps in
+    # dcam_wait while waiting, instead of polling the camera.
+    #
+    # @param timeout The maximum time to wait in seconds.
+    #
+    # @return True if there are new frames, False if the timeout passed.
+    #
+    def waitForFrame(self, timeout):
+        b_index, f_count = self.getAq_Info()
+        if f_count > self.last_frame_number:
+            return True
+
+        dwait = ctypes.c_int(DCAMCAP_EVENT_FRAMEREADY)
+        ret = dcam.dcam_wait(self.camera_handle,
+                             ctypes.byref(dwait),
+                             ctypes.c_int(int(timeout * 1000)),
+                             None)
+        return ret == DCAMERR_NOERROR
+
     def getAq_Info(self):
         """b_index indicates which index position in the buffer was last
         written to, f_count indicates how many frames were aquired since start"""
@@ -764,12 +828,14 @@ class HamamatsuCamera:
 # Memory recycling camera class.
 #
 # This version allocates "user memory" for the Hamamatsu camera
-# buffers. This memory is also the location of the storage for
-# the np_array element of a HCamData() class. The memory is
-# allocated once at the beginning, then recycled. This means
-# that there is a lot less memory allocation & shuffling compared
-# to the basic class, which performs one allocation and (I believe)
-# two copies for each frame that is acquired.
+# buffers. The memory is one contiguous (frames, height, width)
+# numpy array, a ring buffer that the camera writes each frame
+# into directly. The memory is allocated once at the beginning,
+# then recycled. This means that there is a lot less memory
+# allocation & shuffling compared to the basic class, which
+# performs one allocation and (I believe) two copies for each
+# frame that is acquired. New frames are returned as a view of
+# the ring buffer where possible.
 #
 # WARNING: There is the potential here for chaos. Since the memory
 #   is now shared there is the possibility that downstream code
@@ -789,12 +855,45 @@ class HamamatsuCameraMR(HamamatsuCamera):
     def __init__(self, camera_id):
         HamamatsuCamera.__init__(self, camera_id)
 
-        self.hcam_data = []
+        self.frame_memory = None
+        self.frame_buffer = None
         self.hcam_ptr = False
+        self.hcam_ptr_values = None
         self.old_frame_bytes = -1
 
+        self.buffer_frames = None
+        self.max_buffer_bytes = 4 * 1024 * 1024 * 1024
+        self.huge_pages = False
+
         self.setPropertyValue("output_trigger_kind[0]", 2)
 
+    # ## setBufferFrames
+    #
+    # Set the number of frames that the ring buffer should at least
+    # hold, eg. the length of a recording, used from the next start of
+    # the acquisition. The buffer always holds as many frames as fit in
+    # max_buffer_bytes, and is only made larger to hold n_frames, as
+    # far as half of the available memory allows.
+    #
+    # @param n_frames The number of frames, None for as many frames as fit in max_buffer_bytes.
+    #
+    def setBufferFrames(self, n_frames):
+        self.buffer_frames = n_frames
+
+    # ## setBufferMemory
+    #
+    # Set the memory limit of the ring buffer and whether the buffer is
+    # backed by huge pages, used from the next allocation of the buffer.
+    #
+    # @param max_buffer_bytes The maximum size of the ring buffer in bytes.
+    # @param huge_pages Back the ring buffer by huge pages if possible.
+    #
+    def setBufferMemory(self, max_buffer_bytes, huge_pages=False):
+        self.max_buffer_bytes = int(max_buffer_bytes)
+        if huge_pages != self.huge_pages:
+            self.frame_memory = None
+            self.huge_pages = huge_pages
+
     # ## getFrames
     #
     # Gets all of the available frames.
@@ -805,32 +904,53 @@ class HamamatsuCameraMR(HamamatsuCamera):
     # FIXME: It does not always seem to block? The length of frames can
     #   be zero. Are frames getting dropped? Some sort of race condition?
     #
-    # @return (frames, (frame x size, frame y size))
+    # The frames are a view of the ring buffer, unless the new frames
+    # wrap around the end of the buffer, then the two parts are copied
+    # into one array. A view is only valid until the camera has filled
+    # the ring buffer once more, so copy frames that should be kept.
+    #
+    # @return (frames, (frame y size, frame x size))
     #
     def getFrames(self):
-        frames = []
-        for n in self.newFrames():
-            im = self.hcam_data[n].getData()
-            frames.append(np.reshape(im, (self.frame_y, self.frame_x)))
-        return np.array(frames), (self.frame_y, self.frame_x)
+        return self.getBufferFrames(self.newFrames()), (self.frame_y, self.frame_x)
+
+    # ## getFramesWithInfo
+    #
+    # Like getFrames, but also returns the number of each frame, counted
+    # from the start of the acquisition, and the host time in seconds
+    # since the epoch at which the frames were read from the buffer.
+    #
+    # @return (frames, frame numbers, time stamps)
+    #
+    def getFramesWithInfo(self):
+        frames = self.getBufferFrames(self.newFrames())
+        timestamps = np.full(len(frames), time.time())
+        return frames, self.new_frame_numbers, timestamps
+
+    def getBufferFrames(self, ids):
+        """ Frames of the ring buffer with the given consecutive ids,
+        possibly wrapping around the end of the buffer. """
+        if len(ids) == 0:
+            return self.frame_buffer[0:0]
+        first, last = ids[0], ids[-1]
+        if last >= first:
+            return self.frame_buffer[first:last + 1]
+        else:
+            return np.concatenate((self.frame_buffer[first:], self.frame_buffer[:last + 1]))
 
     def getLast(self):
         b_index, f_count = self.getAq_Info()
-        im = self.hcam_data[b_index].getData()
-        return np.reshape(im, (self.frame_y, self.frame_x))
+        return self.frame_buffer[b_index]
 
     def updateIndices(self):
         b_index, f_count = self.getAq_Info()
         self.buffer_index = b_index
         self.last_frame_number = f_count
+        self.dropped_frames = 0
 
     def getSpecFrames(self, ids):
         """Get frames specified by their id's"""
-        frames = []
-        for n in ids:
-            frames.append(self.hcam_data[n])
-
-        return frames
+        return self.frame_buffer[np.asarray(ids, dtype=int)]
 
     def UpdateFrameNrBufferIdx(self):
         b_index, f_count = self.getAq_Info()
@@ -839,35 +959,21 @@ class HamamatsuCameraMR(HamamatsuCamera):
 
     # ## startAcquisition
     #
-    # Allocate as many frames as will fit in 2GB of memory and start data acquisition.
+    # Allocate the ring buffer if necessary and start data acquisition.
     #
     def startAcquisition(self):
         self.captureSetup()
         self._logger.debug(self.frame_bytes)
         #
         # Allocate new image buffers if necessary.
-        # Allocate as many frames as can fit in 2GB of memory.
-        # NOTE: The for loop in this function can be timeconsuming if the frame_bytes are small
-        # since this leads to a large amount of frames and thus a large amount of iterations of the
-        # loop.hca
+        # As many frames as fit in max_buffer_bytes, or more if a larger
+        # number of frames was set.
         #
-        if (self.old_frame_bytes != self.frame_bytes):
-            # Even number of frames
-            n_buffers = 2 * int((4 * 1024 * 1024 * 1024) / (2 * self.frame_bytes))
+        n_buffers = self.getBufferSize()
+        if (self.old_frame_bytes != self.frame_bytes) or (self.number_image_buffers != n_buffers):
             self._logger.debug(f'Number of frames to buffer: {n_buffers}')
             self.number_image_buffers = n_buffers
-
-            # Allocate new image buffers.
-            ptr_array = ctypes.c_void_p * self.number_image_buffers
-            self.hcam_ptr = ptr_array()
-            self.hcam_data = []
-
-            # This loop can take time if number_image_frames is large
-            for i in range(self.number_image_buffers):
-                hc_data = HCamData(self.frame_bytes)
-                self.hcam_ptr[i] = hc_data.getDataPtr()
-                self.hcam_data.append(hc_data)
-
+            self.allocateBuffers()
             self.old_frame_bytes = self.frame_bytes
             self._logger.debug('Finished buffering frames')
         # Attach image buffers.
@@ -883,6 +989,49 @@ class HamamatsuCameraMR(HamamatsuCamera):
         self.checkStatus(dcam.dcam_capture(self.camera_handle),
                          "dcam_capture")
 
+    # ## getBufferSize
+    #
+    # @return The number of frames of the ring buffer, always an even number.
+    #
+    def getBufferSize(self):
+        n_buffers = 2 * int(self.max_buffer_bytes / (2 * self.frame_bytes))
+        if self.buffer_frames is not None and self.buffer_frames > n_buffers:
+            allocated_bytes = self.frame_memory.size if self.frame_memory is not None else 0
+            max_bytes = (psutil.virtual_memory().available + allocated_bytes) // 2
+            n_buffers = max(n_buffers, min(2 * int(np.ceil(self.buffer_frames / 2)),
+                                           2 * int(max_bytes / (2 * self.frame_bytes))))
+        return max(n_buffers, 2)
+
+    # ## allocateBuffers
+    #
+    # Carve the ring buffer of number_image_buffers frames out of one
+    # block of memory and fill the table of frame pointers for DCAM.
+    # The memory block is kept, and only allocated again when it is too
+    # small, so changing the ROI does not allocate memory.
+    #
+    def allocateBuffers(self):
+        buffer_bytes = self.number_image_buffers * self.frame_bytes
+        if self.frame_memory is None or self.frame_memory.size < buffer_bytes:
+            # The old memory is released first, so both are never
+            # allocated at the same time.
+            self.frame_buffer = None
+            self.frame_memory = None
+            self.frame_memory = allocateFrameMemory(buffer_bytes, self.huge_pages)
+
+        row_bytes = self.frame_bytes // self.frame_y
+        self.frame_buffer = np.lib.stride_tricks.as_strided(
+            self.frame_memory[:buffer_bytes].view(np.uint16),
+            shape=(self.number_image_buffers, self.frame_y, self.frame_x),
+            strides=(self.frame_bytes, row_bytes, 2),
+            writeable=True
+        )
+
+        self.hcam_ptr_values = (np.uintp(self.frame_memory.ctypes.data) +
+                                np.uintp(self.frame_bytes) *
+                                np.arange(self.number_image_buffers, dtype=np.uintp))
+        ptr_array = ctypes.c_void_p * self.number_image_buffers
+        self.hcam_ptr = ptr_array.from_buffer(self.hcam_ptr_values)
+
     # ## stopAcquisition
     #
     # Stop data acquisition and release the memory associates with the frames.
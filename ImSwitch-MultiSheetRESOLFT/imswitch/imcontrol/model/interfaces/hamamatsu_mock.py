@@ -1,5 +1,6 @@
 import ctypes
 import ctypes.util
+import threading
 import time
 
 import numpy as np
@@ -68,12 +69,19 @@ class MockHamamatsu(Driver):
         self.last_frame_number = 0
         self.properties = {}
         self.max_backlog = 0
+        self.dropped_frames = 0
         self.number_image_buffers = 0
         self.hcam_data = []
+        self.frame_buffer = None
+        self.mock_buffer_frames = 16
+        self.buffer_frames = None
+        self.max_buffer_bytes = 4 * 1024 * 1024 * 1024
+        self.huge_pages = False
 
         self.mock_data_max_value = np.random.randint(65536)
         self.mock_acquisiton_running = False
         self.mock_start_time = time.time_ns()
+        self.mock_frame_condition = threading.Condition()
 
         self.s = Q_(1, 's')
 
@@ -131,27 +139,92 @@ class MockHamamatsu(Driver):
         This will block waiting for new frames even if there new frames
         available when it is called.
 
+        Like the real camera, the frames are a view of a ring buffer of
+        random frames where possible.
+
         @return (frames, (frame x size, frame y size))'''
-        frames = []
         frame_x, frame_y = self.frame_x, self.frame_y
 
-        cur_frame_number = int(
-            (time.time_ns() - self.mock_start_time) / 10e8 * self.properties['internal_frame_rate']
-        )
+        cur_frame_number = self.getMockFrameNumber()
+        first = self.last_frame_number % self.mock_buffer_frames
         num_frames = cur_frame_number - self.last_frame_number
         self.last_frame_number = cur_frame_number
 
-        for i in range(num_frames):
-            # Create storage
-            hc_data = HMockCamData(frame_x * frame_y, self.mock_data_max_value)
-            frames.append(np.reshape(hc_data.getData(), (frame_y, frame_x)))
+        frame_buffer = self.getFrameBuffer()
+        if first + num_frames <= self.mock_buffer_frames:
+            frames = frame_buffer[first:first + num_frames]
+        else:
+            frames = np.take(frame_buffer, np.arange(first, first + num_frames), axis=0, mode='wrap')
 
         return frames, (frame_x, frame_y)
 
+    def getFramesWithInfo(self):
+        ''' Like getFrames, but also returns the number of each frame, counted
+        from the start of the acquisition, and the time stamp of each frame.
+        The mock camera never drops frames.
+
+        @return (frames, frame numbers, time stamps)'''
+        first_frame_number = self.last_frame_number
+        frames, _ = self.getFrames()
+        frame_numbers = np.arange(first_frame_number, first_frame_number + len(frames))
+        timestamps = (self.mock_start_time / 1e9 +
+                      (frame_numbers + 1) / self.properties['internal_frame_rate'])
+        return frames, frame_numbers, timestamps
+
+    def getMockFrameNumber(self):
+        return int(
+            (time.time_ns() - self.mock_start_time) / 10e8 * self.properties['internal_frame_rate']
+        )
+
+    def waitForFrame(self, timeout):
+        ''' Blocks until there are frames that getFrames has not returned yet,
+        or until the timeout has passed.
+
+        @return True if there are new frames, False if the timeout passed.'''
+        deadline = time.time_ns() + timeout * 1e9
+        with self.mock_frame_condition:
+            while self.mock_acquisiton_running:
+                if self.getMockFrameNumber() > self.last_frame_number:
+                    return True
+                now = time.time_ns()
+                if now >= deadline:
+                    return False
+                # Sleep until the next mock frame is due, or until woken up by
+                # stopAcquisition or updateIndices
+                next_frame_time = (self.mock_start_time + (self.last_frame_number + 1) * 1e9
+                                   / self.properties['internal_frame_rate'])
+                self.mock_frame_condition.wait(max(min(next_frame_time, deadline) - now, 0) / 1e9)
+        return self.getMockFrameNumber() > self.last_frame_number
+
     def getLast(self):
-        frame_x, frame_y = self.frame_x, self.frame_y
-        hc_data = HMockCamData(frame_x * frame_y, self.mock_data_max_value)
-        return np.reshape(hc_data.getData(), (frame_y, frame_x))
+        ''' Returns the newest frame, from the frame number that elapsed time
+        and frame rate give while acquiring, without taking frames from
+        getFrames. '''
+        frame_number = self.last_frame_number
+        if self.mock_acquisiton_running:
+            frame_number = max(frame_number, self.getMockFrameNumber())
+        return self.getFrameBuffer()[(frame_number - 1) % self.mock_buffer_frames]
+
+    def getFrameBuffer(self):
+        ''' Ring buffer of random frames, allocated again when the frame size
+        has changed. '''
+        shape = (self.mock_buffer_frames, self.frame_y, self.frame_x)
+        if self.frame_buffer is None or self.frame_buffer.shape != shape:
+            self.frame_buffer = np.random.randint(
+                1, self.mock_data_max_value, shape
+            ).astype(np.uint16)
+        return self.frame_buffer
+
+    def setBufferFrames(self, n_frames):
+        ''' The mock ring buffer always holds mock_buffer_frames frames. '''
+        self.buffer_frames = n_frames
+
+    def getBufferSize(self):
+        return self.mock_buffer_frames
+
+    def setBufferMemory(self, max_buffer_bytes, huge_pages=False):
+        self.max_buffer_bytes = max_buffer_bytes
+        self.huge_pages = huge_pages
 
     def getModelInfo(self):
         ''' Returns the model of the camera
@@ -324,11 +397,15 @@ class MockHamamatsu(Driver):
     # Stop data acquisition.
     #
     def stopAcquisition(self):
-        self.mock_acquisiton_running = False
+        with self.mock_frame_condition:
+            self.mock_acquisiton_running = False
+            self.mock_frame_condition.notify_all()
 
     def updateIndices(self):
-        self.mock_start_time = time.time_ns()
-        self.last_frame_number = 0
+        with self.mock_frame_condition:
+            self.mock_start_time = time.time_ns()
+            self.last_frame_number = 0
+            self.mock_frame_condition.notify_all()
 
     # shutdown
     #
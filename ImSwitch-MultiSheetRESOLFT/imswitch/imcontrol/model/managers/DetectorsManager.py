@@ -16,6 +16,7 @@ class DetectorsManager(MultiManager, SignalInterface):
     sigImageUpdated = Signal(
         str, np.ndarray, bool, bool
     )  # (detectorName, image, init, isCurrentDetector)
+    sigLatestImageAvailable = Signal(str)  # (detectorName)
 
     def __init__(self, detectorInfos, updatePeriod, **lowLevelManagers):
         MultiManager.__init__(self, detectorInfos, 'detectors', **lowLevelManagers)
@@ -25,14 +26,19 @@ class DetectorsManager(MultiManager, SignalInterface):
         self._activeAcqLVHandles = []
         self._activeAcqsMutex = Mutex()
 
+        # Latest LiveView image of each detector that has not been emitted yet
+        self._latestImages = {}
+        self._latestImagesMutex = Mutex()
+        self.sigLatestImageAvailable.connect(self._emitLatestImage)
+
         self._currentDetectorName = None
         for detectorName, detectorInfo in detectorInfos.items():
             if not self._subManagers[detectorName].forAcquisition:
                 continue
             # Connect signals
             self._subManagers[detectorName].sigImageUpdated.connect(
-                lambda image, init, detectorName=detectorName: self.sigImageUpdated.emit(
-                    detectorName, image, init, detectorName == self._currentDetectorName
+                lambda image, init, detectorName=detectorName: self._setLatestImage(
+                    detectorName, image, init
                 )
             )
 
@@ -81,6 +87,40 @@ class DetectorsManager(MultiManager, SignalInterface):
         if self._thread.isRunning():
             self.execOnCurrent(lambda c: c.updateLatestFrame(True))
 
+    def _setLatestImage(self, detectorName, image, init):
+        """ Called in the LiveView thread. Only the latest image of each
+        detector is kept until it has been emitted, so that images do not queue
+        up when they are shown slower than the LiveView update rate. """
+        self._latestImagesMutex.lock()
+        try:
+            pending = detectorName in self._latestImages
+            if pending:
+                # Keep the init flag of the first LiveView image
+                init = init or self._latestImages[detectorName][1]
+            self._latestImages[detectorName] = (image, init)
+        finally:
+            self._latestImagesMutex.unlock()
+
+        if not pending:
+            self.sigLatestImageAvailable.emit(detectorName)
+
+    def _emitLatestImage(self, detectorName):
+        """ Called in the thread of the DetectorsManager. Emits the latest
+        image of the detector, if it has not already been emitted. """
+        self._latestImagesMutex.lock()
+        try:
+            latestImage = self._latestImages.pop(detectorName, None)
+        finally:
+            self._latestImagesMutex.unlock()
+
+        if latestImage is None:
+            return
+
+        image, init = latestImage
+        self.sigImageUpdated.emit(
+            detectorName, image, init, detectorName == self._currentDetectorName
+        )
+
     def execOnCurrent(self, func):
         """ Executes a function on the current detector and returns the result. """
         if not self.hasDevices():
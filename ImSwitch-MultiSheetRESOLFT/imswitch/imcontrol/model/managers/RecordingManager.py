@@ -1,7 +1,10 @@
 import enum
 import os
+import shutil
+import tempfile
+import threading
 import time
-from io import BytesIO
+from collections import deque
 
 import h5py
 import numpy as np
@@ -10,6 +13,11 @@ import tifffile as tiff
 from imswitch.imcommon.framework import Signal, SignalInterface, Thread, Worker
 from imswitch.imcommon.model import initLogger
 
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
 
 class RecordingManager(SignalInterface):
     """ RecordingManager handles single frame captures as well as continuous
@@ -19,6 +27,9 @@ class RecordingManager(SignalInterface):
     sigRecordingEnded = Signal()
     sigRecordingFrameNumUpdated = Signal(int)  # (frameNumber)
     sigRecordingTimeUpdated = Signal(int)  # (recTime)
+    sigRecordingQueueDepthUpdated = Signal(int)  # (queuedFrames)
+    sigRecordingDroppedFramesUpdated = Signal(int)  # (droppedFrames)
+    sigRecordingFramesAvailable = Signal(str, np.ndarray)  # (detectorName, frames)
     sigMemorySnapAvailable = Signal(
         str, np.ndarray, object, bool
     )  # (name, image, filePath, savedToDisk)
@@ -30,9 +41,11 @@ class RecordingManager(SignalInterface):
         super().__init__()
         self.__logger = initLogger(self)
 
-        self._memRecordings = {}  # { filePath: bytesIO }
+        self._memRecordings = {}  # { filePath: memoryFilePath }
+        self.__memRecordingDir = None
         self.__detectorsManager = detectorsManager
         self.__record = False
+        self.__emitFrames = False
         self.__recordingWorker = RecordingWorker(self)
         self.__thread = Thread()
         self.__recordingWorker.moveToThread(self.__thread)
@@ -52,14 +65,28 @@ class RecordingManager(SignalInterface):
     def detectorsManager(self):
         return self.__detectorsManager
 
+    @property
+    def emitFrames(self):
+        """ Whether the recorded frames are also emitted through
+        sigRecordingFramesAvailable, e.g. for a live preview. The frames are
+        copied before they are emitted, so this is disabled by default. """
+        return self.__emitFrames
+
+    @emitFrames.setter
+    def emitFrames(self, emitFrames):
+        self.__emitFrames = emitFrames
+
     def startRecording(self, detectorNames, recMode, savename, saveMode, attrs,
                        singleMultiDetectorFile=False, singleLapseFile=False,
-                       recFrames=None, recTime=None):
+                       recFrames=None, recTime=None, chunkFrames=None,
+                       compression=None):
         """ Starts a recording with the specified detectors, recording mode,
         file name prefix and attributes to save to the recording per detector.
         In SpecFrames mode, recFrames (the number of frames) must be specified,
         and in SpecTime mode, recTime (the recording time in seconds) must be
-        specified. """
+        specified. The HDF5 datasets are stored in chunks of chunkFrames full
+        frames, e.g. one frame or the frames of one pLS-RESOLFT cycle (chosen
+        by h5py if None), compressed with the given Compression. """
 
         self.__logger.info('Starting recording')
         self.__record = True
@@ -72,6 +99,15 @@ class RecordingManager(SignalInterface):
         self.__recordingWorker.recTime = recTime
         self.__recordingWorker.singleMultiDetectorFile = singleMultiDetectorFile
         self.__recordingWorker.singleLapseFile = singleLapseFile
+        self.__recordingWorker.chunkFrames = chunkFrames
+        self.__recordingWorker.compressionOptions = self.getCompressionOptions(compression)
+        self.__detectorsManager.execOnAll(
+            lambda c: c.setRecordingLength(
+                numFrames=recFrames if recMode == RecMode.SpecFrames else None,
+                seconds=recTime if recMode == RecMode.SpecTime else None
+            ),
+            condition=lambda c: c.forAcquisition
+        )
         self.__detectorsManager.execOnAll(lambda c: c.flushBuffers(),
                                           condition=lambda c: c.forAcquisition)
         self.__thread.start()
@@ -89,11 +125,14 @@ class RecordingManager(SignalInterface):
             self.sigRecordingEnded.emit()
         if wait:
             self.__thread.wait()
+        self.__detectorsManager.execOnAll(lambda c: c.setRecordingLength(),
+                                          condition=lambda c: c.forAcquisition)
 
-    def snap(self, detectorNames, savename, saveMode, saveFormat, attrs):
+    def snap(self, detectorNames, savename, saveMode, saveFormat, attrs, compression=None):
         """ Saves a single frame capture with the specified detectors to a file
         with the specified name prefix, save mode, file format and attributes
-        to save to the capture per detector. """
+        to save to the capture per detector. HDF5 captures are compressed with
+        the given Compression. """
         acqHandle = self.__detectorsManager.startAcquisition()
         try:
             images = {}
@@ -111,7 +150,8 @@ class RecordingManager(SignalInterface):
                         file = h5py.File(filePath, 'w')
 
                         shape = self.__detectorsManager[detectorName].shape
-                        dataset = file.create_dataset('data', tuple(reversed(shape)), dtype='i2')
+                        dataset = file.create_dataset('data', tuple(reversed(shape)), dtype='i2',
+                                                      **self.getCompressionOptions(compression))
 
                         for key, value in attrs[detectorName].items():
                             dataset.attrs[key] = value
@@ -137,6 +177,49 @@ class RecordingManager(SignalInterface):
         finally:
             self.__detectorsManager.stopAcquisition(acqHandle)
 
+    def getCompressionOptions(self, compression):
+        """ Returns the keyword arguments for h5py's create_dataset to compress
+        a dataset with the given Compression. LZ4, Blosc and bitshuffle+LZ4
+        need hdf5plugin; without it, the data is saved uncompressed. """
+        if compression is None or compression == Compression.NoCompression:
+            return {}
+        elif compression == Compression.GZIP:
+            return {'compression': 'gzip', 'compression_opts': 1, 'shuffle': True}
+        elif compression == Compression.LZF:
+            return {'compression': 'lzf', 'shuffle': True}
+
+        if hdf5plugin is None:
+            self.__logger.warning(f'hdf5plugin is not installed, {compression.name} compression'
+                                  f' is not available, saving uncompressed data')
+            return {}
+        elif compression == Compression.LZ4:
+            return dict(hdf5plugin.LZ4())
+        elif compression == Compression.Blosc:
+            return dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+        elif compression == Compression.BitshuffleLZ4:
+            return dict(hdf5plugin.Bitshuffle(cname='lz4'))
+        else:
+            raise ValueError(f'Unsupported compression "{compression}"')
+
+    def getMemoryFilePath(self, filePath):
+        """ Returns a new path in memory for a RAM recording that will be saved
+        to filePath. RAM recordings are stored in a temporary folder on the
+        shared memory file system if there is one (/dev/shm), so that their
+        frames can be memory mapped without being copied. """
+        if self.__memRecordingDir is None:
+            sharedMemoryDir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            self.__memRecordingDir = tempfile.mkdtemp(prefix='imswitch_recordings_',
+                                                      dir=sharedMemoryDir)
+        return os.path.join(self.__memRecordingDir,
+                            f'{len(self._memRecordings)}_{os.path.basename(filePath)}')
+
+    def removeMemoryRecordings(self):
+        """ Deletes the files of all RAM recordings, e.g. when closing. """
+        if self.__memRecordingDir is not None:
+            shutil.rmtree(self.__memRecordingDir, ignore_errors=True)
+            self.__memRecordingDir = None
+        self._memRecordings = {}
+
     def getSaveFilePath(self, path, allowOverwriteDisk=False, allowOverwriteMem=False):
         newPath = path
         numExisting = 0
@@ -158,7 +241,9 @@ class RecordingManager(SignalInterface):
 class RecordingWorker(Worker):
     def __init__(self, recordingManager):
         super().__init__()
+        self.__logger = initLogger(self)
         self.__recordingManager = recordingManager
+        self.frameWaitTimeout = 0.1  # s
 
     def run(self):
         acqHandle = self.__recordingManager.detectorsManager.startAcquisition()
@@ -169,14 +254,26 @@ class RecordingWorker(Worker):
 
     def _record(self):
         files, fileDests, filePaths = self._getFiles()
+        if self.saveMode == SaveMode.RAM and self.compressionOptions:
+            self.__logger.warning('RAM recordings are saved uncompressed, so that they can be'
+                                  ' memory mapped')
 
         shapes = {detectorName: self.__recordingManager.detectorsManager[detectorName].shape
                   for detectorName in self.detectorNames}
 
+        if self.recMode in [RecMode.SpecFrames, RecMode.ScanOnce, RecMode.ScanLapse]:
+            expectedFrames = self.recFrames
+        else:
+            expectedFrames = None
+
         currentFrame = {}
         datasets = {}
+        self._frameCounts = {}
+        self._droppedFrames = 0
+        writer = RecordingWriter()
         for detectorName in self.detectorNames:
             currentFrame[detectorName] = 0
+            self._frameCounts[detectorName] = 0
 
             datasetName = detectorName
             if self.recMode == RecMode.ScanLapse and self.singleLapseFile:
@@ -190,10 +287,20 @@ class RecordingWorker(Worker):
 
             # Initial number of frames must not be 0; otherwise, too much disk space may get
             # allocated. We remove this default frame later on if no frames are captured.
+            if self.saveMode == SaveMode.RAM:
+                # Frames are stored uncompressed in a raw file next to the HDF5 file, so that
+                # consumers can memory map them instead of copying them
+                rawFilePath = f'{os.path.splitext(fileDests[detectorName])[0]}_{datasetName}.raw'
+                storageOptions = dict(external=[(rawFilePath, 0, h5py.h5f.UNLIMITED)])
+            elif self.chunkFrames is not None:
+                storageOptions = dict(chunks=(self.chunkFrames, *reversed(shapes[detectorName])),
+                                      **self.compressionOptions)
+            else:
+                storageOptions = self.compressionOptions
             datasets[detectorName] = files[detectorName].create_dataset(
                 datasetName, (1, *reversed(shapes[detectorName])),
                 maxshape=(None, *reversed(shapes[detectorName])),
-                dtype='i2'
+                dtype='i2', **storageOptions
             )
 
             for key, value in self.attrs[detectorName].items():
@@ -205,6 +312,23 @@ class RecordingWorker(Worker):
             datasets[detectorName].attrs['element_size_um'] \
                 = self.__recordingManager.detectorsManager[detectorName].pixelSizeUm
 
+            writer.addDataset(detectorName, datasets[detectorName], expectedFrames)
+
+            # Frame number and time stamp of every frame, to detect dropped frames and to
+            # align the frames of several detectors. They are kept in a group, so that the
+            # frames remain the only datasets in the root of the file.
+            frameInfo = files[detectorName].require_group('frame_info').create_group(datasetName)
+            for infoName, dtype in [('frame_numbers', 'i8'), ('timestamps', 'f8')]:
+                infoDataset = frameInfo.create_dataset(infoName, (1,), maxshape=(None,),
+                                                       dtype=dtype)
+                writer.addDataset((detectorName, infoName), infoDataset, expectedFrames)
+        writer.start()
+        self._frameWaiter = FrameWaiter(
+            {detectorName: self.__recordingManager.detectorsManager[detectorName]
+             for detectorName in self.detectorNames},
+            self.frameWaitTimeout
+        )
+
         self.__recordingManager.sigRecordingStarted.emit()
         try:
             if len(self.detectorNames) < 1:
@@ -223,18 +347,19 @@ class RecordingWorker(Worker):
                         if currentFrame[detectorName] >= recFrames:
                             continue  # Reached requested number of frames with this detector, skip
 
-                        newFrames = self._getNewFrames(detectorName)
+                        newFrames, frameNumbers, timestamps = self._getNewFrames(detectorName)
                         n = len(newFrames)
                         if n > 0:
                             it = currentFrame[detectorName]
-                            dataset = datasets[detectorName]
                             if (it + n) <= recFrames:
-                                dataset.resize(n + it, axis=0)
-                                dataset[it:it + n, :, :] = newFrames
+                                self._writeFrames(writer, detectorName,
+                                                  newFrames, frameNumbers, timestamps)
                                 currentFrame[detectorName] += n
                             else:
-                                dataset.resize(recFrames, axis=0)
-                                dataset[it:recFrames, :, :] = newFrames[0:recFrames - it]
+                                self._writeFrames(writer, detectorName,
+                                                  newFrames[0:recFrames - it],
+                                                  frameNumbers[0:recFrames - it],
+                                                  timestamps[0:recFrames - it])
                                 currentFrame[detectorName] = recFrames
 
                             # Things get a bit weird if we have multiple detectors when we report
@@ -243,7 +368,11 @@ class RecordingWorker(Worker):
                             self.__recordingManager.sigRecordingFrameNumUpdated.emit(
                                 min(list(currentFrame.values()))
                             )
-                    time.sleep(0.0001)  # Prevents freezing for some reason
+                            self.__recordingManager.sigRecordingQueueDepthUpdated.emit(
+                                writer.queuedFrames
+                            )
+                    self._waitForFrames([detectorName for detectorName in self.detectorNames
+                                         if currentFrame[detectorName] < recFrames])
 
                 self.__recordingManager.sigRecordingFrameNumUpdated.emit(0)
             elif self.recMode == RecMode.SpecTime:
@@ -256,14 +385,15 @@ class RecordingWorker(Worker):
                 shouldStop = False
                 while True:
                     for detectorName in self.detectorNames:
-                        newFrames = self._getNewFrames(detectorName)
+                        newFrames, frameNumbers, timestamps = self._getNewFrames(detectorName)
                         n = len(newFrames)
                         if n > 0:
-                            it = currentFrame[detectorName]
-                            dataset = datasets[detectorName]
-                            dataset.resize(n + it, axis=0)
-                            dataset[it:it + n, :, :] = newFrames
+                            self._writeFrames(writer, detectorName,
+                                              newFrames, frameNumbers, timestamps)
                             currentFrame[detectorName] += n
+                            self.__recordingManager.sigRecordingQueueDepthUpdated.emit(
+                                writer.queuedFrames
+                            )
                             self.__recordingManager.sigRecordingTimeUpdated.emit(
                                 np.around(currentRecTime, decimals=2)
                             )
@@ -275,21 +405,22 @@ class RecordingWorker(Worker):
                     if not self.__recordingManager.record or currentRecTime >= recTime:
                         shouldStop = True
 
-                    time.sleep(0.0001)  # Prevents freezing for some reason
+                    self._waitForFrames(self.detectorNames)
 
                 self.__recordingManager.sigRecordingTimeUpdated.emit(0)
             elif self.recMode == RecMode.UntilStop:
                 shouldStop = False
                 while True:
                     for detectorName in self.detectorNames:
-                        newFrames = self._getNewFrames(detectorName)
+                        newFrames, frameNumbers, timestamps = self._getNewFrames(detectorName)
                         n = len(newFrames)
                         if n > 0:
-                            it = currentFrame[detectorName]
-                            dataset = datasets[detectorName]
-                            dataset.resize(n + it, axis=0)
-                            dataset[it:it + n, :, :] = newFrames
+                            self._writeFrames(writer, detectorName,
+                                              newFrames, frameNumbers, timestamps)
                             currentFrame[detectorName] += n
+                            self.__recordingManager.sigRecordingQueueDepthUpdated.emit(
+                                writer.queuedFrames
+                            )
 
                     if shouldStop:
                         break
@@ -297,33 +428,49 @@ class RecordingWorker(Worker):
                     if not self.__recordingManager.record:
                         shouldStop = True  # Enter loop one final time, then stop
 
-                    time.sleep(0.0001)  # Prevents freezing for some reason
+                    self._waitForFrames(self.detectorNames)
             else:
                 raise ValueError('Unsupported recording mode specified')
         finally:
-            for detectorName, file in files.items():
-                # Remove default frame if no frames have been captured
-                if currentFrame[detectorName] < 1:
-                    datasets[detectorName].resize(0, axis=0)
-
-                # Handle memory recordings
-                if self.saveMode == SaveMode.RAM or self.saveMode == SaveMode.DiskAndRAM:
-                    filePath = filePaths[detectorName]
-                    name = os.path.basename(filePath)
-                    if self.saveMode == SaveMode.RAM:
-                        file.close()
-                        self.__recordingManager.sigMemoryRecordingAvailable.emit(
-                            name, fileDests[detectorName], filePath, False
-                        )
-                    else:
-                        file.flush()
-                        self.__recordingManager.sigMemoryRecordingAvailable.emit(
-                            name, file, filePath, True
-                        )
-                else:
+            self._frameWaiter.close()
+            try:
+                # Writes the remaining frames and shrinks the datasets to the written frames,
+                # which also removes the default frame if no frames have been captured
+                writer.close()
+                if writer.blockedTime > 0:
+                    self.__logger.warning(f'Recording waited {writer.blockedTime:.2f} s for the'
+                                          f' disk, max {writer.maxQueuedFrames} frames queued')
+                for detectorName in self.detectorNames:
+                    droppedFrames = self.__recordingManager.detectorsManager[
+                        detectorName
+                    ].droppedFrames
+                    datasets[detectorName].attrs['dropped_frames'] = droppedFrames
+                    if droppedFrames > 0:
+                        self.__logger.warning(f'{detectorName} dropped {droppedFrames} frames'
+                                              f' during the recording')
+            finally:
+                self._closeFiles(files, fileDests, filePaths)
+                self.__recordingManager.sigRecordingQueueDepthUpdated.emit(0)
+                self.__recordingManager.endRecording(wait=False)
+
+    def _closeFiles(self, files, fileDests, filePaths):
+        for detectorName, file in files.items():
+            # Handle memory recordings
+            if self.saveMode == SaveMode.RAM or self.saveMode == SaveMode.DiskAndRAM:
+                filePath = filePaths[detectorName]
+                name = os.path.basename(filePath)
+                if self.saveMode == SaveMode.RAM:
                     file.close()
-
-            self.__recordingManager.endRecording(wait=False)
+                    self.__recordingManager.sigMemoryRecordingAvailable.emit(
+                        name, h5py.File(fileDests[detectorName], 'r'), filePath, False
+                    )
+                else:
+                    file.flush()
+                    self.__recordingManager.sigMemoryRecordingAvailable.emit(
+                        name, file, filePath, True
+                    )
+            else:
+                file.close()
 
     def _getFiles(self):
         singleMultiDetectorFile = self.singleMultiDetectorFile
@@ -338,18 +485,19 @@ class RecordingWorker(Worker):
             else:
                 baseFilePath = f'{self.savename}_{detectorName}.hdf5'
 
+            # RAM recordings are not appended to, since the previous scan may still be open
+            # for reading; every scan of a lapse is a RAM recording of its own
             filePaths[detectorName] = self.__recordingManager.getSaveFilePath(
                 baseFilePath,
-                allowOverwriteDisk=singleLapseFile and self.saveMode != SaveMode.RAM,
-                allowOverwriteMem=singleLapseFile and self.saveMode == SaveMode.RAM
+                allowOverwriteDisk=singleLapseFile and self.saveMode != SaveMode.RAM
             )
 
         for detectorName in self.detectorNames:
             if self.saveMode == SaveMode.RAM:
                 memRecordings = self.__recordingManager._memRecordings
-                if (filePaths[detectorName] not in memRecordings or
-                        memRecordings[filePaths[detectorName]].closed):
-                    memRecordings[filePaths[detectorName]] = BytesIO()
+                if filePaths[detectorName] not in memRecordings:
+                    memRecordings[filePaths[detectorName]] = \
+                        self.__recordingManager.getMemoryFilePath(filePaths[detectorName])
                 fileDests[detectorName] = memRecordings[filePaths[detectorName]]
             else:
                 fileDests[detectorName] = filePaths[detectorName]
@@ -357,15 +505,303 @@ class RecordingWorker(Worker):
             if singleMultiDetectorFile and len(files) > 0:
                 files[detectorName] = list(files.values())[0]
             else:
-                files[detectorName] = h5py.File(fileDests[detectorName],
-                                                'a' if singleLapseFile else 'w-')
+                files[detectorName] = h5py.File(
+                    fileDests[detectorName],
+                    'a' if singleLapseFile and self.saveMode != SaveMode.RAM else 'w-'
+                )
 
         return files, fileDests, filePaths
 
+    def _waitForFrames(self, detectorNames):
+        """ Waits until any of the detectors has new frames, instead of
+        polling the detectors in a busy loop. The timeout bounds how long it
+        takes to notice that the recording was stopped. """
+        if len(detectorNames) > 0:
+            self._frameWaiter.wait(detectorNames, self.frameWaitTimeout)
+
     def _getNewFrames(self, detectorName):
-        newFrames = self.__recordingManager.detectorsManager[detectorName].getChunk()
-        newFrames = np.array(newFrames)
-        return newFrames
+        detector = self.__recordingManager.detectorsManager[detectorName]
+        newFrames, frameNumbers, timestamps = detector.getChunkWithInfo()
+        newFrames = np.asarray(newFrames)  # Avoid copying frames that are already an array
+        if frameNumbers is None:
+            # Detector does not count frames, number the frames as they arrive
+            frameNumbers = np.arange(self._frameCounts[detectorName],
+                                     self._frameCounts[detectorName] + len(newFrames))
+        self._frameCounts[detectorName] += len(newFrames)
+
+        droppedFrames = sum(self.__recordingManager.detectorsManager[name].droppedFrames
+                            for name in self.detectorNames)
+        if droppedFrames != self._droppedFrames:
+            self._droppedFrames = droppedFrames
+            self.__recordingManager.sigRecordingDroppedFramesUpdated.emit(droppedFrames)
+        return newFrames, frameNumbers, timestamps
+
+    def _writeFrames(self, writer, detectorName, frames, frameNumbers, timestamps):
+        if self.__recordingManager.emitFrames:
+            # Copy, the frames may be a view of the detector buffer
+            self.__recordingManager.sigRecordingFramesAvailable.emit(detectorName,
+                                                                     np.array(frames))
+        # Frames of detectors that overwrite their frame buffer are copied when queued, the
+        # detector keeps capturing while they wait to be written
+        detector = self.__recordingManager.detectorsManager[detectorName]
+        writer.write(detectorName, frames, copy=detector.bufferSize is not None)
+        writer.write((detectorName, 'frame_numbers'), np.asarray(frameNumbers, dtype='i8'))
+        writer.write((detectorName, 'timestamps'), np.asarray(timestamps, dtype='f8'))
+
+
+class RecordingWriter:
+    """ Writes chunks of frames to HDF5 datasets in a background thread, so
+    that the thread polling the detectors does not wait for the disk. Chunks
+    are queued until at most maxQueuedBytes are waiting; when the queue is
+    full, write blocks until the writer has caught up (back-pressure), and
+    the time spent waiting is added to blockedTime. Datasets are preallocated
+    to the expected number of frames or grown geometrically, and frames are
+    written in blocks aligned to the HDF5 chunks of the dataset. Frames that
+    are held back until they fill a chunk count towards maxQueuedBytes.
+    Queued chunks are not copied unless requested, frames that the caller
+    overwrites before they are written, e.g. views of a detector ring buffer,
+    are copied into buffers that the writer reuses. """
+
+    defaultMaxQueuedBytes = 1024 ** 3
+
+    def __init__(self, maxQueuedBytes=defaultMaxQueuedBytes):
+        self.maxQueuedBytes = maxQueuedBytes
+        self.queuedFrames = 0
+        self.maxQueuedFrames = 0
+        self.blockedTime = 0.0
+
+        self._datasets = {}
+        self._queue = deque()
+        self._queuedBytes = 0  # Queued frames and frames held back by the datasets
+        self._bufferPool = _BufferPool(maxQueuedBytes)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def addDataset(self, key, dataset, expectedFrames=None):
+        """ Adds a dataset of shape (frames, ...), e.g. (frames, height, width),
+        to write the frames of key to, starting at the first frame. If
+        expectedFrames is given, the dataset is resized to it at once. """
+        chunkFrames = dataset.chunks[0] if dataset.chunks is not None else 1
+        self._datasets[key] = _WriterDataset(dataset, chunkFrames)
+        if expectedFrames is not None and expectedFrames > 0:
+            _resizeDataset(dataset, expectedFrames)
+
+    def start(self):
+        self._thread.start()
+
+    def write(self, key, frames, copy=False):
+        """ Queues the frames to be written after the frames previously queued
+        for key. If copy, the frames are copied first, so that the caller may
+        overwrite them as soon as write returns, also while it waits for the
+        queue. """
+        buffer = None
+        if copy:
+            frames, buffer = self._bufferPool.copy(frames)
+
+        with self._condition:
+            if self._queue and self._queuedBytes + frames.nbytes > self.maxQueuedBytes:
+                startTime = time.perf_counter()
+                while (self._queue and self._error is None and
+                       self._queuedBytes + frames.nbytes > self.maxQueuedBytes):
+                    self._condition.wait()
+                self.blockedTime += time.perf_counter() - startTime
+            self._raiseError()
+
+            self._queue.append((key, frames, buffer))
+            self._queuedBytes += frames.nbytes
+            self.queuedFrames += len(frames)
+            self.maxQueuedFrames = max(self.maxQueuedFrames, self.queuedFrames)
+            self._condition.notify_all()
+
+    def close(self):
+        """ Writes all queued frames, stops the writer thread and shrinks the
+        datasets to the number of frames written. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+        with self._condition:
+            self._raiseError()
+        for target in self._datasets.values():
+            target.flush()
+            _resizeDataset(target.dataset, target.numFrames)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                key, frames, buffer = self._queue[0]
+
+            pendingBytes = self._datasets[key].pendingBytes
+            try:
+                self._datasets[key].write(frames)
+            except Exception as e:
+                with self._condition:
+                    self._error = e
+                    self._queue.clear()
+                    self._condition.notify_all()
+                return
+
+            if buffer is not None:
+                self._bufferPool.release(buffer)
+
+            with self._condition:
+                self._queue.popleft()
+                self._queuedBytes += self._datasets[key].pendingBytes - pendingBytes - frames.nbytes
+                self.queuedFrames -= len(frames)
+                self._condition.notify_all()
+
+    def _raiseError(self):
+        if self._error is not None:
+            raise RuntimeError('Failed to write recording') from self._error
+
+
+class _BufferPool:
+    """ Buffers that RecordingWriter copies queued frames into, which are
+    reused once the frames are written, instead of allocating memory for
+    every chunk. Buffers hold a power of two of frames, such that chunks of
+    varying length reuse them, and at most maxBytes of unused buffers are
+    kept. """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self._free = {}  # Unused buffers by (frames, frame shape, dtype)
+        self._freeBytes = 0
+        self._lock = threading.Lock()
+
+    def copy(self, frames):
+        """ Copies the frames into a buffer, returns the copy and the buffer,
+        which is to be released when the copy is no longer used. """
+        capacity = 1 << max(len(frames) - 1, 0).bit_length()
+        key = (capacity, frames.shape[1:], frames.dtype)
+        with self._lock:
+            buffers = self._free.get(key)
+            buffer = buffers.pop() if buffers else None
+            if buffer is not None:
+                self._freeBytes -= buffer.nbytes
+        if buffer is None:
+            buffer = np.empty((capacity, *frames.shape[1:]), dtype=frames.dtype)
+        copy = buffer[:len(frames)]
+        copy[...] = frames
+        return copy, buffer
+
+    def release(self, buffer):
+        with self._lock:
+            if self._freeBytes + buffer.nbytes <= self.maxBytes:
+                key = (len(buffer), buffer.shape[1:], buffer.dtype)
+                self._free.setdefault(key, []).append(buffer)
+                self._freeBytes += buffer.nbytes
+
+
+class FrameWaiter:
+    """ Waits until any of several detectors has new frames. Every detector
+    is waited for in a thread of its own, which blocks in waitForFrames and
+    marks the detector as having new frames. It then waits until wait has
+    returned for the detector, i.e. until its frames are read, before waiting
+    for the next frames. timeout bounds how long close takes. """
+
+    def __init__(self, detectors, timeout):
+        self._detectors = detectors
+        self._timeout = timeout
+        self._newFrames = set()  # Names of the detectors with new frames
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, args=(detectorName,), daemon=True)
+                         for detectorName in detectors]
+        for thread in self._threads:
+            thread.start()
+
+    def wait(self, detectorNames, timeout):
+        """ Blocks until any of the detectors has new frames, or until timeout
+        seconds have passed, and returns whether there are new frames. The
+        frames of all the detectors are expected to be read afterwards. """
+        with self._condition:
+            hasNewFrames = self._condition.wait_for(
+                lambda: not self._newFrames.isdisjoint(detectorNames), timeout
+            )
+            self._newFrames.difference_update(detectorNames)
+            self._condition.notify_all()
+        return hasNewFrames
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, detectorName):
+        detector = self._detectors[detectorName]
+        while not self._closed:
+            if not detector.waitForFrames(self._timeout):
+                continue
+            with self._condition:
+                self._newFrames.add(detectorName)
+                self._condition.notify_all()
+                self._condition.wait_for(
+                    lambda: detectorName not in self._newFrames or self._closed
+                )
+
+
+class _WriterDataset:
+    """ A dataset written to by RecordingWriter. Writes always start at a
+    multiple of the number of frames per HDF5 chunk, frames left over that do
+    not fill a chunk are kept until the next write or flush. """
+
+    def __init__(self, dataset, chunkFrames):
+        self.dataset = dataset
+        self.chunkFrames = chunkFrames
+        self.capacity = dataset.shape[0]
+        self.numFrames = 0  # Frames written to the dataset
+        self.pending = []  # Frames that do not fill a chunk yet
+
+    @property
+    def pendingBytes(self):
+        return sum(pendingFrames.nbytes for pendingFrames in self.pending)
+
+    def write(self, frames):
+        numPending = sum(len(pendingFrames) for pendingFrames in self.pending)
+        if numPending > 0:
+            n = min(self.chunkFrames - numPending, len(frames))
+            self.pending.append(np.array(frames[:n]))
+            frames = frames[n:]
+            if numPending + n < self.chunkFrames:
+                return
+            self.flush()
+
+        n = len(frames) // self.chunkFrames * self.chunkFrames
+        if n > 0:
+            self._writeBlock(frames[:n])
+        if n < len(frames):
+            self.pending.append(np.array(frames[n:]))
+
+    def flush(self):
+        """ Writes the frames that do not fill a chunk """
+        if self.pending:
+            self._writeBlock(np.concatenate(self.pending))
+            self.pending = []
+
+    def _writeBlock(self, frames):
+        n = len(frames)
+        if self.numFrames + n > self.capacity:
+            self.capacity = max(self.numFrames + n, 2 * self.capacity)
+            _resizeDataset(self.dataset, self.capacity)
+        self.dataset[self.numFrames:self.numFrames + n] = frames
+        self.numFrames += n
+
+
+def _resizeDataset(dataset, numFrames):
+    """ Resizes the frame axis of the dataset. h5py only resizes chunked
+    datasets, so this goes through the low-level API, which also resizes
+    datasets stored in an external file of unlimited size. """
+    dataset.id.set_extent((numFrames, *dataset.shape[1:]))
 
 
 class RecMode(enum.Enum):
@@ -387,6 +823,15 @@ class SaveFormat(enum.Enum):
     TIFF = 2
 
 
+class Compression(enum.Enum):
+    NoCompression = 1
+    GZIP = 2
+    LZF = 3
+    LZ4 = 4
+    Blosc = 5
+    BitshuffleLZ4 = 6
+
+
 # Copyright (C) 2020-2021 ImSwitch developers
 # This file is part of ImSwitch.
 #
@@ -5,7 +5,7 @@ from .NidaqManager import NidaqManager
 from .PulseStreamerManager import PulseStreamerManager
 from .PositionersManager import PositionersManager
 from .RS232sManager import RS232sManager
-from .RecordingManager import RecordingManager, RecMode, SaveMode, SaveFormat
+from .RecordingManager import RecordingManager, RecMode, SaveMode, SaveFormat, Compression
 from .SLMManager import SLMManager
 from .ScanManager import ScanManager
 from .TriggerScopeManager import TriggerScopeManager
@@ -1,3 +1,4 @@
+import time
 import traceback
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
@@ -101,6 +102,10 @@ class DetectorManager(SignalInterface):
         self.__fullShape = fullShape
         self.__supportedBinnings = supportedBinnings
         self.__image = np.array([])
+        self.__lastLiveViewTime = None
+
+        self.setLiveViewBinning(detectorInfo.liveViewBinning)
+        self.setLiveViewMaxFPS(detectorInfo.liveViewMaxFPS)
 
         self.__forAcquisition = detectorInfo.forAcquisition
         self.__forFocusLock = detectorInfo.forFocusLock
@@ -112,11 +117,17 @@ class DetectorManager(SignalInterface):
 
     def updateLatestFrame(self, init):
         """ :meta private: """
+        now = time.perf_counter()
+        if (init and self.__liveViewMaxFPS is not None and self.__lastLiveViewTime is not None
+                and now - self.__lastLiveViewTime < 1 / self.__liveViewMaxFPS):
+            return
+
         try:
             self.__image = self.getLatestFrame()
         except Exception:
             self.__logger.error(traceback.format_exc())
         else:
+            self.__lastLiveViewTime = now
             self.sigImageUpdated.emit(self.__image, init)
 
     def setParameter(self, name: str, value: Any) -> Dict[str, DetectorParameter]:
@@ -180,6 +191,38 @@ class DetectorManager(SignalInterface):
         """ Latest LiveView image. """
         return self.__image
 
+    @property
+    def liveViewBinning(self) -> int:
+        """ Number of pixels along each axis that are summed into one pixel of
+        the images shown in the live view, see binLiveViewImage. """
+        return self.__liveViewBinning
+
+    @property
+    def liveViewMaxFPS(self) -> Optional[float]:
+        """ Maximum number of live view images emitted per second, or None if
+        an image is emitted every live view update. """
+        return self.__liveViewMaxFPS
+
+    def setLiveViewBinning(self, liveViewBinning: int) -> None:
+        """ Sets the number of pixels along each axis that are summed into one
+        pixel of the images shown in the live view. """
+        if int(liveViewBinning) < 1:
+            raise ValueError(f'Live view binning must be at least 1, got "{liveViewBinning}"')
+        self.__liveViewBinning = int(liveViewBinning)
+
+    def setLiveViewMaxFPS(self, liveViewMaxFPS: Optional[float]) -> None:
+        """ Sets the maximum number of live view images emitted per second,
+        None to emit an image every live view update. """
+        if liveViewMaxFPS is not None and liveViewMaxFPS <= 0:
+            raise ValueError(f'Live view max FPS must be positive, got "{liveViewMaxFPS}"')
+        self.__liveViewMaxFPS = liveViewMaxFPS
+
+    def binLiveViewImage(self, image: np.ndarray) -> np.ndarray:
+        """ Returns the image binned by liveViewBinning for display. Images
+        emitted through sigImageUpdated are not binned, since other consumers
+        than the live view display need the full image. """
+        return _binImage(image, self.__liveViewBinning)
+
     @property
     def parameters(self) -> Dict[str, DetectorParameter]:
         """ Dictionary of available parameters. """
@@ -229,7 +272,9 @@ class DetectorManager(SignalInterface):
         """ Returns the frames captured by the detector since getChunk was last
         called, or since the buffers were last flushed (whichever happened
         last). The returned object is a numpy array of shape
-        (numFrames, height, width). """
+        (numFrames, height, width). It may be a view of the detector's frame
+        buffer, which is overwritten once the detector has filled the buffer
+        again, so frames that should be kept must be copied. """
         pass
 
     @abstractmethod
@@ -238,6 +283,45 @@ class DetectorManager(SignalInterface):
         frame captured at the time that this function was called. """
         pass
 
+    def getChunkWithInfo(self) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+        """ Returns the same frames as getChunk, together with the number of
+        each frame counted from the start of the acquisition, or None if the
+        detector does not count frames, and the time stamp of each frame in
+        seconds since the epoch. Detectors without time stamps use the time
+        at which the frames were read. """
+        frames = np.asarray(self.getChunk())
+        return frames, None, np.full(len(frames), time.time())
+
+    @property
+    def droppedFrames(self) -> int:
+        """ The number of frames that were lost since the buffers were last
+        flushed, because the detector overwrote them before they were read. """
+        return 0
+
+    @property
+    def bufferSize(self) -> Optional[int]:
+        """ The number of frames in the frame buffer of the detector, after
+        which the frames returned by getChunk are overwritten, or None if the
+        returned frames are not overwritten. """
+        return None
+
+    def waitForFrames(self, timeout: float) -> bool:
+        """ Blocks until the detector has captured frames that have not been
+        returned by getChunk yet, or until timeout seconds have passed, and
+        returns whether there are new frames. Detectors that can not wait for
+        frames only sleep briefly and return True, so that they are polled. """
+        time.sleep(0.0001)
+        return True
+
+    def setRecordingLength(self, numFrames: Optional[int] = None,
+                           seconds: Optional[float] = None) -> None:
+        """ Tells the detector how long the recording that is about to start
+        is, either as a number of frames or in seconds, or None if the length
+        is unknown. Called without a length when the recording has ended.
+        Detectors that keep frames in a buffer can use it to size the buffer.
+        """
+        pass
+
     @abstractmethod
     def startAcquisition(self) -> None:
         """ Starts image acquisition. """
@@ -253,6 +337,20 @@ class DetectorManager(SignalInterface):
         pass
 
 
+def _binImage(image, binning):
+    """ Sums blocks of binning x binning pixels of the last two axes of the
+    image, cropping pixels that do not fill a whole block. """
+    if binning <= 1 or image.ndim < 2:
+        return image
+
+    height = image.shape[-2] // binning * binning
+    width = image.shape[-1] // binning * binning
+    image = image[..., :height, :width]
+    return image.reshape(
+        image.shape[:-2] + (height // binning, binning, width // binning, binning)
+    ).sum(axis=(-3, -1), dtype=np.uint32 if image.dtype.kind in 'ub' else None)
+
+
 # Copyright (C) 2020-2021 ImSwitch developers
 # This file is part of ImSwitch.
 #
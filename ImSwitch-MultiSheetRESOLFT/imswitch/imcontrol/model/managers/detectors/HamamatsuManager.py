@@ -1,3 +1,5 @@
+import numpy as np
+
 from imswitch.imcommon.model import initLogger
 from .DetectorManager import (
     DetectorManager, DetectorNumberParameter, DetectorListParameter
@@ -14,6 +16,10 @@ class HamamatsuManager(DetectorManager):
       (list indexing starts at 0); set this to an invalid value, e.g. the
       string "mock" to load a mocker
     - ``hamamatsu`` -- dictionary of DCAM API properties to pass to the driver
+    - ``bufferMemoryGB`` -- maximum memory of the frame ring buffer in GB
+      (optional, default 4)
+    - ``bufferHugePages`` -- whether to back the frame ring buffer by huge
+      pages, if the OS supports it (optional, default False)
     """
 
     def __init__(self, detectorInfo, name, **_lowLevelManagers):
@@ -21,10 +27,21 @@ class HamamatsuManager(DetectorManager):
 
         self._camera = self._getCameraObj(detectorInfo.managerProperties['cameraListIndex'])
         self._binning = 1
+        self._acquiring = False
 
         for propertyName, propertyValue in detectorInfo.managerProperties['hamamatsu'].items():
             self._camera.setPropertyValue(propertyName, propertyValue)
 
+        try:
+            bufferMemoryGB = detectorInfo.managerProperties['bufferMemoryGB']
+        except KeyError:
+            bufferMemoryGB = 4
+        try:
+            bufferHugePages = detectorInfo.managerProperties['bufferHugePages']
+        except KeyError:
+            bufferHugePages = False
+        self._camera.setBufferMemory(bufferMemoryGB * 1024 ** 3, bufferHugePages)
+
         fullShape = (self._camera.getPropertyValue('image_width')[0],
                      self._camera.getPropertyValue('image_height')[0])
 
@@ -92,9 +109,41 @@ class HamamatsuManager(DetectorManager):
     def getChunk(self):
         return self._camera.getFrames()[0]
 
+    def getChunkWithInfo(self):
+        return self._camera.getFramesWithInfo()
+
+    @property
+    def droppedFrames(self):
+        return self._camera.dropped_frames
+
+    @property
+    def bufferSize(self):
+        return self._camera.getBufferSize()
+
     def flushBuffers(self):
         self._camera.updateIndices()
 
+    def waitForFrames(self, timeout):
+        return self._camera.waitForFrame(timeout)
+
+    def setRecordingLength(self, numFrames=None, seconds=None):
+        """ Grows the frame ring buffer to hold the whole recording if its
+        number of frames is known, i.e. given, or given in seconds while the
+        camera runs on its internal trigger. The buffer never holds fewer
+        frames than fit in the buffer memory. A running acquisition is
+        restarted when the buffer grows, such that the recording uses it. """
+        if (numFrames is None and seconds is not None and
+                self.parameters['Trigger source'].value == 'Internal trigger'):
+            numFrames = int(np.ceil(seconds * self.parameters['Internal frame rate'].value))
+
+        bufferSize = self._camera.getBufferSize()
+        self._camera.setBufferFrames(numFrames)
+        if self._acquiring and self._camera.getBufferSize() > bufferSize:
+            self.__logger.debug(f'Restarting acquisition to grow buffer to'
+                                f' {self._camera.getBufferSize()} frames')
+            self.stopAcquisition()
+            self.startAcquisition()
+
     def crop(self, hpos, vpos, hsize, vsize):
         """Method to crop the frame read out by the camera. """
 
@@ -143,9 +192,11 @@ class HamamatsuManager(DetectorManager):
 
     def startAcquisition(self):
         self._camera.startAcquisition()
+        self._acquiring = True
 
     def stopAcquisition(self):
         self._camera.stopAcquisition()
+        self._acquiring = False
 
     def _setExposure(self, time):
         self._camera.setPropertyValue('exposure_time', time)
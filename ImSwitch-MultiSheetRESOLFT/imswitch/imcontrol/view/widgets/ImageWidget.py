@@ -61,14 +61,27 @@ class ImageWidget(Widget):
     def addStaticLayer(self, name, im):
         self.napariViewer.add_image(im, rgb=False, name=name, blending='additive')
 
+    def updateStaticLayer(self, name, im):
+        if name in self.napariViewer.layers:
+            layer = self.napariViewer.layers[name]
+            layer.data = im
+            layer.reset_contrast_limits()
+        else:
+            self.addStaticLayer(name, im)
+
     def getCurrentImageName(self):
         return self.napariViewer.active_layer.name
 
     def getImage(self, name):
         return self.imgLayers[name].data
 
-    def setImage(self, name, im):
-        self.imgLayers[name].data = im
+    def setImage(self, name, im, binning=1):
+        layer = self.imgLayers[name]
+        if layer.scale[-1] != binning:
+            # Show binned images in the coordinates of the full frame
+            layer.scale = (binning, binning)
+            layer.translate = ((binning - 1) / 2, (binning - 1) / 2)
+        layer.data = im
 
     def clearImage(self, name):
         self.setImage(name, np.zeros((1, 1)))
@@ -98,6 +98,10 @@ class RecordingWidget(Widget):
 
         self.untilSTOPbtn = QtWidgets.QRadioButton('Run until STOP')
 
+        # Recording status, frames waiting to be written and frames lost by the detectors
+        self.queuedFrames = QtWidgets.QLabel('0')
+        self.droppedFrames = QtWidgets.QLabel('0')
+
         self.snapSaveFormatLabel = QtWidgets.QLabel('<strong>Snap format:</strong>')
         self.snapSaveFormatList = QtWidgets.QComboBox()
         self.snapSaveFormatList.addItems(['HDF5', 'TIFF'])
@@ -177,6 +181,12 @@ class RecordingWidget(Widget):
         recGrid.addWidget(self.untilSTOPbtn, gridRow, 0, 1, -1)
         gridRow += 1
 
+        recGrid.addWidget(QtWidgets.QLabel('Queued frames'), gridRow, 0)
+        recGrid.addWidget(self.queuedFrames, gridRow, 1)
+        recGrid.addWidget(QtWidgets.QLabel('Dropped frames'), gridRow, 2)
+        recGrid.addWidget(self.droppedFrames, gridRow, 3)
+        gridRow += 1
+
         recGrid.addWidget(self.snapSaveFormatLabel, gridRow, 0)
         recGrid.addWidget(self.snapSaveFormatList, gridRow, 1, 1, -1)
         gridRow += 1
@@ -384,6 +394,13 @@ class RecordingWidget(Widget):
     def updateRecLapseNum(self, lapseNum):
         self.currentLapse.setText(str(lapseNum) + ' /')
 
+    def updateRecQueueDepth(self, queuedFrames):
+        self.queuedFrames.setText(str(queuedFrames))
+
+    def updateRecDroppedFrames(self, droppedFrames):
+        self.droppedFrames.setText(str(droppedFrames))
+        self.droppedFrames.setStyleSheet('color: red' if droppedFrames > 0 else '')
+
     @shortcut('Ctrl+R', "Record")
     def toggleRecButton(self):
         self.recButton.toggle()
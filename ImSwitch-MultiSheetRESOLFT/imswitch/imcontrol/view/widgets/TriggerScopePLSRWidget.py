@@ -163,6 +163,30 @@ class TriggerScopePLSRWidget(Widget):
         # Temp fix
         self.cycleScanDeviceEdit.setEnabled(False)
 
+        """Live deskew preview parameters"""
+        liveDeskewLabel = QtWidgets.QLabel('Live deskew preview')
+        self.liveDeskewCheck = QtWidgets.QCheckBox()
+
+        liveDeskewRestackLabel = QtWidgets.QLabel('Restack before deskewing')
+        self.liveDeskewRestackCheck = QtWidgets.QCheckBox()
+        self.liveDeskewRestackCheck.setChecked(True)
+
+        skewAngleLabel = QtWidgets.QLabel('Skew angle (deg)')
+        self.skewAngleEdit = guitools.BetterDoubleSpinBox(allowScrollChanges=False)
+        self.skewAngleEdit.setMaximum(90)
+        self.skewAngleEdit.setValue(35)
+
+        deltaYLabel = QtWidgets.QLabel('Delta-Y step size (nm)')
+        self.deltaYEdit = guitools.BetterDoubleSpinBox(allowScrollChanges=False)
+        self.deltaYEdit.setMaximum(9999)
+        self.deltaYEdit.setValue(210)
+
+        reconVxSizeLabel = QtWidgets.QLabel('Reconstruction vx size (nm)')
+        self.reconVxSizeEdit = guitools.BetterDoubleSpinBox(allowScrollChanges=False)
+        self.reconVxSizeEdit.setMinimum(1)
+        self.reconVxSizeEdit.setMaximum(9999)
+        self.reconVxSizeEdit.setValue(100)
+
         currentRow = 0
 
         # Add space item to make the grid look nicer
@@ -263,6 +287,24 @@ class TriggerScopePLSRWidget(Widget):
         currentRow += 1
         self.grid.addWidget(roLaserLabel, currentRow, 0)
         self.grid.addWidget(self.roLaserEdit, currentRow, 1)
+        currentRow += 1
+        self.grid.addItem(
+            QtWidgets.QSpacerItem(40, 20,
+                                  QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding),
+            currentRow, 0, 1, 4)
+        currentRow += 1
+        self.grid.addWidget(liveDeskewLabel, currentRow, 0)
+        self.grid.addWidget(self.liveDeskewCheck, currentRow, 1)
+        self.grid.addWidget(skewAngleLabel, currentRow, 2)
+        self.grid.addWidget(self.skewAngleEdit, currentRow, 3)
+        currentRow += 1
+        self.grid.addWidget(liveDeskewRestackLabel, currentRow, 0)
+        self.grid.addWidget(self.liveDeskewRestackCheck, currentRow, 1)
+        self.grid.addWidget(deltaYLabel, currentRow, 2)
+        self.grid.addWidget(self.deltaYEdit, currentRow, 3)
+        currentRow += 1
+        self.grid.addWidget(reconVxSizeLabel, currentRow, 2)
+        self.grid.addWidget(self.reconVxSizeEdit, currentRow, 3)
 
         # Connect signals
         self.saveScanBtn.clicked.connect(self.sigSaveScanClicked)
@@ -404,6 +446,21 @@ class TriggerScopePLSRWidget(Widget):
         ind = self.cycleScanDeviceEdit.findText(value)
         self.cycleScanDeviceEdit.setCurrentIndex(ind)
 
+    def getLiveDeskewChecked(self):
+        return self.liveDeskewCheck.isChecked()
+
+    def getLiveDeskewRestackChecked(self):
+        return self.liveDeskewRestackCheck.isChecked()
+
+    def getSkewAngleDeg(self):
+        return self.skewAngleEdit.value()
+
+    def getDeltaYNm(self):
+        return self.deltaYEdit.value()
+
+    def getReconVxSizeNm(self):
+        return self.reconVxSizeEdit.value()
+
     def setScanButtonChecked(self, checked):
         self.scanButton.setEnabled(not checked)
         self.scanButton.setCheckable(checked)
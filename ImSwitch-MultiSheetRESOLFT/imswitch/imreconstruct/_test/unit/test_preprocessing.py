@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from imswitch.imreconstruct.model.preprocessing import (
+    averageTimepoints, bleachingCorrection, bleachingFactors, restack
+)
+
+
+cycles = 5
+planesInCycle = 4
+timepoints = 3
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.uniform(50, 100, (timepoints * cycles * planesInCycle, 6, 7)).astype(np.float32)
+
+
+# Loop implementations that the preprocessing functions replace, as they were in
+# ImRecMainViewController.reconstruct
+
+def loopRestack(tp_data):
+    restacked = np.zeros_like(tp_data)
+    for i in range(planesInCycle):
+        restacked[i * cycles:(i + 1) * cycles] = tp_data[i::planesInCycle]
+    return restacked
+
+
+def loopBleachingCorrection(data):
+    correctedData = data.copy()
+    energy = np.sum(data, axis=(1, 2))
+    for i in range(data.shape[0]):
+        c = (energy[0] / energy[i]) ** 4
+        correctedData[i, :, :] = data[i, :, :] * c
+    return correctedData
+
+
+def loopAverageTimepoints(data):
+    shape = data.shape
+    reshaped = np.reshape(data, (timepoints, shape[0] // timepoints, shape[1], shape[2]))
+    return np.mean(reshaped, axis=0)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_restack(data, parallel):
+    tp_data = data[:cycles * planesInCycle]
+    assert np.array_equal(restack(tp_data, cycles, planesInCycle, parallel=parallel),
+                          loopRestack(tp_data))
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_restack_with_bleaching_factors(data, parallel):
+    tp_data = data[:cycles * planesInCycle]
+    factors = bleachingFactors(tp_data)
+    np.testing.assert_allclose(
+        restack(tp_data, cycles, planesInCycle, factors=factors, parallel=parallel),
+        loopRestack(loopBleachingCorrection(tp_data)), rtol=1e-5
+    )
+
+
+def test_bleaching_correction(data):
+    expected = loopBleachingCorrection(data)
+    np.testing.assert_allclose(bleachingCorrection(data), expected, rtol=1e-5)
+
+    # In place
+    bleachingCorrection(data, out=data)
+    np.testing.assert_allclose(data, expected, rtol=1e-5)
+
+
+def test_average_timepoints(data):
+    np.testing.assert_allclose(averageTimepoints(data, timepoints),
+                               loopAverageTimepoints(data), rtol=1e-6)
+    factors = bleachingFactors(data)
+    np.testing.assert_allclose(averageTimepoints(data, timepoints, factors=factors),
+                               loopAverageTimepoints(loopBleachingCorrection(data)), rtol=1e-5)
+
+
+# Copyright (C) 2020-2021 ImSwitch developers
+# This file is part of ImSwitch.
+#
+# ImSwitch is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImSwitch is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
@@ -0,0 +1,42 @@
+import numpy as np
+
+from imswitch.imreconstruct.model import Reconstructor
+
+
+def test_sparse_deskew_matches_kernel():
+    # Deskewing with the precomputed sparse operator must give the same reconstruction as the
+    # gaussian distribution kernel followed by the normalization
+    rng = np.random.default_rng(0)
+    data = rng.uniform(100, 1000, (12, 10, 16)).astype(np.float32)
+    reconstructor = Reconstructor(useGPU=False)
+    parameters = (116, np.deg2rad(35), 105, 100)
+
+    direct = reconstructor.simpleDeskew(data, *parameters, sparse=False)
+    sparse = reconstructor.simpleDeskew(data, *parameters, sparse=True)
+    assert sparse.shape == direct.shape
+    np.testing.assert_allclose(sparse, direct, rtol=1e-5, atol=1e-5 * direct.max())
+
+    # The operator is reused for the next timepoint
+    data2 = rng.uniform(100, 1000, data.shape).astype(np.float32)
+    np.testing.assert_allclose(reconstructor.simpleDeskew(data2, *parameters, sparse=True),
+                               reconstructor.simpleDeskew(data2, *parameters, sparse=False),
+                               rtol=1e-5, atol=1e-5 * direct.max())
+    assert len(reconstructor._deskewOperatorCache) == 1
+    assert list(reconstructor._deskewOperatorCache.values())[0] is not None
+
+
+# Copyright (C) 2020-2021 ImSwitch developers
+# This file is part of ImSwitch.
+#
+# ImSwitch is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImSwitch is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
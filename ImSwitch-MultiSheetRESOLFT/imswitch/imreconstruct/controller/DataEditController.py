@@ -1,5 +1,3 @@
-import numpy as np
-
 from .basecontrollers import ImRecWidgetController
 
 
@@ -14,7 +12,7 @@ class DataEditController(ImRecWidgetController):
 
     def setData(self, inDataObj):
         self._dataObj = inDataObj
-        self._meanData = np.array(np.mean(self._dataObj.data, 0), dtype=np.float32)
+        self._meanData = self._dataObj.getMeanData()
         self.showMean()
         self._widget.updateDataProperties(self._dataObj.name, self._dataObj.datasetName,
                                           self._dataObj.numFrames)
@@ -6,7 +6,9 @@ import tifffile as tiff
 
 import imswitch.imreconstruct.view.guitools as guitools
 from imswitch.imcommon.controller import PickDatasetsController
-from imswitch.imreconstruct.model import DataObj, ReconObj, Reconstructor
+from imswitch.imreconstruct.model import (
+    DataObj, ReconObj, ReconstructionParameters, ReconstructionQueue
+)
 from .DataFrameController import DataFrameController
 from .MultiDataFrameController import MultiDataFrameController
 from .ReconstructionViewController import ReconstructionViewController
@@ -31,7 +33,17 @@ class ImRecMainViewController(ImRecWidgetController):
             PickDatasetsController, self._widget.pickDatasetsDialog
         )
 
-        self._reconstructor = Reconstructor()
+        self._reconstructionQueue = ReconstructionQueue()
+        self._reconstructionQueue.sigJobAdded.connect(self.reconstructionAdded)
+        self._reconstructionQueue.sigReconstructionAllocated.connect(self.reconstructionAllocated)
+        self._reconstructionQueue.sigTimepointReconstructed.connect(self.timepointReconstructed)
+        self._reconstructionQueue.sigJobFinished.connect(self.reconstructionEnded)
+        self._reconstructionQueue.sigJobCancelled.connect(self.reconstructionEnded)
+        self._reconstructionQueue.sigJobFailed.connect(self.reconstructionFailed)
+        self._shownReconObjs = []
+        self._jobTimepoints = {}  # { job: numReconstructedTimepoints }
+        self._numQueuedTimepoints = 0
+        self._numReconstructedTimepoints = 0
 
         self._currentDataObj = None
         self._dataFolder = None
@@ -58,6 +70,7 @@ class ImRecMainViewController(ImRecWidgetController):
         self._widget.sigReconstructMultiIndividual.connect(
             lambda: self.reconstructMulti(consolidate=False)
         )
+        self._widget.sigCancelReconstructions.connect(self._reconstructionQueue.cancelAll)
         self._widget.sigQuickLoadData.connect(self.quickLoadData)
         self._widget.sigUpdate.connect(lambda: self.updateScanParams(applyOnCurrentRecon=True))
 
@@ -152,77 +165,83 @@ class ImRecMainViewController(ImRecWidgetController):
         self.reconstruct(self._widget.getMultiDatas(), consolidate)
 
     def reconstruct(self, dataObjs, consolidate):
-        #consolidate not fully implemented now
-        reconObj = None
-        for index, dataObj in enumerate(dataObjs):
-            preloaded = dataObj.dataLoaded
-            try:
-                dataObj.checkAndLoadData()
-
-                if not consolidate or index == 0:
-                    reconObj = ReconObj(dataObj.name,
-                                        self._widget.timepoints_text)
-
-                data = dataObj.data
-                if self._widget.getBleachCorrectionBool():
-                    data = self.bleachingCorrection(data)
-
-                timepoints = self._widget.getTimepoints()
-                if timepoints > 1 and self._widget.getAverageTimepointsBool():
-                    shape = data.shape
-                    reshaped = np.reshape(data, (timepoints, shape[0]//timepoints, shape[1], shape[2]))
-                    data = np.mean(reshaped, axis=0)
-                    timepoints = 1
-
-                cycles = self._widget.getCycles()
-                planes_in_cycle = self._widget.getPlanesInCycle()
-                dataShape_tp = np.array([cycles*planes_in_cycle, data.shape[1], data.shape[2]])
-                reconstructionSize = self._reconstructor.getReconstructionSize(dataShape_tp, self._widget.getPixelSizeNm(),
-                                                                             self._widget.getSkewAngleRad(),
-                                                                             self._widget.getDeltaY(),
-                                                                             self._widget.getReconstructionVxSize())
-
-                reconObj.allocateReconstruction(timepoints, reconstructionSize)
-
-                for tp in range(timepoints):
-                    """Restack data"""
-                    slices = cycles * planes_in_cycle
-                    tp_data = data[tp*slices:(tp + 1)*slices]
-                    if self._widget.getRestackBool():
-                        try:
-                            restacked = np.zeros_like(tp_data)
-                            for i in range(planes_in_cycle):
-                                restacked[i * cycles:(i + 1) * cycles] = tp_data[i::planes_in_cycle]
-                        except ValueError:
-                            self._logger.warning('Data shape does not match given restacking parameters')
-                    else:
-                        restacked = tp_data
-                    if self._widget.getPosScanDirection():
-                        restacked = np.flip(restacked, 0)
-                    self._logger.debug('Reconstructing data tp: %s' % tp)
-                    recon = self._reconstructor.simpleDeskew(restacked, self._widget.getPixelSizeNm(),
-                                                             self._widget.getSkewAngleRad(),
-                                                             self._widget.getDeltaY(),
-                                                             self._widget.getReconstructionVxSize())
-                    reconObj.addReconstructionTimepoint(tp, recon)
-
-            finally:
-                if not preloaded:
-                    dataObj.checkAndUnloadData()
-
-            if not consolidate:
-                self._widget.addNewReconstruction(reconObj, reconObj.name)
+        """ Queues the reconstruction of the data objects, which runs in the
+        background. """
+        dataObjs = list(dataObjs)
+        if len(dataObjs) < 1:
+            return
 
-        if consolidate:
-            self._widget.addNewReconstruction(reconObj, f'{reconObj.name}_multi')
+        parameters = ReconstructionParameters(
+            pixelSizeNm=self._widget.getPixelSizeNm(),
+            skewAngleRad=self._widget.getSkewAngleRad(),
+            deltaYNm=self._widget.getDeltaY(),
+            reconVxSizeNm=self._widget.getReconstructionVxSize(),
+            cycles=self._widget.getCycles(),
+            planesInCycle=self._widget.getPlanesInCycle(),
+            timepoints=self._widget.getTimepoints(),
+            restack=self._widget.getRestackBool(),
+            posScanDirection=self._widget.getPosScanDirection(),
+            bleachCorrection=self._widget.getBleachCorrectionBool(),
+            averageTimepoints=self._widget.getAverageTimepointsBool(),
+            sparseDeskew=self._widget.getSparseDeskewBool()
+        )
 
-    def bleachingCorrection(self, data):
-        correctedData = data.copy()
-        energy = np.sum(data, axis=(1, 2))
-        for i in range(data.shape[0]):
-            c = (energy[0] / energy[i]) ** 4
-            correctedData[i, :, :] = data[i, :, :] * c
-        return correctedData
+        #consolidate not fully implemented now
+        if consolidate:
+            reconObj = ReconObj(dataObjs[0].name, self._widget.timepoints_text,
+                                saveFolder=self._saveFolder)
+            self._reconstructionQueue.addJob(dataObjs, reconObj, f'{reconObj.name}_multi',
+                                             parameters)
+        else:
+            for dataObj in dataObjs:
+                reconObj = ReconObj(dataObj.name, self._widget.timepoints_text,
+                                    saveFolder=self._saveFolder)
+                self._reconstructionQueue.addJob([dataObj], reconObj, reconObj.name, parameters)
+
+    def reconstructionAdded(self, job):
+        self._jobTimepoints[job] = 0
+        self._numQueuedTimepoints += job.numTimepoints
+        self.updateReconstructionProgress()
+
+    def reconstructionAllocated(self, job):
+        """ Shows the reconstruction as soon as it has been allocated, the
+        timepoints are filled in as they are reconstructed. """
+        if job.reconObj not in self._shownReconObjs:
+            self._shownReconObjs.append(job.reconObj)
+            self._widget.addNewReconstruction(job.reconObj, job.name)
+        else:
+            self.reconstructionController.reconstructionUpdated(job.reconObj)
+
+    def timepointReconstructed(self, job, timepoint, numReconstructed):
+        self._jobTimepoints[job] = numReconstructed
+        self._numReconstructedTimepoints += 1
+        self.reconstructionController.reconstructionUpdated(job.reconObj,
+                                                            autoLevels=numReconstructed == 1)
+        self.updateReconstructionProgress()
+
+    def reconstructionEnded(self, job):
+        # Timepoints that were not reconstructed no longer count towards the progress
+        self._numQueuedTimepoints -= job.numTimepoints - self._jobTimepoints.pop(job, 0)
+        if job.reconObj in self._shownReconObjs:
+            self._shownReconObjs.remove(job.reconObj)
+        if len(self._jobTimepoints) < 1:
+            self._numQueuedTimepoints = 0
+            self._numReconstructedTimepoints = 0
+        self.updateReconstructionProgress()
+
+    def reconstructionFailed(self, job, errorMessage):
+        self._logger.error(f'Reconstruction of {job.name} failed: {errorMessage}')
+        self.reconstructionEnded(job)
+
+    def updateReconstructionProgress(self):
+        self._widget.setReconstructionProgress(len(self._jobTimepoints),
+                                               self._numReconstructedTimepoints,
+                                               self._numQueuedTimepoints)
+
+    def closeEvent(self):
+        self._reconstructionQueue.close()
+        for _, reconObj in self.reconstructionController.getAllReconObjs():
+            reconObj.close()
 
     def saveCurrent(self, dataType):
         """ Saves the reconstructed image or coefficeints from the current
@@ -231,7 +250,9 @@ class ImRecMainViewController(ImRecWidgetController):
         filePath = guitools.askForFilePath(self._widget,
                                            caption=f'Save {dataType}',
                                            defaultFolder=self._saveFolder or self._dataFolder,
-                                           nameFilter='*.tiff', isSaving=True)
+                                           nameFilter=('*.tiff;;*.hdf5' if dataType == 'reconstruction'
+                                                       else '*.tiff'),
+                                           isSaving=True)
 
         if filePath:
             reconObj = self.reconstructionController.getActiveReconObj()
@@ -295,16 +316,24 @@ class ImRecMainViewController(ImRecWidgetController):
 
         self._logger.debug(f'Trying to save to: {filePath}, Vx size: {self._widget.getReconstructionVxSize(), self._widget.getReconstructionVxSize(), self._widget.getReconstructionVxSize()},'
                            f' dt: -')
-        # Reconstructed image
-        reconstrData = reconObj.getReconstruction() #Not good for memory limitations
-        reconstrData = np.array([reconstrData])
-        reconstrData = np.swapaxes(reconstrData, 1, 2)
-        tiff.imwrite(filePath, reconstrData,
+        if os.path.splitext(filePath)[1] in ['.hdf5', '.h5']:
+            if reconObj in self._shownReconObjs:
+                self._logger.warning(f'Can not save {reconObj.name} while it is being reconstructed')
+                return
+            # The file of the reconstruction is moved, no data is copied
+            vxSizeUm = self._widget.getReconstructionVxSize() / 1000
+            reconObj.saveAs(filePath, attrs={'element_size_um': [vxSizeUm] * 3})
+            return
+
+        # Reconstructed image, written one plane at a time in the order of the axes
+        reconstrData = reconObj.getReconstruction()
+        numTimepoints, numSlices = reconstrData.shape[:2]
+        planes = (reconstrData[tp, z] for z in range(numSlices) for tp in range(numTimepoints))
+        tiff.imwrite(filePath, planes, shape=(1, numSlices, numTimepoints, *reconstrData.shape[2:]),
+                     dtype=reconstrData.dtype,
                      imagej=True, resolution=(1 / self._widget.getReconstructionVxSize(), 1 / self._widget.getReconstructionVxSize()),
                      metadata={'spacing': self._widget.getReconstructionVxSize(), 'unit': 'nm', 'axes': 'TZCYX'})
-        """Reshape back to original, since we do not deep copy from reconObj"""
-        reconstrData = np.swapaxes(reconstrData, 1, 2)
-        reconstrData = reconstrData[0]
+
     def saveCoefficients(self, reconObj, filePath):
         coeffs = copy.deepcopy(reconObj.getCoeffs())
         self._logger.debug(f'Shape of coeffs: {coeffs.shape}')
@@ -1,3 +1,4 @@
+import dask.array as da
 import numpy as np
 
 from .basecontrollers import ImRecWidgetController
@@ -67,7 +68,9 @@ class ReconstructionViewController(ImRecWidgetController):
         else:
             transposeOrder = [0, 3, 1, 2]
 
-        im = data.transpose(*transposeOrder)
+        # Read lazily from the file of the reconstruction, only the slices that are shown. A new
+        # name every time, so that timepoints that have been reconstructed since are not cached.
+        im = da.from_array(data, chunks=data.chunks, name=False).transpose(*transposeOrder)
         axisLabels = np.array(['Time point', 'Slice', 'Y', 'X'])[transposeOrder]
         self._transposeOrder = transposeOrder
         self._widget.setImage(im, axisLabels)
@@ -105,13 +108,19 @@ class ReconstructionViewController(ImRecWidgetController):
         im = self._widget.getImage()
         indexForImage = [slice(None) for _ in range(len(im.shape))]
         indexForImage[baseAxisIndex] = base
-        imAtBase = im[tuple(indexForImage)]
+        imAtBase = np.asarray(im[tuple(indexForImage)])
 
         # Update levels
         levels = imAtBase.min(), imAtBase.max()
         self._widget.setImageDisplayLevelsRange(*levels)
         self._widget.setImageDisplayLevels(*levels)
 
+    def reconstructionUpdated(self, reconObj, autoLevels=False):
+        """ Shows the new timepoints of a reconstruction that is running, if
+        it is the reconstruction that is shown. """
+        if reconObj is self._widget.getCurrentItemData():
+            self.setImgSlice(autoLevels=autoLevels)
+
     def updateRecon(self):
         reconObj = self._widget.getCurrentItemData()
         if reconObj is not None:
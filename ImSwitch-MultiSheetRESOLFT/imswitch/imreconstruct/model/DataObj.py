@@ -1,13 +1,31 @@
 import os
+import weakref
+from collections import OrderedDict
 
 import h5py
 import numpy as np
+import psutil
 import tifffile as tiff
 
-from imswitch.imcommon.model import initLogger
+from imswitch.imcommon.framework import Mutex
+from imswitch.imcommon.model import getDatasetArray, initLogger
 
 
 class DataObj:
+    """ Data of one dataset in an HDF5 or TIFF file. The data is exposed as
+    a lazy array that is read when sliced: a memory map where the file
+    allows it, otherwise the HDF5 dataset itself. Only TIFF files that can
+    not be memory mapped are read into memory. Data held in memory, including
+    the mean and max images, counts towards maxMemoryBytes, which is shared
+    by all data objects; when it is exceeded, the memory of the least
+    recently used data objects is freed and read again when needed. """
+
+    maxMemoryBytes = psutil.virtual_memory().total // 4
+    blockBytes = 64 * 1024 ** 2  # Bytes read at a time when streaming over the frames
+
+    _memoryObjs = OrderedDict()  # Least recently used first
+    _memoryObjsMutex = Mutex()
+
     def __init__(self, name, datasetName, *, path=None, file=None):
         self.__logger = initLogger(self, instanceName=f'{name}/{datasetName}')
 
@@ -15,6 +33,7 @@ class DataObj:
         self.dataPath = path
         self.darkFrame = None
         self._meanData = None
+        self._maxData = None
         self._file = file
         self._data = None
         self._datasetName = datasetName
@@ -23,14 +42,27 @@ class DataObj:
 
     @property
     def data(self):
+        """ The data as an array of frames, which supports slicing per frame
+        or per range of frames without reading the rest of the data. """
         if self._data is not None:
+            self._markUsed()
             return self._data
 
         if isinstance(self._file, h5py.File):
-            self._data = np.array(self._file.get(self._datasetName)[:])
+            dataset = self._file.get(self._datasetName)
+            if dataset is not None and dataset.external is not None:
+                self._data = getDatasetArray(dataset)
+            else:
+                self._data = dataset
         elif isinstance(self._file, tiff.TiffFile):
-            self._data = self._file.asarray()
+            try:
+                self._data = tiff.memmap(self._file.filehandle.path, mode='c')
+            except ValueError:
+                # Compressed or not contiguous
+                self._data = self._file.asarray()
 
+        if self.memorySize > 0:
+            self._markUsed(evict=True)
         return self._data
 
     @property
@@ -47,7 +79,18 @@ class DataObj:
 
     @property
     def dataLoaded(self):
-        return self.data is not None
+        """ Whether the file of the data is open, which does not mean that the
+        data has been read. """
+        return self._file is not None
+
+    @property
+    def memorySize(self):
+        """ Number of bytes of memory held by the data object. Data that is
+        read lazily or memory mapped does not count. """
+        arrays = [self._meanData, self._maxData]
+        if isinstance(self._data, np.ndarray) and not isinstance(self._data, np.memmap):
+            arrays.append(self._data)
+        return sum(array.nbytes for array in arrays if array is not None)
 
     @property
     def datasetName(self):
@@ -80,19 +123,101 @@ class DataObj:
         self._data = None
         self._attrs = None
         self._meanData = None
+        self._maxData = None
+        self._forgetMemory()
 
     def getMeanData(self):
+        """ Mean of all frames, computed a block of frames at a time. """
         if self._meanData is None:
-            self._meanData = np.array(np.mean(self.data, 0), dtype=np.float32)
+            total = None
+            for frames in self.iterFrameBlocks():
+                blockSum = np.sum(frames, axis=0, dtype=np.float64)
+                total = blockSum if total is None else total + blockSum
+            self._meanData = np.array(total / self.numFrames, dtype=np.float32)
+            self._markUsed(evict=True)
 
         return self._meanData
 
+    def getMaxData(self):
+        """ Max of all frames, computed a block of frames at a time. """
+        if self._maxData is None:
+            maxData = None
+            for frames in self.iterFrameBlocks():
+                blockMax = np.max(frames, axis=0)
+                maxData = blockMax if maxData is None else np.maximum(maxData, blockMax)
+            self._maxData = maxData
+            self._markUsed(evict=True)
+
+        return self._maxData
+
+    def iterFrameBlocks(self):
+        """ Reads the data in blocks of consecutive frames of about blockBytes
+        bytes each. """
+        data = self.data
+        frameBytes = max(int(np.prod(data.shape[1:])) * data.dtype.itemsize, 1)
+        blockFrames = max(self.blockBytes // frameBytes, 1)
+        for start in range(0, len(data), blockFrames):
+            yield np.asarray(data[start:start + blockFrames])
+
+    def _markUsed(self, evict=False):
+        """ Marks the data object as most recently used if it holds data in
+        memory. If evict is True, the memory of the least recently used data
+        objects is then freed until the data in memory fits in
+        maxMemoryBytes. """
+        if not evict and id(self) not in DataObj._memoryObjs:
+            return
+
+        DataObj._memoryObjsMutex.lock()
+        try:
+            memoryObjs = DataObj._memoryObjs
+            memoryObjs.pop(id(self), None)
+            memoryObjs[id(self)] = weakref.ref(self)
+            if not evict:
+                return
+
+            memorySizes = {}
+            for key, ref in list(memoryObjs.items()):
+                dataObj = ref()
+                if dataObj is None:
+                    del memoryObjs[key]
+                else:
+                    memorySizes[key] = dataObj.memorySize
+
+            totalMemorySize = sum(memorySizes.values())
+            for key, ref in list(memoryObjs.items()):
+                if totalMemorySize <= DataObj.maxMemoryBytes:
+                    break
+                dataObj = ref()
+                if dataObj is self or dataObj is None:
+                    continue
+                dataObj._freeMemory()
+                del memoryObjs[key]
+                totalMemorySize -= memorySizes[key]
+        finally:
+            DataObj._memoryObjsMutex.unlock()
+
+    def _forgetMemory(self):
+        DataObj._memoryObjsMutex.lock()
+        try:
+            DataObj._memoryObjs.pop(id(self), None)
+        finally:
+            DataObj._memoryObjsMutex.unlock()
+
+    def _freeMemory(self):
+        """ Frees the data held in memory. The file stays open, so the data is
+        read again the next time it is needed. """
+        self._meanData = None
+        self._maxData = None
+        if isinstance(self._data, np.ndarray) and not isinstance(self._data, np.memmap):
+            self._data = None
+        self.__logger.debug('Freed memory of data')
+
     @staticmethod
     def getDatasetNames(path):
         file, _ = DataObj._open(path, allowMultipleDatasets=True)
         try:
             if isinstance(file, h5py.File):
-                return list(file.keys())
+                return DataObj.getHDF5DatasetNames(file)
             elif isinstance(file, tiff.TiffFile):
                 return ['default']
             else:
@@ -100,18 +225,25 @@ class DataObj:
         finally:
             file.close()
 
+    @staticmethod
+    def getHDF5DatasetNames(file):
+        """ Names of the datasets in the root of the file, groups such as the
+        frame_info of recordings are not data. """
+        return [name for name, item in file.items() if isinstance(item, h5py.Dataset)]
+
     @staticmethod
     def _open(path, datasetName=None, allowMultipleDatasets=False):
         ext = os.path.splitext(path)[1]
         if ext in ['.hdf5', '.hdf']:
             file = h5py.File(path, 'r')
-            if len(file) < 1:
+            datasetNames = DataObj.getHDF5DatasetNames(file)
+            if len(datasetNames) < 1:
                 raise RuntimeError('File does not contain any datasets')
-            elif len(file) > 1 and datasetName is None and not allowMultipleDatasets:
+            elif len(datasetNames) > 1 and datasetName is None and not allowMultipleDatasets:
                 raise RuntimeError('File contains multiple datasets')
 
             if datasetName is None and not allowMultipleDatasets:
-                datasetName = list(file.keys())[0]
+                datasetName = datasetNames[0]
 
             return file, datasetName
         elif ext in ['.tiff', '.tif']:
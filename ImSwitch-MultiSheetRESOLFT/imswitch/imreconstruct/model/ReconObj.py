@@ -1,10 +1,26 @@
+import os
+import shutil
+import tempfile
+
+import h5py
 import numpy as np
 
 from imswitch.imcommon.model import initLogger
 
 
 class ReconObj:
-    def __init__(self, name, timepoints_text, *args, **kwargs):
+    """ A reconstruction with all its timepoints. The reconstruction is stored
+    in a temporary HDF5 file, and every timepoint is written to the file when
+    it has been reconstructed, so that long time-lapses do not have to fit in
+    memory. The file is deleted when the ReconObj is closed, unless the
+    reconstruction has been saved with saveAs. saveFolder is the folder that
+    the reconstruction will likely be saved to; if the temporary folder is on
+    another file system, the temporary file is created in saveFolder instead,
+    such that saving it is a rename rather than a copy. """
+
+    datasetName = 'reconstruction'
+
+    def __init__(self, name, timepoints_text, *args, saveFolder=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.__logger = initLogger(self, instanceName=name)
 
@@ -15,19 +31,42 @@ class ReconObj:
 
         self.dispLevels = None
 
+        fd, self._filePath = tempfile.mkstemp(
+            prefix=f'{name}_', suffix='.recon.hdf5',
+            dir=_getTemporaryFolder(saveFolder)
+        )
+        os.close(fd)
+        self._fileIsTemporary = True
+        self._file = h5py.File(self._filePath, 'w', rdcc_nbytes=64 * 1024 ** 2)
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def filePath(self):
+        """ Path of the HDF5 file that the reconstruction is stored in. """
+        return self._filePath
 
     def allocateReconstruction(self, timepoints, size):
         self._reconSize = size
-        arraySize = np.insert(size, 0, timepoints)
-        self.reconstructed = np.zeros(arraySize, dtype='float32')
+        arraySize = tuple(int(s) for s in np.insert(size, 0, timepoints))
+        if self.datasetName in self._file:
+            self.reconstructed = None
+            del self._file[self.datasetName]
+        # Chunks of one plane, the unit that the viewer and the TIFF export read. Timepoints
+        # that have not been reconstructed yet are not stored and read as zeros.
+        self.reconstructed = self._file.create_dataset(
+            self.datasetName, arraySize, dtype='float32',
+            chunks=(1, 1, *arraySize[2:]), fillvalue=0
+        )
 
     def setReconstruction(self, reconstruction):
-        #Here one could maybe preallocate an array big enough for all timepoints
-        self.reconstructed = np.array([reconstruction], dtype='float32')
+        self.allocateReconstruction(1, np.shape(reconstruction))
+        self.addReconstructionTimepoint(0, reconstruction)
 
     def addReconstructionTimepoint(self, timepoint, new_reconstruction):
         if not new_reconstruction is None:
-            self.reconstructed[timepoint] = new_reconstruction
+            self.reconstructed[timepoint] = np.asarray(new_reconstruction, dtype='float32')
             self.__logger.debug('Added timepoint, ndim of reconstruction is %s', self.reconstructed.ndim)
         else:
             self.__logger.warning('Tried to add reconstruction that is None')
@@ -38,6 +77,8 @@ class ReconObj:
         return self.dispLevels
 
     def getReconstruction(self):
+        """ Returns the reconstruction as an HDF5 dataset of shape
+        (timepoints, z, y, x), which is read from disk when it is sliced. """
         return self.reconstructed
 
     def getScanParams(self):
@@ -46,6 +87,55 @@ class ReconObj:
     def updateScanParams(self, scanParDict):
         self.scanParDict = scanParDict
 
+    def saveAs(self, filePath, attrs=None):
+        """ Saves the reconstruction as an HDF5 file at filePath. The temporary
+        file is moved there, which is a rename if filePath is on the same file
+        system; once the reconstruction has been saved, the saved file is
+        copied instead, so that earlier saves are kept. The reconstruction is
+        read from the new file afterwards. """
+        self.reconstructed = None
+        self._file.close()
+        if self._fileIsTemporary:
+            shutil.move(self._filePath, filePath)
+        else:
+            shutil.copyfile(self._filePath, filePath)
+        self._filePath = filePath
+        self._fileIsTemporary = False
+        self._file = h5py.File(self._filePath, 'r+', rdcc_nbytes=64 * 1024 ** 2)
+        self.reconstructed = self._file.get(self.datasetName)
+        if attrs is not None:
+            self.reconstructed.attrs.update(attrs)
+
+    def close(self):
+        """ Closes the file of the reconstruction, and deletes it unless the
+        reconstruction has been saved with saveAs. """
+        if getattr(self, '_file', None) is None:
+            return
+
+        self.reconstructed = None
+        try:
+            self._file.close()
+        finally:
+            self._file = None
+            if self._fileIsTemporary:
+                try:
+                    os.remove(self._filePath)
+                except OSError:
+                    self.__logger.warning(f'Failed to delete {self._filePath}')
+
+
+def _getTemporaryFolder(saveFolder=None):
+    """ Returns the folder to create temporary reconstruction files in: the
+    system temporary folder, or saveFolder if it is on another file system. """
+    folder = os.path.join(tempfile.gettempdir(), 'imswitch_reconstructions')
+    os.makedirs(folder, exist_ok=True)
+    if saveFolder is not None and os.path.isdir(saveFolder):
+        try:
+            if os.stat(saveFolder).st_dev != os.stat(folder).st_dev:
+                return saveFolder
+        except OSError:
+            pass
+    return folder
 
 
 # Copyright (C) 2020-2021 ImSwitch developers
@@ -0,0 +1,274 @@
+import traceback
+from collections import deque
+from dataclasses import dataclass
+
+import numba
+import numpy as np
+
+from imswitch.imcommon.framework import Mutex, Signal, SignalInterface, Thread, Worker
+from imswitch.imcommon.model import initLogger
+from .Reconstructor import Reconstructor
+from .preprocessing import averageTimepoints, bleachingCorrection, bleachingFactors, restack
+
+
+@dataclass(frozen=True)
+class ReconstructionParameters:
+    """ Parameters of a reconstruction. They are read when the job is queued,
+    so that they can be changed while the job is waiting or running. """
+
+    pixelSizeNm: float
+    skewAngleRad: float
+    deltaYNm: float
+    reconVxSizeNm: float
+    cycles: int
+    planesInCycle: int
+    timepoints: int
+    restack: bool
+    posScanDirection: bool
+    bleachCorrection: bool
+    averageTimepoints: bool
+    sparseDeskew: bool = False
+
+    @property
+    def reconstructedTimepoints(self):
+        """ Number of timepoints of the reconstruction of one data object. """
+        if self.timepoints > 1 and self.averageTimepoints:
+            return 1
+        return self.timepoints
+
+
+class ReconstructionJob:
+    """ A reconstruction of one or more data objects into one ReconObj. The
+    data objects of a consolidated job are all reconstructed into the same
+    ReconObj. """
+
+    def __init__(self, dataObjs, reconObj, name, parameters):
+        self.dataObjs = list(dataObjs)
+        self.reconObj = reconObj
+        self.name = name
+        self.parameters = parameters
+        self.numTimepoints = len(self.dataObjs) * parameters.reconstructedTimepoints
+        self.__cancelled = False
+
+    @property
+    def cancelled(self):
+        return self.__cancelled
+
+    def cancel(self):
+        """ Cancels the job. A running job stops before its next timepoint. """
+        self.__cancelled = True
+
+
+class ReconstructionQueue(SignalInterface):
+    """ Runs reconstruction jobs one at a time in a background thread, in the
+    order they were added, so that the GUI stays responsive. Progress and
+    partial results are reported through signals, which are emitted from the
+    background thread. """
+
+    sigJobAdded = Signal(object)  # (job)
+    sigJobStarted = Signal(object)  # (job)
+    sigReconstructionAllocated = Signal(object)  # (job)
+    sigTimepointReconstructed = Signal(object, int, int)  # (job, timepoint, numReconstructed)
+    sigJobFinished = Signal(object)  # (job)
+    sigJobCancelled = Signal(object)  # (job)
+    sigJobFailed = Signal(object, str)  # (job, errorMessage)
+    sigRunJobs = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self.__logger = initLogger(self)
+
+        self._jobs = deque()
+        self._currentJob = None
+        self._jobsMutex = Mutex()
+
+        # The TBB threading layer of numba can hang when exiting after parallel kernels have been
+        # launched from a thread other than the main thread, as the worker does. The threading
+        # layer is chosen for the whole process when the first parallel kernel runs, unless it is
+        # set through NUMBA_THREADING_LAYER.
+        if numba.config.THREADING_LAYER == 'default':
+            numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+
+        self.__worker = ReconstructionWorker(self)
+        self.__thread = Thread()
+        self.__worker.moveToThread(self.__thread)
+        self.sigRunJobs.connect(self.__worker.runJobs)
+        self.__thread.start()
+
+    def __del__(self):
+        self.close()
+        if hasattr(super(), '__del__'):
+            super().__del__()
+
+    @property
+    def numJobs(self):
+        """ Number of jobs that are waiting or running. """
+        self._jobsMutex.lock()
+        try:
+            return len(self._jobs) + (1 if self._currentJob is not None else 0)
+        finally:
+            self._jobsMutex.unlock()
+
+    def addJob(self, dataObjs, reconObj, name, parameters):
+        """ Queues the reconstruction of the data objects into reconObj and
+        returns the job. """
+        job = ReconstructionJob(dataObjs, reconObj, name, parameters)
+        self._jobsMutex.lock()
+        try:
+            self._jobs.append(job)
+        finally:
+            self._jobsMutex.unlock()
+
+        self.sigJobAdded.emit(job)
+        self.sigRunJobs.emit()
+        return job
+
+    def cancelAll(self):
+        """ Cancels the running job and all waiting jobs. """
+        self._jobsMutex.lock()
+        try:
+            jobs = list(self._jobs)
+            if self._currentJob is not None:
+                jobs.append(self._currentJob)
+        finally:
+            self._jobsMutex.unlock()
+
+        for job in jobs:
+            job.cancel()
+
+    def close(self):
+        """ Cancels all jobs and stops the background thread. """
+        self.cancelAll()
+        self.__thread.quit()
+        self.__thread.wait()
+
+    def _takeNextJob(self):
+        self._jobsMutex.lock()
+        try:
+            self._currentJob = self._jobs.popleft() if len(self._jobs) > 0 else None
+            return self._currentJob
+        finally:
+            self._jobsMutex.unlock()
+
+
+class ReconstructionWorker(Worker):
+    def __init__(self, reconstructionQueue):
+        super().__init__()
+        self.__logger = initLogger(self)
+        self._queue = reconstructionQueue
+        self._reconstructor = None
+
+    def runJobs(self):
+        job = self._queue._takeNextJob()
+        while job is not None:
+            if job.cancelled:
+                self._queue.sigJobCancelled.emit(job)
+                job = self._queue._takeNextJob()
+                continue
+
+            self._queue.sigJobStarted.emit(job)
+            try:
+                self.reconstruct(job)
+            except Exception as e:
+                self.__logger.error(traceback.format_exc())
+                self._queue.sigJobFailed.emit(job, str(e))
+            else:
+                if job.cancelled:
+                    self.__logger.info(f'Reconstruction of {job.name} cancelled')
+                    self._queue.sigJobCancelled.emit(job)
+                else:
+                    self._queue.sigJobFinished.emit(job)
+
+            job = self._queue._takeNextJob()
+
+    def reconstruct(self, job):
+        if self._reconstructor is None:
+            # Created in this thread, the first time it is needed
+            self._reconstructor = Reconstructor()
+
+        params = job.parameters
+        numReconstructed = 0
+        for dataObj in job.dataObjs:
+            if job.cancelled:
+                return
+
+            preloaded = dataObj.dataLoaded
+            try:
+                dataObj.checkAndLoadData()
+
+                data = dataObj.data
+                factors = bleachingFactors(data) if params.bleachCorrection else None
+
+                timepoints = params.timepoints
+                if timepoints > 1 and params.averageTimepoints:
+                    data = averageTimepoints(data, timepoints, factors=factors)
+                    factors = None
+                    timepoints = 1
+
+                cycles = params.cycles
+                planes_in_cycle = params.planesInCycle
+                dataShape_tp = np.array([cycles*planes_in_cycle, data.shape[1], data.shape[2]])
+                reconstructionSize = self._reconstructor.getReconstructionSize(
+                    dataShape_tp, params.pixelSizeNm, params.skewAngleRad, params.deltaYNm,
+                    params.reconVxSizeNm
+                )
+
+                job.reconObj.allocateReconstruction(timepoints, reconstructionSize)
+                self._queue.sigReconstructionAllocated.emit(job)
+
+                buffer = None
+                for tp in range(timepoints):
+                    if job.cancelled:
+                        return
+
+                    restacked, buffer = self._preprocessTimepoint(data, factors, tp, params,
+                                                                  buffer)
+                    self.__logger.debug('Reconstructing data tp: %s' % tp)
+                    recon = self._reconstructor.simpleDeskew(restacked, params.pixelSizeNm,
+                                                             params.skewAngleRad,
+                                                             params.deltaYNm,
+                                                             params.reconVxSizeNm,
+                                                             sparse=params.sparseDeskew)
+                    job.reconObj.addReconstructionTimepoint(tp, recon)
+                    numReconstructed += 1
+                    self._queue.sigTimepointReconstructed.emit(job, tp, numReconstructed)
+            finally:
+                if not preloaded:
+                    dataObj.checkAndUnloadData()
+
+    def _preprocessTimepoint(self, data, factors, tp, params, buffer):
+        """ Restacks the frames of the timepoint and corrects them for
+        bleaching if factors are given, into buffer, which is reused for every
+        timepoint. Returns the preprocessed frames and the buffer. """
+        slices = params.cycles * params.planesInCycle
+        tp_data = data[tp*slices:(tp + 1)*slices]
+        tp_factors = factors[tp*slices:(tp + 1)*slices] if factors is not None else None
+        if params.restack:
+            buffer = restack(tp_data, params.cycles, params.planesInCycle, factors=tp_factors,
+                             out=buffer, parallel=True)
+            restacked = buffer
+        elif tp_factors is not None:
+            buffer = bleachingCorrection(tp_data, tp_factors, out=buffer)
+            restacked = buffer
+        else:
+            restacked = tp_data
+        if params.posScanDirection:
+            restacked = np.flip(restacked, 0)
+        return restacked, buffer
+
+
+# Copyright (C) 2020-2021 ImSwitch developers
+# This file is part of ImSwitch.
+#
+# ImSwitch is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImSwitch is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
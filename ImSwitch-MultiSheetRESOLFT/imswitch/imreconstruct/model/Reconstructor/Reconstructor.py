@@ -1,14 +1,36 @@
 
+from collections import OrderedDict
+from fractions import Fraction
+
 import numpy as np
-import cupy as cp
-from cupyx.scipy import signal as cpsig
-from cupyx.scipy.ndimage import affine_transform
+import numba
+import psutil
+import scipy.sparse
 from numba import cuda
-from .gpu_kernels import gaussDistribTransform
+from . import cpu_kernels, gpu_kernels
 from imswitch.imcommon.model import dirtools, initLogger
 
-mempool = cp.get_default_memory_pool()
-pinned_mempool = cp.get_default_pinned_memory_pool()
+try:
+    import cupy as cp
+    import cupyx.scipy.sparse
+except ImportError:
+    cp = None
+    outOfMemoryErrors = (MemoryError,)
+else:
+    mempool = cp.get_default_memory_pool()
+    pinned_mempool = cp.get_default_pinned_memory_pool()
+    outOfMemoryErrors = (MemoryError, cp.cuda.memory.OutOfMemoryError)
+
+
+def gpuAvailable():
+    """ True if cupy can be imported and a CUDA device exists. """
+    if cp is None:
+        return False
+    try:
+        return cuda.is_available()
+    except Exception:
+        return False
+
 
 class Reconstructor:
     """ This class takes the raw data together with pre-set
@@ -16,8 +38,24 @@ class Reconstructor:
     bases).
     """
 
-    def __init__(self):
+    def __init__(self, useGPU=None):
+        """ useGPU=None uses the GPU if cupy and a CUDA device are
+        available, otherwise the CPU (numba parallel) kernels. """
         self.__logger = initLogger(self)
+        if useGPU is None:
+            useGPU = gpuAvailable()
+        elif useGPU and not gpuAvailable():
+            raise RuntimeError('GPU reconstruction requested but cupy or a CUDA device is not'
+                               ' available')
+        self.useGPU = useGPU
+        self.xp = cp if useGPU else np
+        self._normalizationCache = OrderedDict()
+        self._normalizationCacheSize = 4
+        self._deskewOperatorCache = OrderedDict()
+        if useGPU:
+            self.__logger.info('Reconstructing on GPU')
+        else:
+            self.__logger.info(f'Reconstructing on CPU with {numba.get_num_threads()} threads')
 
     def getReconstructionSize(self, dataShape, cam_px_size, alpha_rad, dy_step_size, recon_vx_size):
         """Get size of reconstruction, this is just a very ugly temp solution"""
@@ -25,46 +63,45 @@ class Reconstructor:
         camera_offset = 100
 
         """Make coordiate transformation matrix such that sampleCoordinates = M * dataCoordinates"""
-        transformation_mat = cp.array([[cam_px_size * np.sin(alpha_rad), 0, 0],
+        transformation_mat = np.array([[cam_px_size * np.sin(alpha_rad), 0, 0],
                                        [cam_px_size * np.cos(alpha_rad), dy_step_size, 0],
                                        [0, 0, cam_px_size]])
-        voxelize_scale_mat = cp.array(
+        voxelize_scale_mat = np.array(
             [[1 / recon_vx_size, 0, 0], [0, 1 / recon_vx_size, 0], [0, 0, 1 / recon_vx_size]])
 
-        M = cp.matmul(voxelize_scale_mat, transformation_mat)
+        M = np.matmul(voxelize_scale_mat, transformation_mat)
 
         """Reshape data"""
         permuted_axis = np.array([1, 0, 2])
         size_data = dataShape[permuted_axis]
         """Calculate reconstruction canvas size"""
-        cp_size_data = cp.array(size_data)
-        cp_size_sample = cp.ceil(cp.matmul(M, cp_size_data)).astype(int)
-        size_sample = cp.asnumpy(cp_size_sample)
+        size_sample = np.ceil(np.matmul(M, size_data)).astype(int)
 
         return size_sample
 
-    def simpleDeskew(self, data, cam_px_size, alpha_rad, dy_step_size, recon_vx_size):
-        """Deskew the data in one step transform"""
+    def simpleDeskew(self, data, cam_px_size, alpha_rad, dy_step_size, recon_vx_size, sparse=False):
+        """Deskew the data in one step transform. If sparse, the transform is precomputed as a
+        sparse matrix, with the normalization folded into the weights, and kept for the next
+        timepoints with the same geometry, which are then deskewed by one matrix-vector
+        product each."""
 
         camera_offset = 100
 
         """Make coordiate transformation matrix such that sampleCoordinates = M * dataCoordinates"""
-        transformation_mat = cp.array([[cam_px_size * np.sin(alpha_rad), 0, 0],
+        transformation_mat = np.array([[cam_px_size * np.sin(alpha_rad), 0, 0],
                                        [cam_px_size * np.cos(alpha_rad), dy_step_size, 0],
                                        [0, 0, cam_px_size]])
-        voxelize_scale_mat = cp.array(
+        voxelize_scale_mat = np.array(
             [[1 / recon_vx_size, 0, 0], [0, 1 / recon_vx_size, 0], [0, 0, 1 / recon_vx_size]])
 
-        M = cp.matmul(voxelize_scale_mat, transformation_mat)
+        M = np.matmul(voxelize_scale_mat, transformation_mat)
 
         """Reshape data"""
         permuted_axis = (1, 0, 2)
         data_correct_axes = np.transpose(data, axes=permuted_axis)
         size_data = data_correct_axes.shape
         """Calculate reconstruction canvas size"""
-        cp_size_data = cp.array(size_data)
-        cp_size_sample = cp.ceil(cp.matmul(M, cp_size_data)).astype(int)
-        size_sample = cp.asnumpy(cp_size_sample)
+        size_sample = np.ceil(np.matmul(M, size_data)).astype(int)
 
         interp_size_fac = 1 # 1 means gauss FWHM = distance to nearest datapoint
         x_dist_px = cam_px_size / recon_vx_size  # px size in vx
@@ -78,44 +115,223 @@ class Reconstructor:
         sigma_x = x_dist_px / 2.355
         sigma_z, sigma_y, sigma_x = interp_size_fac * sigma_z, interp_size_fac * sigma_y, interp_size_fac * sigma_x
 
-        free_mem = cuda.current_context().get_memory_info()[0]
+        """Split the data in tiles along x if it does not fit in memory. Each data column only
+        contributes to sample columns within x_halfsize of it, so the core of each tile is exact
+        when the tiles overlap by that much."""
         needed_sample_volumes = 2
-        needed_data_volumes = 1
-        tot_data_elements = needed_sample_volumes*np.prod(size_sample) + needed_data_volumes*np.prod(size_data)
-        f32memusage = 4*tot_data_elements
-        if f32memusage > free_mem:
-            dt = 'float16'
-            print('Low on memory, using 16-bit precision float')
+        needed_data_volumes = 2
+        if self.useGPU:
+            free_mem = cuda.current_context().get_memory_info()[0]
         else:
-            dt = 'float32'
+            free_mem = psutil.virtual_memory().available
+            needed_sample_volumes += numba.get_num_threads()  # Thread local canvases
+        tot_data_elements = (needed_sample_volumes*np.prod(size_sample) +
+                             needed_data_volumes*np.prod(size_data))
+        f32memusage = 4*tot_data_elements
+        max_tile_columns = int(0.8 * free_mem / (f32memusage / size_data[2]))
+        tiles = self._getXTiles(size_data[2], M[2, 2], x_halfsize + 1, max_tile_columns)
+        if len(tiles) > 1:
+            self.__logger.info(f'Low on memory, reconstructing in {len(tiles)} tiles')
+            sparse = False  # The deskew operator would not fit either
+
         """Reconstruct"""
-        threadsperblock = 8
-        blocks_per_grid_z = (size_data[0] + (threadsperblock - 1)) // threadsperblock
-        blocks_per_grid_y = (size_data[1] + (threadsperblock - 1)) // threadsperblock
-        blocks_per_grid_x = (size_data[2] + (threadsperblock - 1)) // threadsperblock
         try:
-            dataOnes = cp.ones(data_correct_axes.shape)
-            invTransfOnes = cp.zeros(size_sample, dtype=dt)
-            gaussDistribTransform[(blocks_per_grid_z, blocks_per_grid_y, blocks_per_grid_x),
-                                  (threadsperblock, threadsperblock, threadsperblock)](dataOnes, invTransfOnes, M, sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize)
-            del dataOnes
-            invTransfOnes = invTransfOnes.clip(0.01)
-            adjustedData = cp.array(data_correct_axes, dtype=dt)
-            adjustedData = cp.subtract(adjustedData, camera_offset).clip(0)
-            recon_canvas = cp.zeros(size_sample, dtype=dt)
-            gaussDistribTransform[(blocks_per_grid_z, blocks_per_grid_y, blocks_per_grid_x),
-                                  (threadsperblock, threadsperblock, threadsperblock)](adjustedData, recon_canvas, M, sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize)
-            reconstructed = cp.asnumpy(cp.divide(recon_canvas, invTransfOnes))
-            del adjustedData
-            del recon_canvas
-            del invTransfOnes
-            mempool.free_all_blocks()
-        except cp.cuda.memory.OutOfMemoryError:
+            reconstructed = np.zeros(size_sample, dtype='float32')
+            for data_start, data_stop, core_start, core_stop in tiles:
+                sample_start = int(round(M[2, 2] * data_start))
+                sample_core_start = int(round(M[2, 2] * core_start))
+                if core_stop == size_data[2]:
+                    sample_core_stop = size_sample[2]
+                else:
+                    sample_core_stop = int(round(M[2, 2] * core_stop))
+                tile_size_sample = (size_sample[0], size_sample[1],
+                                    max(int(np.ceil(M[2, 2] * (data_stop - data_start))),
+                                        sample_core_stop - sample_start))
+                tile_reconstructed = self._deskewVolume(
+                    data_correct_axes[:, :, data_start:data_stop], tile_size_sample, M,
+                    camera_offset, sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize,
+                    sparse
+                )
+                reconstructed[:, :, sample_core_start:sample_core_stop] = tile_reconstructed[
+                    :, :, sample_core_start - sample_start:sample_core_stop - sample_start
+                ]
+        except outOfMemoryErrors:
             print('Out of memory')
             return None
 
         return reconstructed
 
+    def _deskewVolume(self, data, size_sample, M, camera_offset, sigma_z, sigma_y, sigma_x,
+                      z_halfsize, y_halfsize, x_halfsize, sparse=False):
+        xp = self.xp
+        if sparse:
+            operator = self._getDeskewOperator(data.shape, size_sample, M,
+                                               sigma_z, sigma_y, sigma_x,
+                                               z_halfsize, y_halfsize, x_halfsize)
+            if operator is not None:
+                adjustedData = xp.array(data, dtype='float32')
+                adjustedData = xp.subtract(adjustedData, camera_offset).clip(0)
+                reconstructed = (operator @ adjustedData.ravel()).reshape(tuple(size_sample))
+                del adjustedData
+                if self.useGPU:
+                    reconstructed = cp.asnumpy(reconstructed)
+                    mempool.free_all_blocks()
+                return reconstructed
+
+        invTransfOnes = xp.asarray(self._getNormalization(data.shape, size_sample, M,
+                                                          sigma_z, sigma_y, sigma_x,
+                                                          z_halfsize, y_halfsize, x_halfsize))
+        adjustedData = xp.array(data, dtype='float32')
+        adjustedData = xp.subtract(adjustedData, camera_offset).clip(0)
+        recon_canvas = xp.zeros(size_sample, dtype='float32')
+        self._gaussDistribTransform(adjustedData, recon_canvas, M, sigma_z, sigma_y, sigma_x,
+                                    z_halfsize, y_halfsize, x_halfsize)
+        reconstructed = xp.divide(recon_canvas, invTransfOnes)
+        if self.useGPU:
+            reconstructed = cp.asnumpy(reconstructed)
+        del adjustedData
+        del recon_canvas
+        del invTransfOnes
+        if self.useGPU:
+            mempool.free_all_blocks()
+
+        return reconstructed
+
+    def _getNormalization(self, data_shape, size_sample, M, sigma_z, sigma_y, sigma_x,
+                          z_halfsize, y_halfsize, x_halfsize):
+        """ Transform of ones, clipped to avoid dividing by zero. It only depends on the
+        geometry, so it is kept for the last few geometries (on the host) instead of being
+        recalculated for every timepoint. """
+        key = (tuple(data_shape), tuple(int(s) for s in size_sample), M.tobytes(),
+               sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize)
+        if key in self._normalizationCache:
+            self._normalizationCache.move_to_end(key)
+            return self._normalizationCache[key]
+
+        xp = self.xp
+        dataOnes = xp.ones(data_shape, dtype='float32')
+        invTransfOnes = xp.zeros(size_sample, dtype='float32')
+        self._gaussDistribTransform(dataOnes, invTransfOnes, M, sigma_z, sigma_y, sigma_x,
+                                    z_halfsize, y_halfsize, x_halfsize)
+        del dataOnes
+        invTransfOnes = invTransfOnes.clip(0.01)
+        if self.useGPU:
+            invTransfOnes = cp.asnumpy(invTransfOnes)
+
+        self._normalizationCache[key] = invTransfOnes
+        while len(self._normalizationCache) > self._normalizationCacheSize:
+            self._normalizationCache.popitem(last=False)
+        return invTransfOnes
+
+    def _getDeskewOperator(self, data_shape, size_sample, M, sigma_z, sigma_y, sigma_x,
+                           z_halfsize, y_halfsize, x_halfsize):
+        """ Sparse matrix (CSR) that maps the flattened data to the flattened reconstruction like
+        _gaussDistribTransform followed by the normalization. Each row holds the gaussian weights
+        of the data voxels that contribute to one sample voxel, divided by their sum, so a
+        timepoint is deskewed by a single matrix-vector product without atomic adds. It only
+        depends on the geometry and is kept (on the device when using the GPU) for the last
+        geometry. None is returned, and kept, if the matrix does not fit in memory. """
+        size_sample = tuple(int(s) for s in size_sample)
+        key = (tuple(data_shape), size_sample, M.tobytes(),
+               sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize)
+        if key in self._deskewOperatorCache:
+            return self._deskewOperatorCache[key]
+        # Free the memory of the previous operator first
+        self._deskewOperatorCache.clear()
+        if self.useGPU:
+            mempool.free_all_blocks()
+
+        nr_data = int(np.prod(data_shape))
+        nr_sample = int(np.prod(size_sample))
+        max_nnz = nr_data * (2 * z_halfsize + 1) * (2 * y_halfsize + 1) * (2 * x_halfsize + 1)
+        index_bytes = 4 if max(max_nnz, nr_sample, nr_data) < 2 ** 31 else 8
+        operator_bytes = max_nnz * (4 + index_bytes) + (nr_sample + 1) * index_bytes
+        # While building, the weights of all neighbours and the matrix in CSC format are also
+        # held in host memory
+        build_bytes = 3 * operator_bytes
+        if (build_bytes > 0.8 * psutil.virtual_memory().available or
+                (self.useGPU and operator_bytes > 0.5 * cp.cuda.runtime.memGetInfo()[0])):
+            self.__logger.warning(f'Deskew operator of {operator_bytes / 1024 ** 3:.1f} GB does not'
+                                  f' fit in memory, deskewing without it')
+            self._deskewOperatorCache[key] = None  # Don't try again for every timepoint
+            return None
+
+        """Weights of the data voxels (columns) that each sample voxel (row) gathers"""
+        nr_neighbours = max_nnz // nr_data
+        index_dtype = np.int32 if index_bytes == 4 else np.int64
+        sample_indices = np.empty(max_nnz, dtype=index_dtype)
+        weights = np.empty(max_nnz, dtype=np.float32)
+        cpu_kernels.gaussDistribWeights(np.array(data_shape), np.array(size_sample), M,
+                                        sigma_z, sigma_y, sigma_x,
+                                        z_halfsize, y_halfsize, x_halfsize,
+                                        sample_indices, weights)
+        valid = sample_indices >= 0
+        col_ptr = np.zeros(nr_data + 1, dtype=index_dtype)
+        np.cumsum(valid.reshape(nr_data, nr_neighbours).sum(axis=1), out=col_ptr[1:])
+        operator = scipy.sparse.csc_matrix((weights[valid], sample_indices[valid], col_ptr),
+                                           shape=(nr_sample, nr_data)).tocsr()
+        del sample_indices, weights, valid, col_ptr
+
+        """Fold the normalization (transform of ones, clipped) into the weights"""
+        normalization = np.asarray(operator.sum(axis=1)).ravel().clip(0.01)
+        operator.data /= np.repeat(normalization, np.diff(operator.indptr)).astype(np.float32)
+
+        if self.useGPU:
+            operator = cupyx.scipy.sparse.csr_matrix(operator)
+        self.__logger.debug(f'Built deskew operator with {operator.nnz} weights')
+
+        self._deskewOperatorCache[key] = operator
+        return operator
+
+    def _getXTiles(self, nr_columns, scale, overlap, max_tile_columns):
+        """Split the data columns along x in tiles of at most max_tile_columns, overlapping by at
+        least overlap sample voxels on each side. Tile borders are placed on data columns that map
+        exactly onto a sample voxel if possible. Returns list of (data_start, data_stop, core_start,
+        core_stop) in data columns."""
+        if max_tile_columns >= nr_columns:
+            return [(0, nr_columns, 0, nr_columns)]
+
+        fraction = Fraction(float(scale)).limit_denominator(int(nr_columns))
+        alignment = fraction.denominator if abs(float(fraction) - scale) < 1e-9 else 1
+        overlap_columns = int(np.ceil(np.ceil(overlap / scale) / alignment) * alignment)
+        core_columns = (max_tile_columns - 2 * overlap_columns) // alignment * alignment
+        if core_columns < alignment and alignment > 1:
+            self.__logger.warning('Tile borders can not be aligned to sample grid, tiles may be'
+                                  ' shifted by up to half a voxel')
+            alignment = 1
+            overlap_columns = int(np.ceil(overlap / scale))
+            core_columns = max_tile_columns - 2 * overlap_columns
+        if core_columns < 1:
+            raise MemoryError('Not enough memory for a single tile')
+        nr_tiles = int(np.ceil(nr_columns / core_columns))
+        core_columns = int(np.ceil(nr_columns / nr_tiles / alignment) * alignment)
+
+        tiles = []
+        for core_start in range(0, nr_columns, core_columns):
+            core_stop = min(core_start + core_columns, nr_columns)
+            tiles.append((max(core_start - overlap_columns, 0),
+                          min(core_stop + overlap_columns, nr_columns),
+                          core_start, core_stop))
+
+        return tiles
+
+    def _gaussDistribTransform(self, dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x,
+                               z_halfsize, y_halfsize, x_halfsize):
+        if self.useGPU:
+            threadsperblock = 8
+            blocks_per_grid_z = (dataStack.shape[0] + (threadsperblock - 1)) // threadsperblock
+            blocks_per_grid_y = (dataStack.shape[1] + (threadsperblock - 1)) // threadsperblock
+            blocks_per_grid_x = (dataStack.shape[2] + (threadsperblock - 1)) // threadsperblock
+            gpu_kernels.gaussDistribTransform[
+                (blocks_per_grid_z, blocks_per_grid_y, blocks_per_grid_x),
+                (threadsperblock, threadsperblock, threadsperblock)
+            ](dataStack, sampleVol, cp.array(transformMat), sigma_z, sigma_y, sigma_x,
+              z_halfsize, y_halfsize, x_halfsize)
+        else:
+            cpu_kernels.gaussDistribTransform(dataStack, sampleVol, transformMat,
+                                              sigma_z, sigma_y, sigma_x,
+                                              z_halfsize, y_halfsize, x_halfsize)
+
 
 # Copyright (C) 2020-2021 ImSwitch developers
 # This file is part of ImSwitch.
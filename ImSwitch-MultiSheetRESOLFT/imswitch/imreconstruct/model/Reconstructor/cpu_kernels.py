@@ -0,0 +1,318 @@
+import math
+import numpy as np
+import numba
+from numba import prange
+
+"""CPU versions of the transforms in gpu_kernels, giving the same results. The functions are
+called directly, without launch configuration. Transforms that distribute data values to the
+sample volume (scatter) would need atomic operations when parallelized, instead the data stack is
+split into as many chunks as there are threads, each chunk is distributed into its own copy of the
+sample volume and the copies are summed at the end. Note that this needs one sample volume of
+memory per thread."""
+
+
+@numba.njit(parallel=True)
+def _reduceBuffers(buffers, sampleVol):
+    """Add the thread local sample volumes to the sample volume"""
+    for z in prange(sampleVol.shape[0]):
+        for c in range(buffers.shape[0]):
+            sampleVol[z] += buffers[c, z]
+
+
+@numba.njit
+def _nrOfChunks(dataStack):
+    return min(numba.get_num_threads(), dataStack.shape[0])
+
+
+@numba.njit(parallel=True)
+def gaussDistribTransform(dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x,
+                          z_halfsize, y_halfsize, x_halfsize):
+    """Distribute the values in the data stack to the sample canvas with gaussian weights around
+    the nearest voxel"""
+    nChunks = _nrOfChunks(dataStack)
+    buffers = np.zeros((nChunks,) + sampleVol.shape, dtype=sampleVol.dtype)
+    for c in prange(nChunks):
+        for idz in range(c, dataStack.shape[0], nChunks):
+            for idy in range(dataStack.shape[1]):
+                for idx in range(dataStack.shape[2]):
+                    sampleCoords_z = (transformMat[0, 0] * idz + transformMat[0, 1] * idy +
+                                      transformMat[0, 2] * idx)
+                    sampleCoords_y = (transformMat[1, 0] * idz + transformMat[1, 1] * idy +
+                                      transformMat[1, 2] * idx)
+                    sampleCoords_x = (transformMat[2, 0] * idz + transformMat[2, 1] * idy +
+                                      transformMat[2, 2] * idx)
+
+                    # Round to nearest and cast to int
+                    sampleIndex_z = int(round(sampleCoords_z))
+                    sampleIndex_y = int(round(sampleCoords_y))
+                    sampleIndex_x = int(round(sampleCoords_x))
+
+                    dataValue = dataStack[idz, idy, idx]
+
+                    for index_z in range(sampleIndex_z - z_halfsize,
+                                         sampleIndex_z + z_halfsize + 1):
+                        for index_y in range(sampleIndex_y - y_halfsize,
+                                             sampleIndex_y + y_halfsize + 1):
+                            for index_x in range(sampleIndex_x - x_halfsize,
+                                                 sampleIndex_x + x_halfsize + 1):
+                                if (0 <= index_z < sampleVol.shape[0] and
+                                        0 <= index_y < sampleVol.shape[1] and
+                                        0 <= index_x < sampleVol.shape[2]):
+                                    dz = float(index_z) - sampleCoords_z
+                                    dy = float(index_y) - sampleCoords_y
+                                    dx = float(index_x) - sampleCoords_x
+                                    scaleFac = math.exp(-((dz**2 / (2*sigma_z**2)) +
+                                                          (dy**2 / (2*sigma_y**2)) +
+                                                          (dx**2 / (2*sigma_x**2))))
+                                    buffers[c, index_z, index_y, index_x] += scaleFac*dataValue
+    _reduceBuffers(buffers, sampleVol)
+
+
+@numba.njit(parallel=True)
+def gaussDistribWeights(dataShape, sampleShape, transformMat, sigma_z, sigma_y, sigma_x,
+                        z_halfsize, y_halfsize, x_halfsize, sampleIndices, weights):
+    """The (flattened) sample voxels and weights that gaussDistribTransform distributes each data
+    voxel to, the neighbours of data voxel i in elements i * nrNeighbours to
+    (i + 1) * nrNeighbours. Neighbours outside the sample volume get sample index -1."""
+    nrNeighbours = (2 * z_halfsize + 1) * (2 * y_halfsize + 1) * (2 * x_halfsize + 1)
+    for idz in prange(dataShape[0]):
+        for idy in range(dataShape[1]):
+            for idx in range(dataShape[2]):
+                sampleCoords_z = (transformMat[0, 0] * idz + transformMat[0, 1] * idy +
+                                  transformMat[0, 2] * idx)
+                sampleCoords_y = (transformMat[1, 0] * idz + transformMat[1, 1] * idy +
+                                  transformMat[1, 2] * idx)
+                sampleCoords_x = (transformMat[2, 0] * idz + transformMat[2, 1] * idy +
+                                  transformMat[2, 2] * idx)
+
+                # Round to nearest and cast to int
+                sampleIndex_z = int(round(sampleCoords_z))
+                sampleIndex_y = int(round(sampleCoords_y))
+                sampleIndex_x = int(round(sampleCoords_x))
+
+                i = ((idz * dataShape[1] + idy) * dataShape[2] + idx) * nrNeighbours
+                for index_z in range(sampleIndex_z - z_halfsize, sampleIndex_z + z_halfsize + 1):
+                    for index_y in range(sampleIndex_y - y_halfsize,
+                                         sampleIndex_y + y_halfsize + 1):
+                        for index_x in range(sampleIndex_x - x_halfsize,
+                                             sampleIndex_x + x_halfsize + 1):
+                            if (0 <= index_z < sampleShape[0] and 0 <= index_y < sampleShape[1] and
+                                    0 <= index_x < sampleShape[2]):
+                                dz = float(index_z) - sampleCoords_z
+                                dy = float(index_y) - sampleCoords_y
+                                dx = float(index_x) - sampleCoords_x
+                                weights[i] = math.exp(-((dz**2 / (2*sigma_z**2)) +
+                                                        (dy**2 / (2*sigma_y**2)) +
+                                                        (dx**2 / (2*sigma_x**2))))
+                                sampleIndices[i] = ((index_z * sampleShape[1] + index_y) *
+                                                    sampleShape[2] + index_x)
+                            else:
+                                weights[i] = 0
+                                sampleIndices[i] = -1
+                            i += 1
+
+
+"""Forward model"""
+
+
+@numba.njit(parallel=True)
+def convTransform(dataStack, sampleVol, kernel, transformMat):
+    """Retrieve the value from the sample guess as if a convolution with the kernel was performed
+    first"""
+    volume_size = kernel.shape
+    for idz in prange(dataStack.shape[0]):
+        for idy in range(dataStack.shape[1]):
+            for idx in range(dataStack.shape[2]):
+                sampleCoords_z = (transformMat[0, 0] * idz + transformMat[0, 1] * idy +
+                                  transformMat[0, 2] * idx)
+                sampleCoords_y = (transformMat[1, 0] * idz + transformMat[1, 1] * idy +
+                                  transformMat[1, 2] * idx)
+                sampleCoords_x = (transformMat[2, 0] * idz + transformMat[2, 1] * idy +
+                                  transformMat[2, 2] * idx)
+
+                # Round to nearest and cast to int
+                sampleIndex_z = int(round(sampleCoords_z))
+                sampleIndex_y = int(round(sampleCoords_y))
+                sampleIndex_x = int(round(sampleCoords_x))
+
+                finalValue = 0.0
+                for zk in range(0, volume_size[0]):
+                    z = sampleIndex_z + zk - (volume_size[0] // 2)
+                    for yk in range(0, volume_size[1]):
+                        y = sampleIndex_y + yk - (volume_size[1] // 2)
+                        for xk in range(0, volume_size[2]):
+                            x = sampleIndex_x + xk - (volume_size[2] // 2)
+                            if (0 <= z < sampleVol.shape[0] and 0 <= y < sampleVol.shape[1] and
+                                    0 <= x < sampleVol.shape[2]):
+                                # Flipping in convolution
+                                finalValue += sampleVol[z, y, x] * kernel[volume_size[0]-zk-1,
+                                                                          volume_size[1]-yk-1,
+                                                                          volume_size[2]-xk-1]
+                dataStack[idz, idy, idx] = finalValue
+
+
+@numba.njit(parallel=True)
+def NNTransform(dataStack, sampleVol, transformMat):
+    """Retrieve the nearest neighbour value from the sample volume and place in the data stack"""
+    for idz in prange(dataStack.shape[0]):
+        for idy in range(dataStack.shape[1]):
+            for idx in range(dataStack.shape[2]):
+                sampleCoords_z = (transformMat[0, 0] * idz + transformMat[0, 1] * idy +
+                                  transformMat[0, 2] * idx)
+                sampleCoords_y = (transformMat[1, 0] * idz + transformMat[1, 1] * idy +
+                                  transformMat[1, 2] * idx)
+                sampleCoords_x = (transformMat[2, 0] * idz + transformMat[2, 1] * idy +
+                                  transformMat[2, 2] * idx)
+
+                # Round to nearest and cast to int
+                sampleIndex_z = int(round(sampleCoords_z))
+                sampleIndex_y = int(round(sampleCoords_y))
+                sampleIndex_x = int(round(sampleCoords_x))
+
+                if (0 <= sampleIndex_z < sampleVol.shape[0] and
+                        0 <= sampleIndex_y < sampleVol.shape[1] and
+                        0 <= sampleIndex_x < sampleVol.shape[2]):
+                    dataStack[idz, idy, idx] = sampleVol[sampleIndex_z, sampleIndex_y,
+                                                         sampleIndex_x]
+                else:
+                    dataStack[idz, idy, idx] = 0
+
+
+"""Inverse model"""
+
+
+@numba.njit(parallel=True)
+def invNNTransform(dataStack, sampleVol, transformMat):
+    """Distribute the values in the data stack back to the sample canvas in the nearest neighbour
+    voxel"""
+    nChunks = _nrOfChunks(dataStack)
+    buffers = np.zeros((nChunks,) + sampleVol.shape, dtype=sampleVol.dtype)
+    for c in prange(nChunks):
+        for idz in range(c, dataStack.shape[0], nChunks):
+            for idy in range(dataStack.shape[1]):
+                for idx in range(dataStack.shape[2]):
+                    sampleCoords_z = (transformMat[0, 0] * idz + transformMat[0, 1] * idy +
+                                      transformMat[0, 2] * idx)
+                    sampleCoords_y = (transformMat[1, 0] * idz + transformMat[1, 1] * idy +
+                                      transformMat[1, 2] * idx)
+                    sampleCoords_x = (transformMat[2, 0] * idz + transformMat[2, 1] * idy +
+                                      transformMat[2, 2] * idx)
+
+                    # Round to nearest and cast to int
+                    sampleIndex_z = int(round(sampleCoords_z))
+                    sampleIndex_y = int(round(sampleCoords_y))
+                    sampleIndex_x = int(round(sampleCoords_x))
+
+                    if (0 <= sampleIndex_z < sampleVol.shape[0] and
+                            0 <= sampleIndex_y < sampleVol.shape[1] and
+                            0 <= sampleIndex_x < sampleVol.shape[2]):
+                        buffers[c, sampleIndex_z, sampleIndex_y, sampleIndex_x] += \
+                            dataStack[idz, idy, idx]
+    _reduceBuffers(buffers, sampleVol)
+
+
+@numba.njit(parallel=True)
+def invConvTransform(dataStack, sampleVol, kernel, transformMat):
+    """Distribute the values in the data stack back to the sample canvas according to the kernel
+    values"""
+    volume_size = kernel.shape
+    nChunks = _nrOfChunks(dataStack)
+    buffers = np.zeros((nChunks,) + sampleVol.shape, dtype=sampleVol.dtype)
+    for c in prange(nChunks):
+        for idz in range(c, dataStack.shape[0], nChunks):
+            for idy in range(dataStack.shape[1]):
+                for idx in range(dataStack.shape[2]):
+                    sampleCoords_z = (transformMat[0, 0] * idz + transformMat[0, 1] * idy +
+                                      transformMat[0, 2] * idx)
+                    sampleCoords_y = (transformMat[1, 0] * idz + transformMat[1, 1] * idy +
+                                      transformMat[1, 2] * idx)
+                    sampleCoords_x = (transformMat[2, 0] * idz + transformMat[2, 1] * idy +
+                                      transformMat[2, 2] * idx)
+
+                    # Round to nearest and cast to int
+                    sampleIndex_z = int(round(sampleCoords_z))
+                    sampleIndex_y = int(round(sampleCoords_y))
+                    sampleIndex_x = int(round(sampleCoords_x))
+
+                    dataValue = dataStack[idz, idy, idx]
+                    for zk in range(0, volume_size[0]):
+                        z = sampleIndex_z + zk - (volume_size[0] // 2)
+                        for yk in range(0, volume_size[1]):
+                            y = sampleIndex_y + yk - (volume_size[1] // 2)
+                            for xk in range(0, volume_size[2]):
+                                x = sampleIndex_x + xk - (volume_size[2] // 2)
+                                if (0 <= z < sampleVol.shape[0] and 0 <= y < sampleVol.shape[1] and
+                                        0 <= x < sampleVol.shape[2]):
+                                    buffers[c, z, y, x] += dataValue * kernel[volume_size[0]-zk-1,
+                                                                              volume_size[1]-yk-1,
+                                                                              volume_size[2]-xk-1]
+    _reduceBuffers(buffers, sampleVol)
+
+
+@numba.njit
+def _dataIndexRange(m0, m1, m2, lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, axisSize):
+    """Range of data indices along one data axis that can be rounded into the sample index box
+    [lo, hi] (inclusive), m0, m1, m2 is the row of the inverse transform matrix belonging to the
+    data axis"""
+    dMin = (min(m0 * (lo_z - 0.5), m0 * (hi_z + 0.5)) +
+            min(m1 * (lo_y - 0.5), m1 * (hi_y + 0.5)) +
+            min(m2 * (lo_x - 0.5), m2 * (hi_x + 0.5)))
+    dMax = (max(m0 * (lo_z - 0.5), m0 * (hi_z + 0.5)) +
+            max(m1 * (lo_y - 0.5), m1 * (hi_y + 0.5)) +
+            max(m2 * (lo_x - 0.5), m2 * (hi_x + 0.5)))
+    start = max(int(math.floor(dMin)), 0)
+    stop = min(int(math.ceil(dMax)) + 1, axisSize)
+    return start, stop
+
+
+@numba.njit(parallel=True)
+def invConvTransformGather(dataStack, sampleVol, kernel, transformMat, invTransformMat):
+    """Same result as invConvTransform but formulated as a gather, see the GPU version. Each
+    sample voxel is only written by one thread, so no thread local buffers are needed.
+    NOTE: The sample canvas is overwritten, not added to as in invConvTransform."""
+    volume_size = kernel.shape
+    for idz in prange(sampleVol.shape[0]):
+        for idy in range(sampleVol.shape[1]):
+            for idx in range(sampleVol.shape[2]):
+                lo_z = idz - (volume_size[0] - 1 - volume_size[0] // 2)
+                hi_z = idz + volume_size[0] // 2
+                lo_y = idy - (volume_size[1] - 1 - volume_size[1] // 2)
+                hi_y = idy + volume_size[1] // 2
+                lo_x = idx - (volume_size[2] - 1 - volume_size[2] // 2)
+                hi_x = idx + volume_size[2] // 2
+
+                start_dz, stop_dz = _dataIndexRange(
+                    invTransformMat[0, 0], invTransformMat[0, 1], invTransformMat[0, 2],
+                    lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[0]
+                )
+                start_dy, stop_dy = _dataIndexRange(
+                    invTransformMat[1, 0], invTransformMat[1, 1], invTransformMat[1, 2],
+                    lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[1]
+                )
+                start_dx, stop_dx = _dataIndexRange(
+                    invTransformMat[2, 0], invTransformMat[2, 1], invTransformMat[2, 2],
+                    lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[2]
+                )
+
+                finalValue = 0.0
+                for dz in range(start_dz, stop_dz):
+                    for dy in range(start_dy, stop_dy):
+                        for dx in range(start_dx, stop_dx):
+                            sampleCoords_z = (transformMat[0, 0] * dz + transformMat[0, 1] * dy +
+                                              transformMat[0, 2] * dx)
+                            sampleCoords_y = (transformMat[1, 0] * dz + transformMat[1, 1] * dy +
+                                              transformMat[1, 2] * dx)
+                            sampleCoords_x = (transformMat[2, 0] * dz + transformMat[2, 1] * dy +
+                                              transformMat[2, 2] * dx)
+                            sampleIndex_z = int(round(sampleCoords_z))
+                            sampleIndex_y = int(round(sampleCoords_y))
+                            sampleIndex_x = int(round(sampleCoords_x))
+                            if (lo_z <= sampleIndex_z <= hi_z and lo_y <= sampleIndex_y <= hi_y and
+                                    lo_x <= sampleIndex_x <= hi_x):
+                                zk = idz - sampleIndex_z + volume_size[0] // 2
+                                yk = idy - sampleIndex_y + volume_size[1] // 2
+                                xk = idx - sampleIndex_x + volume_size[2] // 2
+                                finalValue += dataStack[dz, dy, dx] * kernel[volume_size[0]-zk-1,
+                                                                             volume_size[1]-yk-1,
+                                                                             volume_size[2]-xk-1]
+                sampleVol[idz, idy, idx] = finalValue
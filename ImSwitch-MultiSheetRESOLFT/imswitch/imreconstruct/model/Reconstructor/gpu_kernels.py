@@ -62,6 +62,76 @@ def invConvTransform(dataStack, sampleVol, kernel, transformMat):
                         value = dataValue * kernel[-zk-1, -yk-1, -xk-1]
                         cuda.atomic.add(sampleVol, (z, y, x), value)
 
+
+@cuda.jit(device=True)
+def _dataIndexRange(m0, m1, m2, lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, axisSize):
+    """Range of data indices along one data axis that can be rounded into the sample index box
+    [lo, hi] (inclusive), m0, m1, m2 is the row of the inverse transform matrix belonging to the
+    data axis"""
+    dMin = (min(m0 * (lo_z - 0.5), m0 * (hi_z + 0.5)) +
+            min(m1 * (lo_y - 0.5), m1 * (hi_y + 0.5)) +
+            min(m2 * (lo_x - 0.5), m2 * (hi_x + 0.5)))
+    dMax = (max(m0 * (lo_z - 0.5), m0 * (hi_z + 0.5)) +
+            max(m1 * (lo_y - 0.5), m1 * (hi_y + 0.5)) +
+            max(m2 * (lo_x - 0.5), m2 * (hi_x + 0.5)))
+    start = max(int(math.floor(dMin)), 0)
+    stop = min(int(math.ceil(dMax)) + 1, axisSize)
+    return start, stop
+
+
+@cuda.jit
+def invConvTransformGather(dataStack, sampleVol, kernel, transformMat, invTransformMat):
+    """Same result as invConvTransform but formulated as a gather, each thread computes one sample
+    voxel by collecting the values from the data voxels whose nearest sample index falls within
+    reach of the kernel. Candidate data voxels are found using the inverse transform matrix, which
+    removes the need for atomicAdd operations.
+    NOTE: The sample canvas is overwritten, not added to as in invConvTransform."""
+    idz, idy, idx = cuda.grid(3)
+    if idz < sampleVol.shape[0] and idy < sampleVol.shape[1] and idx < sampleVol.shape[2]:
+        volume_size = kernel.shape
+        # A data voxel with nearest sample index s reaches sample voxels s - K//2 to
+        # s + K - 1 - K//2, so the sample indices that reach this voxel lie in the box [lo, hi]
+        lo_z = idz - (volume_size[0] - 1 - volume_size[0] // 2)
+        hi_z = idz + volume_size[0] // 2
+        lo_y = idy - (volume_size[1] - 1 - volume_size[1] // 2)
+        hi_y = idy + volume_size[1] // 2
+        lo_x = idx - (volume_size[2] - 1 - volume_size[2] // 2)
+        hi_x = idx + volume_size[2] // 2
+
+        start_z, stop_z = _dataIndexRange(
+            invTransformMat[0, 0], invTransformMat[0, 1], invTransformMat[0, 2],
+            lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[0]
+        )
+        start_y, stop_y = _dataIndexRange(
+            invTransformMat[1, 0], invTransformMat[1, 1], invTransformMat[1, 2],
+            lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[1]
+        )
+        start_x, stop_x = _dataIndexRange(
+            invTransformMat[2, 0], invTransformMat[2, 1], invTransformMat[2, 2],
+            lo_z, hi_z, lo_y, hi_y, lo_x, hi_x, dataStack.shape[2]
+        )
+
+        finalValue = 0.
+        for dz in range(start_z, stop_z):
+            for dy in range(start_y, stop_y):
+                for dx in range(start_x, stop_x):
+                    # Same rounding as in the forward model to get the identical nearest
+                    # sample index
+                    sampleIndex_z = int(round(transformMat[0, 0] * dz + transformMat[0, 1] * dy +
+                                              transformMat[0, 2] * dx))
+                    sampleIndex_y = int(round(transformMat[1, 0] * dz + transformMat[1, 1] * dy +
+                                              transformMat[1, 2] * dx))
+                    sampleIndex_x = int(round(transformMat[2, 0] * dz + transformMat[2, 1] * dy +
+                                              transformMat[2, 2] * dx))
+                    if (lo_z <= sampleIndex_z <= hi_z and lo_y <= sampleIndex_y <= hi_y and
+                            lo_x <= sampleIndex_x <= hi_x):
+                        zk = idz - sampleIndex_z + (volume_size[0] // 2)
+                        yk = idy - sampleIndex_y + (volume_size[1] // 2)
+                        xk = idx - sampleIndex_x + (volume_size[2] // 2)
+                        finalValue += dataStack[dz, dy, dx] * kernel[-zk-1, -yk-1, -xk-1]
+        sampleVol[idz, idy, idx] = finalValue
+
+
 @cuda.jit
 def gaussDistribTransform(dataStack, sampleVol, transformMat, sigma_z, sigma_y, sigma_x, z_halfsize, y_halfsize, x_halfsize):
     """Distribute the values in the data stack back to the sample canvas in the nearest neighbour voxel"""
@@ -88,4 +158,4 @@ def gaussDistribTransform(dataStack, sampleVol, transformMat, sigma_z, sigma_y,
                     if 0 <= index_z < sampleVol.shape[0] and 0 <= index_y < sampleVol.shape[
                         1] and 0 <= index_x < \
                             sampleVol.shape[2]:
-                        cuda.atomic.add(sampleVol, (index_z, index_y, index_x), scaleFac*dataValue)
\ No newline at end of file
+                        cuda.atomic.add(sampleVol, (index_z, index_y, index_x), scaleFac*dataValue)
@@ -1,4 +1,5 @@
 from .DataObj import DataObj
 from .PatternFinder import PatternFinder
 from .ReconObj import ReconObj
+from .ReconstructionQueue import ReconstructionParameters, ReconstructionQueue
 from .Reconstructor import Reconstructor
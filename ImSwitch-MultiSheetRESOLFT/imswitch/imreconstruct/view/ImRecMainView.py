@@ -23,6 +23,7 @@ class ImRecMainView(QtWidgets.QMainWindow):
     sigReconstuctCurrent = QtCore.Signal()
     sigReconstructMultiConsolidated = QtCore.Signal()
     sigReconstructMultiIndividual = QtCore.Signal()
+    sigCancelReconstructions = QtCore.Signal()
     sigQuickLoadData = QtCore.Signal()
     sigUpdate = QtCore.Signal()
 
@@ -79,12 +80,14 @@ class ImRecMainView(QtWidgets.QMainWindow):
         self.multiDataFrame = MultiDataFrame()
 
         btnFrame = BtnFrame()
+        btnFrame.sigCancelReconstructions.connect(self.sigCancelReconstructions)
         btnFrame.sigReconstuctCurrent.connect(self.sigReconstuctCurrent)
         btnFrame.sigReconstructMultiConsolidated.connect(self.sigReconstructMultiConsolidated)
         btnFrame.sigReconstructMultiIndividual.connect(self.sigReconstructMultiIndividual)
         btnFrame.sigQuickLoadData.connect(self.sigQuickLoadData)
         btnFrame.sigUpdate.connect(self.sigUpdate)
 
+        self.btnFrame = btnFrame
         self.reconstructionWidget = ReconstructionView()
 
         self.parTree = ReconParTree()
@@ -149,6 +152,9 @@ class ImRecMainView(QtWidgets.QMainWindow):
     def addNewReconstruction(self, reconObj, name):
         self.reconstructionWidget.addNewData(reconObj, name)
 
+    def setReconstructionProgress(self, numJobs, numReconstructed, numTimepoints):
+        self.btnFrame.setReconstructionProgress(numJobs, numReconstructed, numTimepoints)
+
     def getMultiDatas(self):
         dataList = self.multiDataFrame.dataList
         for i in range(dataList.count()):
@@ -201,6 +207,9 @@ class ImRecMainView(QtWidgets.QMainWindow):
 
     def getAverageTimepointsBool(self):
         return self.parTree.p.param('Reconstruction options').param('Average timepoints').value()
+
+    def getSparseDeskewBool(self):
+        return self.parTree.p.param('Reconstruction options').param('Precompute deskew operator').value()
     def getAutoReconstructNewDataBool(self):
         return self.parTree.p.param('Autoreconstruct data from module').value()
 
@@ -229,7 +238,8 @@ class ReconParTree(ParameterTree):
                  'suffix': 'nm'},
                 {'name': 'Bleaching correction', 'type': 'bool'},
                 {'name': 'Restack before deskewing', 'type': 'bool'},
-                {'name': 'Average timepoints', 'type': 'bool'}]},
+                {'name': 'Average timepoints', 'type': 'bool'},
+                {'name': 'Precompute deskew operator', 'type': 'bool'}]},
             {'name': 'Autoreconstruct data from module', 'type': 'bool'}]
 
         self.p = Parameter.create(name='params', type='group', children=params)
@@ -241,6 +251,7 @@ class BtnFrame(QtWidgets.QFrame):
     sigReconstuctCurrent = QtCore.Signal()
     sigReconstructMultiConsolidated = QtCore.Signal()
     sigReconstructMultiIndividual = QtCore.Signal()
+    sigCancelReconstructions = QtCore.Signal()
     sigQuickLoadData = QtCore.Signal()
     sigUpdate = QtCore.Signal()
 
@@ -267,14 +278,33 @@ class BtnFrame(QtWidgets.QFrame):
         self.reconMultiIndividual.triggered.connect(self.sigReconstructMultiIndividual)
         self.reconMultiBtn.addAction(self.reconMultiIndividual)
 
+        self.reconProgressBar = QtWidgets.QProgressBar()
+        self.reconProgressBar.setTextVisible(True)
+        self.cancelReconBtn = BetterPushButton('Cancel')
+        self.cancelReconBtn.setToolTip('Cancel the running and queued reconstructions')
+        self.cancelReconBtn.clicked.connect(self.sigCancelReconstructions)
+
         layout = QtWidgets.QGridLayout()
         self.setLayout(layout)
 
         layout.addWidget(self.quickLoadDataBtn, 0, 0, 1, 2)
         layout.addWidget(self.reconCurrBtn, 1, 0, 1, 2)
         layout.addWidget(self.reconMultiBtn, 2, 0, 1, 2)
+        layout.addWidget(self.reconProgressBar, 3, 0)
+        layout.addWidget(self.cancelReconBtn, 3, 1)
         # layout.addWidget(self.updateBtn, 2, 0, 1, 2)
 
+        self.setReconstructionProgress(0, 0, 0)
+
+    def setReconstructionProgress(self, numJobs, numReconstructed, numTimepoints):
+        self.reconProgressBar.setMaximum(max(numTimepoints, 1))
+        self.reconProgressBar.setValue(numReconstructed)
+        if numJobs > 0:
+            self.reconProgressBar.setFormat(f'%v/%m timepoints, {numJobs} reconstruction(s) left')
+        else:
+            self.reconProgressBar.setFormat('No reconstructions running')
+        self.cancelReconBtn.setEnabled(numJobs > 0)
+
 
 # Copyright (C) 2020-2021 ImSwitch developers
 # This file is part of ImSwitch.
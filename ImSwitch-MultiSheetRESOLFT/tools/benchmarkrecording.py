@@ -0,0 +1,290 @@
+""" Benchmarks the recording path with mock Hamamatsu cameras, without any
+hardware. Every combination of the requested recording modes and save modes is
+recorded for a while with DetectorsManager and RecordingManager, and the
+sustained frame rate, dropped frames, write rate, CPU use and frame latency
+percentiles are reported. The latency is the time from the time stamp of a
+frame until the recording thread has read it from the detector.
+
+Example:
+
+    python tools/benchmarkrecording.py --fps 400 --size 2304 --duration 10 \
+        --save-modes Disk --output-folder /data/benchmark
+
+ScanOnce and ScanLapse recordings are recorded like SpecFrames recordings of
+the same length, since no scan is run.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import psutil
+from qtpy import QtCore
+
+from imswitch.imcontrol.model import (
+    DetectorInfo, DetectorsManager, RecordingManager, RecMode, SaveMode
+)
+
+
+def getDetectorInfos(numDetectors, fps, width, height):
+    """ Mock Hamamatsu cameras that produce frames of the given size at the
+    given rate. """
+    return {
+        f'Camera {i + 1}': DetectorInfo(
+            analogChannel=None,
+            digitalLine=None,
+            managerName='HamamatsuManager',
+            managerProperties={
+                'cameraListIndex': 'mock',
+                'hamamatsu': {
+                    'subarray_hpos': 0,
+                    'subarray_vpos': 0,
+                    'subarray_hsize': width,
+                    'subarray_vsize': height,
+                    'image_width': width,
+                    'image_height': height,
+                    'internal_frame_rate': fps
+                }
+            },
+            forAcquisition=True
+        )
+        for i in range(numDetectors)
+    }
+
+
+class LatencyProbe:
+    """ Records the latency of every frame that the recording thread reads
+    from a detector, by wrapping the getChunkWithInfo method of the detector.
+    """
+
+    def __init__(self, detector):
+        self.latencies = []
+        self._getChunkWithInfo = detector.getChunkWithInfo
+        detector.getChunkWithInfo = self.getChunkWithInfo
+
+    def getChunkWithInfo(self):
+        frames, frameNumbers, timestamps = self._getChunkWithInfo()
+        if len(frames) > 0:
+            self.latencies.extend(time.time() - np.asarray(timestamps))
+        return frames, frameNumbers, timestamps
+
+    def reset(self):
+        self.latencies = []
+
+
+class RecordingBenchmark:
+    def __init__(self, app, detectorsManager, outputFolder, duration, liveView):
+        self.app = app
+        self.detectorsManager = detectorsManager
+        self.recordingManager = RecordingManager(detectorsManager)
+        self.outputFolder = outputFolder
+        self.duration = duration
+        self.liveView = liveView
+
+        self.detectorNames = detectorsManager.getAllDeviceNames()
+        self.probes = {detectorName: LatencyProbe(detectorsManager[detectorName])
+                       for detectorName in self.detectorNames}
+
+        self._memoryFiles = []
+        self._numLiveViewImages = 0
+        self.recordingManager.sigMemoryRecordingAvailable.connect(self._memoryRecordingAvailable)
+        self.detectorsManager.sigImageUpdated.connect(self._imageUpdated)
+
+    def run(self, recMode, saveMode, fps):
+        """ Records with the given modes and returns the results as a dict. """
+        savename = os.path.join(self.outputFolder, f'{recMode.name}_{saveMode.name}')
+        recFrames = max(int(round(fps * self.duration)), 1)
+
+        for probe in self.probes.values():
+            probe.reset()
+        self._numLiveViewImages = 0
+
+        lvHandle = None
+        if self.liveView:
+            lvHandle = self.detectorsManager.startAcquisition(liveView=True)
+
+        process = psutil.Process()
+        cpuTimesStart = process.cpu_times()
+        start = time.perf_counter()
+        self.recordingManager.startRecording(
+            detectorNames=self.detectorNames,
+            recMode=recMode,
+            savename=savename,
+            saveMode=saveMode,
+            attrs={detectorName: {} for detectorName in self.detectorNames},
+            singleLapseFile=recMode == RecMode.ScanLapse,
+            recFrames=recFrames,
+            recTime=self.duration
+        )
+        while self.recordingManager.record:
+            if recMode == RecMode.UntilStop and time.perf_counter() - start >= self.duration:
+                self.recordingManager.endRecording(emitSignal=False, wait=False)
+            self.app.processEvents()
+            time.sleep(0.01)
+        self.recordingManager.endRecording(emitSignal=False, wait=True)
+        elapsed = time.perf_counter() - start
+        cpuTimesEnd = process.cpu_times()
+
+        if lvHandle is not None:
+            self.detectorsManager.stopAcquisition(lvHandle, liveView=True)
+        self.app.processEvents()  # Receive memory recordings
+
+        numFrames, droppedFrames, numBytes = self._readRecordings(savename, saveMode)
+        latencies = np.concatenate([probe.latencies for probe in self.probes.values()]) * 1000
+        cpuTime = ((cpuTimesEnd.user - cpuTimesStart.user) +
+                   (cpuTimesEnd.system - cpuTimesStart.system))
+
+        return {
+            'recMode': recMode.name,
+            'saveMode': saveMode.name,
+            'seconds': elapsed,
+            'fps': numFrames / elapsed / len(self.detectorNames),
+            'droppedFrames': droppedFrames,
+            'MBps': numBytes / elapsed / 1024 ** 2,
+            'cpuPercent': cpuTime / elapsed * 100,
+            'latencyMs': dict(zip(['p50', 'p95', 'p99', 'max'],
+                                  np.percentile(latencies, [50, 95, 99, 100])
+                                  if len(latencies) > 0 else [np.nan] * 4)),
+            'liveViewImages': self._numLiveViewImages
+        }
+
+    def close(self):
+        for file in self._memoryFiles:
+            file.close()
+        self._memoryFiles = []
+        self.recordingManager.removeMemoryRecordings()
+
+    def _readRecordings(self, savename, saveMode):
+        """ Returns the number of recorded frames, the number of dropped frames
+        and the number of bytes of recorded frames, summed over the
+        detectors. """
+        if saveMode != SaveMode.Disk:
+            # The disk file of a DiskAndRAM recording is still open as memory recording
+            files = list(self._memoryFiles)
+        else:
+            files = [h5py.File(f'{savename}_{detectorName}.hdf5', 'r')
+                     for detectorName in self.detectorNames]
+
+        numFrames, droppedFrames, numBytes = 0, 0, 0
+        try:
+            for file in files:
+                for datasetName, frameInfo in file['frame_info'].items():
+                    dataset = file[datasetName]
+                    frameNumbers = frameInfo['frame_numbers'][:]
+                    numFrames += len(frameNumbers)
+                    if len(frameNumbers) > 1:
+                        droppedFrames += int(np.sum(np.diff(frameNumbers) - 1))
+                    numBytes += len(frameNumbers) * np.prod(dataset.shape[1:]) * \
+                        dataset.dtype.itemsize
+        finally:
+            if saveMode == SaveMode.Disk:
+                for file in files:
+                    file.close()
+
+        self.close()
+        return numFrames, droppedFrames, numBytes
+
+    def _memoryRecordingAvailable(self, _, file, __, ___):
+        self._memoryFiles.append(file)
+
+    def _imageUpdated(self, *_):
+        self._numLiveViewImages += 1
+
+
+def formatResults(results):
+    lines = [f'{"Rec mode":<11} {"Save mode":<11} {"fps":>8} {"dropped":>8} {"MB/s":>8}'
+             f' {"CPU %":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}'
+             f' {"LV imgs":>8}']
+    for result in results:
+        latency = result['latencyMs']
+        lines.append(f'{result["recMode"]:<11} {result["saveMode"]:<11} {result["fps"]:>8.1f}'
+                     f' {result["droppedFrames"]:>8d} {result["MBps"]:>8.1f}'
+                     f' {result["cpuPercent"]:>7.1f} {latency["p50"]:>8.1f}'
+                     f' {latency["p95"]:>8.1f} {latency["p99"]:>8.1f} {latency["max"]:>8.1f}'
+                     f' {result["liveViewImages"]:>8d}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fps', type=float, default=100,
+                        help='frame rate of every mock camera (default 100)')
+    parser.add_argument('--size', type=int, nargs='+', default=[1024],
+                        help='ROI width and height in pixels, or one value for a square ROI'
+                             ' (default 1024)')
+    parser.add_argument('--num-detectors', type=int, default=1,
+                        help='number of mock cameras recorded at the same time (default 1)')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='length of every recording in seconds (default 5)')
+    parser.add_argument('--rec-modes', nargs='+', default=[mode.name for mode in RecMode],
+                        choices=[mode.name for mode in RecMode],
+                        help='recording modes to benchmark (default all)')
+    parser.add_argument('--save-modes', nargs='+', default=[mode.name for mode in SaveMode],
+                        choices=[mode.name for mode in SaveMode],
+                        help='save modes to benchmark (default all)')
+    parser.add_argument('--live-view', action='store_true',
+                        help='run the live view during the recordings')
+    parser.add_argument('--output-folder', default=None,
+                        help='folder to record to; a temporary folder that is removed'
+                             ' afterwards if not given')
+    args = parser.parse_args()
+
+    width, height = (args.size * 2)[:2]
+    os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+    app = QtCore.QCoreApplication([])
+
+    outputFolder = args.output_folder
+    removeOutputFolder = outputFolder is None
+    if removeOutputFolder:
+        outputFolder = tempfile.mkdtemp(prefix='imswitch_benchmark_')
+    else:
+        os.makedirs(outputFolder, exist_ok=True)
+
+    detectorsManager = DetectorsManager(
+        getDetectorInfos(args.num_detectors, args.fps, width, height), updatePeriod=100
+    )
+    benchmark = RecordingBenchmark(app, detectorsManager, outputFolder, args.duration,
+                                   args.live_view)
+
+    print(f'{args.num_detectors} mock camera(s), {width}x{height} pixels at {args.fps:g} fps,'
+          f' {args.duration:g} s per recording, recording to {outputFolder}')
+    results = []
+    try:
+        for recModeName in args.rec_modes:
+            for saveModeName in args.save_modes:
+                results.append(benchmark.run(RecMode[recModeName], SaveMode[saveModeName],
+                                             args.fps))
+                print(formatResults(results[-1:]).splitlines()[-1], flush=True)
+    finally:
+        benchmark.close()
+        if removeOutputFolder:
+            shutil.rmtree(outputFolder, ignore_errors=True)
+
+    print()
+    print(formatResults(results))
+
+
+if __name__ == '__main__':
+    main()
+
+
+# Copyright (C) 2020-2021 ImSwitch developers
+# This file is part of ImSwitch.
+#
+# ImSwitch is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImSwitch is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.